@@ -0,0 +1,111 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Activity data parser script
+
+import calendar
+import numpy as np
+
+# One record per minute of recorded activity
+ACTIVITY_DTYPE = np.dtype([('time', '<f8'), ('kind', 'u1'), ('intensity', 'u1'), ('steps', 'u1'), ('hr', 'u1')])
+
+def fetch_start_time(data):
+
+    """ Read the time of the first record from the fetch metadata response
+        Format: 0x10 0x01 0x01, record bytes (4), year (2), month, day, hour, minute, second, timezone
+        Returns the time in seconds since epoch, or None if the response has no date
+
+    Arguments:
+    bytes[] data: Response received on the fetch characteristic """
+
+    if len(data) < 14:
+        return None
+
+    fields = [int(b) for b in data[7:15]]
+    year = fields[0] | (fields[1] << 8)
+    start = calendar.timegm((year, fields[2], fields[3], fields[4], fields[5], fields[6]))
+
+    # The timezone is given in quarters of hour
+    if len(data) > 14:
+        timezone = fields[7]
+        start -= (timezone - 256 if timezone > 127 else timezone) * 900
+    return float(start)
+
+# -----------------------------------------------------------------------------
+# Activity Parser Class
+# -----------------------------------------------------------------------------
+
+class ActivityParser(object):
+
+    def __init__(self, sample_size=4, capacity=1440):
+
+        """ Decode activity packets into a structured array
+            Each packet is a sequence number followed by records of sample_size bytes:
+            kind, intensity, steps and heart rate (then sleep data on newer bands)
+
+        Arguments:
+        int   sample_size: Bytes of each record
+        int   capacity: Initial number of records, doubled when full """
+
+        self.sampleSize = sample_size
+        self.records = np.zeros(capacity, dtype=ACTIVITY_DTYPE)
+        self.count = 0
+        self.startTime = 0.0
+        self.minute = 0
+        self.lastNumber = None
+        self.gaps = 0
+
+    def start(self, start_time):
+
+        """ Start a new fetch, whose first record is at start_time
+
+        Arguments:
+        float start_time: Time of the first record in seconds since epoch """
+
+        self.startTime = start_time
+        self.minute = 0
+        self.lastNumber = None
+
+    def feed(self, value):
+
+        """ Decode every record of a packet in one pass
+            Returns the number of records decoded
+
+        Arguments:
+        bytes[] value: Packet received on the activity characteristic """
+
+        data = np.frombuffer(value, dtype=np.uint8)
+        if len(data) < 1 + self.sampleSize:
+            return 0
+
+        if self.lastNumber is not None and data[0] != (self.lastNumber + 1) & 0xff:
+            self.gaps += 1
+        self.lastNumber = int(data[0])
+
+        n = (len(data) - 1) // self.sampleSize
+        samples = data[1:1 + n * self.sampleSize].reshape(n, self.sampleSize)
+
+        if self.count + n > len(self.records):
+            records = np.zeros(max(2 * len(self.records), self.count + n), dtype=ACTIVITY_DTYPE)
+            records[:self.count] = self.records[:self.count]
+            self.records = records
+
+        block = self.records[self.count:self.count + n]
+        block['time'] = self.startTime + (self.minute + np.arange(n)) * 60.0
+        block['kind'] = samples[:, 0]
+        block['intensity'] = samples[:, 1]
+        block['steps'] = samples[:, 2]
+        block['hr'] = samples[:, 3]
+
+        self.count += n
+        self.minute += n
+        return n
+
+    def data(self):
+
+        """ Records decoded so far, as a view of the internal array """
+
+        return self.records[:self.count]
@@ -0,0 +1,237 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Alert delivery script
+
+import atexit
+import json
+import queue
+import threading
+import time
+import urllib.request
+from session import Backoff
+import output
+
+# -----------------------------------------------------------------------------
+# Alert Sinks
+# -----------------------------------------------------------------------------
+
+class FileSink(object):
+
+    def __init__(self, path):
+
+        """ Append every alert to a file as a JSON line
+
+        Arguments:
+        str   path: File where the alerts are written """
+
+        self.path = path
+
+    def send(self, alert):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(alert) + "\n")
+
+class WebhookSink(object):
+
+    def __init__(self, url, timeout=2.0):
+
+        """ POST every alert as JSON to a URL
+
+        Arguments:
+        str   url: Address of the webhook
+        float timeout: Seconds to wait for the answer """
+
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, alert):
+        request = urllib.request.Request(self.url, data=json.dumps(alert).encode(),
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+# -----------------------------------------------------------------------------
+# Alert State Class
+# -----------------------------------------------------------------------------
+
+class AlertState(object):
+
+    def __init__(self, mac_address, cooldown=60.0, clear=5):
+
+        """ Turn the rules that fire on every sample into alerts
+            A rule raises an alert when it starts firing (de-duplication), stops being
+            active after clear samples without firing (hysteresis) and does not
+            raise another alert before cooldown seconds
+
+        Arguments:
+        str   mac_address: MAC address of the band
+        float cooldown: Minimum seconds between two alerts of the same rule
+        int   clear: Samples without firing before a rule can raise a new alert """
+
+        self.macAddress = mac_address
+        self.cooldown = cooldown
+        self.clear = clear
+        self.quiet = {}
+        self.lastAlert = {}
+        self.suppressed = 0
+
+    def update(self, fired, timestamp, value):
+
+        """ Register the rules that fired on a sample
+            Returns the alert to deliver, or None
+
+        Arguments:
+        list  fired: Names of the rules that fired
+        float timestamp: Time of the sample
+        int   value: Heart rate value """
+
+        raised = []
+        for name in fired:
+            if name not in self.quiet:
+                if timestamp - self.lastAlert.get(name, -self.cooldown) >= self.cooldown:
+                    raised.append(name)
+                    self.lastAlert[name] = timestamp
+                else:
+                    self.suppressed += 1
+            self.quiet[name] = 0
+
+        # Rules that did not fire count towards being cleared
+        for name in list(self.quiet):
+            if name not in fired:
+                self.quiet[name] += 1
+                if self.quiet[name] >= self.clear:
+                    del self.quiet[name]
+
+        if not raised:
+            return None
+        return {'time': timestamp, 'mac': self.macAddress, 'rules': raised, 'hr': value}
+
+# -----------------------------------------------------------------------------
+# Alert Dispatcher Class
+# -----------------------------------------------------------------------------
+
+class AlertDispatcher(object):
+
+    def __init__(self, sinks=(), maxsize=64, retries=3):
+
+        """ Deliver alerts from a background thread, so the notification callback
+            never waits for the band or the sinks
+
+        Arguments:
+        list  sinks: Extra destinations of the alerts (FileSink, WebhookSink)
+        int   maxsize: Number of alerts waiting to be delivered
+        int   retries: Attempts after a failed delivery """
+
+        self.sinks = list(sinks)
+        self.retries = retries
+        self.dropped = 0
+        self.failed = 0
+        self.alerts = queue.Queue(maxsize=maxsize)
+
+        self.thread = threading.Thread(target=self.deliver_alerts, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, alert, write=None):
+
+        """ Queue an alert, dropping it if the queue is full
+
+        Arguments:
+        dict  alert: Alert returned by AlertState.update
+        function write: Sends the alert to the band """
+
+        try:
+            self.alerts.put_nowait((alert, write))
+        except queue.Full:
+            self.dropped += 1
+
+    def deliver(self, function, alert):
+
+        """ Call function(alert), retrying with backoff when it fails
+
+        Arguments:
+        function function: Delivery function
+        dict  alert: Alert delivered """
+
+        backoff = Backoff(base=0.5, cap=5.0)
+        for attempt in range(self.retries + 1):
+            try:
+                function(alert)
+                return True
+            except Exception as e:
+                if attempt == self.retries:
+                    self.failed += 1
+                    output.message("Alert not delivered: " + str(e), alert['mac'])
+                    return False
+                time.sleep(backoff.next_delay())
+
+    def deliver_alerts(self):
+
+        """ Deliver alerts until the dispatcher is closed """
+
+        while True:
+            item = self.alerts.get()
+            if item is None:
+                break
+            alert, write = item
+            if write is not None:
+                self.deliver(lambda a: write(), alert)
+            for sink in self.sinks:
+                self.deliver(sink.send, alert)
+
+    def close(self):
+
+        """ Deliver the alerts still queued and stop the thread """
+
+        if not self.thread.is_alive():
+            return
+        self.alerts.put(None)
+        self.thread.join(timeout=5.0)
+
+# Settings of the alert states and dispatcher, changed by configure
+cooldown = 60.0
+clear = 5
+dispatcher = None
+
+def configure(alert_cooldown=60.0, alert_clear=5, alert_file=None, webhook=None):
+
+    """ Set how alerts are raised and where they are delivered
+
+    Arguments:
+    float alert_cooldown: Minimum seconds between two alerts of the same rule
+    int   alert_clear: Samples without firing before a rule can raise a new alert
+    str   alert_file: File where alerts are also written (None disables it)
+    str   webhook: URL where alerts are also posted (None disables it) """
+
+    global cooldown, clear, dispatcher
+
+    cooldown = alert_cooldown
+    clear = alert_clear
+    sinks = []
+    if alert_file is not None:
+        sinks.append(FileSink(alert_file))
+    if webhook is not None:
+        sinks.append(WebhookSink(webhook))
+
+    if dispatcher is not None:
+        dispatcher.close()
+    dispatcher = AlertDispatcher(sinks)
+    return dispatcher
+
+def get_dispatcher():
+
+    """ Return the dispatcher used by the bands """
+
+    return dispatcher or configure(cooldown, clear)
+
+def create_state(mac_address):
+
+    """ Return a new alert state with the configured settings
+
+    Arguments:
+    str   mac_address: MAC address of the band """
+
+    return AlertState(mac_address, cooldown, clear)
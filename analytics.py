@@ -0,0 +1,269 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Offline analytics script
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from functools import partial
+import numpy as np
+from history import HR_DTYPE
+from rules import RuleEngine, default_rules, invalid_mask, load_rules
+
+# Heart rate zones as fractions of the maximum heart rate
+ZONES = (0.5, 0.6, 0.7, 0.8, 0.9)
+
+# Values counted by the heart rate histograms
+HR_BINS = 256
+
+def load_samples(path):
+
+    """ Read the samples of a recorded session
+        Returns the MAC address of the band and the records
+
+    Arguments:
+    str   path: Session log (.hrlog) or heart rate CSV file written by the exporter """
+
+    if path.endswith(".hrlog"):
+        from sessionlog import read_session
+        header, records = read_session(path)
+        return header['mac'], records
+
+    from export import read_batches
+    dtype, batches = read_batches(path)
+    if dtype != HR_DTYPE:
+        raise ValueError(path + " does not hold heart rate samples")
+
+    # Exported files are named after the band: aabbccddeeff_hr_...
+    name = os.path.basename(path).split("_")[0].upper()
+    mac = ":".join(name[i:i + 2] for i in range(0, len(name), 2))
+    return mac, np.concatenate(list(batches) or [np.zeros(0, dtype=HR_DTYPE)])
+
+def count_alerts(fires, times, cooldown=60.0, clear=5):
+
+    """ Count the alerts a rule raises over a recording, like alerts.AlertState
+        Only the starts of firing episodes are looped over
+
+    Arguments:
+    ndarray fires: True where the rule fires
+    ndarray times: Time of every sample in seconds
+    float cooldown: Minimum seconds between two alerts of the rule
+    int   clear: Samples without firing before the rule can raise a new alert """
+
+    index = np.flatnonzero(fires)
+    if len(index) == 0:
+        return 0, 0
+
+    # An episode starts when clear samples or more did not fire since the last firing one
+    starts = index[np.concatenate(([True], np.diff(index) - 1 >= clear))]
+
+    raised = 0
+    lastAlert = -np.inf
+    for timestamp in times[starts]:
+        if timestamp - lastAlert >= cooldown:
+            raised += 1
+            lastAlert = timestamp
+    return raised, len(starts) - raised
+
+def summarize(path, rules_file=None, gap=5.0, cooldown=60.0, clear=5):
+
+    """ Compute the aggregates of one session, vectorised over its samples
+        Every aggregate can be merged with the ones of other sessions
+
+    Arguments:
+    str   path: Session log (.hrlog) or heart rate CSV file written by the exporter
+    str   rules_file: JSON file with the alert rules (default: heart rate drop)
+    float gap: Seconds without sample counted as a gap in the data
+    float cooldown: Minimum seconds between two alerts of the same rule
+    int   clear: Samples without firing before a rule can raise a new alert """
+
+    mac, records = load_samples(path)
+    times = np.asarray(records['time'], dtype=np.float64)
+    values = np.asarray(records['hr'])
+
+    summary = {'mac': mac, 'files': 1, 'samples': len(times), 'invalid': 0, 'start': None, 'end': None,
+               'counts': np.zeros(HR_BINS, dtype=np.int64), 'seconds': np.zeros(HR_BINS),
+               'gaps': 0, 'gapSeconds': 0.0, 'longestGap': 0.0, 'alerts': {}, 'suppressed': {}, 'hours': {}}
+    if len(times) == 0:
+        return summary
+
+    summary['start'], summary['end'] = float(times[0]), float(times[-1])
+
+    # Gaps between consecutive samples
+    intervals = np.diff(times)
+    gaps = intervals[intervals > gap]
+    summary['gaps'] = len(gaps)
+    summary['gapSeconds'] = float(gaps.sum())
+    summary['longestGap'] = float(gaps.max()) if len(gaps) else 0.0
+
+    # Alerts the rules would have raised
+    rules = load_rules(rules_file) if rules_file is not None else default_rules()
+    for name, fires in RuleEngine(rules).evaluate(times, values).items():
+        summary['alerts'][name], summary['suppressed'][name] = count_alerts(fires, times, cooldown, clear)
+
+    # Histograms of the valid samples, by count and by time until the next sample (gaps excluded)
+    valid = ~invalid_mask(values)
+    summary['invalid'] = int(len(values) - valid.sum())
+    durations = np.concatenate((np.where(intervals > gap, 0.0, intervals), [0.0]))
+    hr = np.minimum(values[valid], HR_BINS - 1).astype(np.int64)
+    summary['counts'] = np.bincount(hr, minlength=HR_BINS)
+    summary['seconds'] = np.bincount(hr, weights=durations[valid], minlength=HR_BINS)
+
+    # Aggregates per hour: samples, sum, min and max of the valid samples
+    if len(hr):
+        hours, inverse = np.unique((times[valid] // 3600).astype(np.int64), return_inverse=True)
+        count = np.bincount(inverse, minlength=len(hours))
+        total = np.bincount(inverse, weights=hr, minlength=len(hours))
+        low = np.full(len(hours), HR_BINS, dtype=np.int64)
+        high = np.zeros(len(hours), dtype=np.int64)
+        np.minimum.at(low, inverse, hr)
+        np.maximum.at(high, inverse, hr)
+        for i, hour in enumerate(hours.tolist()):
+            summary['hours'][hour] = [int(count[i]), float(total[i]), int(low[i]), int(high[i])]
+
+    return summary
+
+def merge(summary, other):
+
+    """ Add the aggregates of another session of the same band to a summary
+
+    Arguments:
+    dict  summary: Aggregates updated in place
+    dict  other: Aggregates to add """
+
+    for key in ('files', 'samples', 'invalid', 'gaps', 'gapSeconds', 'counts', 'seconds'):
+        summary[key] = summary[key] + other[key]
+    summary['longestGap'] = max(summary['longestGap'], other['longestGap'])
+
+    starts = [s for s in (summary['start'], other['start']) if s is not None]
+    ends = [e for e in (summary['end'], other['end']) if e is not None]
+    summary['start'] = min(starts) if starts else None
+    summary['end'] = max(ends) if ends else None
+
+    for key in ('alerts', 'suppressed'):
+        for name, count in other[key].items():
+            summary[key][name] = summary[key].get(name, 0) + count
+
+    for hour, (count, total, low, high) in other['hours'].items():
+        if hour in summary['hours']:
+            current = summary['hours'][hour]
+            summary['hours'][hour] = [current[0] + count, current[1] + total, min(current[2], low), max(current[3], high)]
+        else:
+            summary['hours'][hour] = [count, total, low, high]
+    return summary
+
+def percentile(counts, fraction):
+
+    """ Value below which a fraction of the samples of a histogram falls
+
+    Arguments:
+    ndarray counts: Number of samples of every value
+    float fraction: Fraction of the samples, between 0 and 1 """
+
+    cumulative = np.cumsum(counts)
+    return int(np.searchsorted(cumulative, fraction * cumulative[-1]))
+
+def report(summary, max_hr=190, resting=0.05):
+
+    """ Turn the merged aggregates of a band into a report
+
+    Arguments:
+    dict  summary: Merged aggregates of the band
+    int   max_hr: Maximum heart rate of the wearer, used for the zones
+    float resting: Fraction of the lowest samples below the resting heart rate """
+
+    counts = summary['counts']
+    valid = int(counts.sum())
+    result = {'mac': summary['mac'], 'files': summary['files'], 'samples': summary['samples'],
+              'invalid': summary['invalid'], 'start': summary['start'], 'end': summary['end'],
+              'gaps': {'count': summary['gaps'], 'seconds': round(summary['gapSeconds'], 1),
+                       'longest': round(summary['longestGap'], 1)},
+              'alerts': summary['alerts'], 'suppressed': summary['suppressed']}
+    if valid == 0:
+        return result
+
+    values = np.arange(HR_BINS)
+    nonzero = np.flatnonzero(counts)
+    result['hr'] = {'mean': round(float((counts * values).sum() / valid), 1), 'min': int(nonzero[0]),
+                    'max': int(nonzero[-1]), 'resting': percentile(counts, resting)}
+
+    # Seconds spent in every zone, from the lowest bound of each one
+    bounds = [int(np.ceil(z * max_hr)) for z in ZONES] + [HR_BINS]
+    result['zones'] = {"%d%%" % round(z * 100): round(float(summary['seconds'][low:high].sum()), 1)
+                       for z, low, high in zip(ZONES, bounds[:-1], bounds[1:])}
+
+    result['hours'] = [{'hour': time.strftime("%Y-%m-%d %H:00", time.localtime(hour * 3600)), 'samples': count,
+                        'mean': round(total / count, 1), 'min': low, 'max': high}
+                       for hour, (count, total, low, high) in sorted(summary['hours'].items())]
+    return result
+
+def analyze(paths, jobs=None, **options):
+
+    """ Summarize many sessions over a pool of processes and merge them by band
+        Returns the merged aggregates by MAC address
+
+    Arguments:
+    list  paths: Session logs or heart rate CSV files
+    int   jobs: Number of processes (None uses every core)
+    dict  options: Arguments of summarize """
+
+    # Larger files first so a big session does not finish alone at the end
+    paths = sorted(paths, key=os.path.getsize, reverse=True)
+    merged = {}
+
+    function = partial(summarize, **options)
+    pool = multiprocessing.Pool(jobs) if jobs != 1 else None
+    try:
+        for summary in (pool.imap_unordered(function, paths) if pool is not None else map(function, paths)):
+            merged[summary['mac']] = merge(merged[summary['mac']], summary) if summary['mac'] in merged else summary
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return merged
+
+def main():
+
+    """ Main function
+        Prints a report per band for many recorded sessions """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sessions', nargs='+', help='Session logs (.hrlog) or exported heart rate CSV files')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of processes (default: every core)')
+    parser.add_argument('-r', '--rules', default=None, help='JSON file with the alert rules (default: drop rule)')
+    parser.add_argument('-m', '--max-hr', type=int, default=190, help='Maximum heart rate of the wearer, used for the zones')
+    parser.add_argument('-g', '--gap', type=float, default=5.0, help='Seconds without sample counted as a gap')
+    parser.add_argument('--alert-cooldown', type=float, default=60.0, help='Minimum seconds between two alerts of the same rule')
+    parser.add_argument('--alert-clear', type=int, default=5, help='Samples without firing before a rule can alert again')
+    parser.add_argument('-o', '--output', default=None, help='File where the reports are written as JSON')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    merged = analyze(args.sessions, args.jobs, rules_file=args.rules, gap=args.gap,
+                     cooldown=args.alert_cooldown, clear=args.alert_clear)
+    reports = [report(merged[mac], args.max_hr) for mac in sorted(merged)]
+    elapsed = time.perf_counter() - start
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+
+    for result in reports:
+        print("%s: %d files, %d samples (%d invalid)" % (result['mac'], result['files'], result['samples'], result['invalid']))
+        if 'hr' in result:
+            print("  Heart rate: mean %.1f, min %d, max %d, resting %d" % (result['hr']['mean'], result['hr']['min'],
+                                                                          result['hr']['max'], result['hr']['resting']))
+            print("  Zones (s): " + ", ".join("%s %.0f" % item for item in result['zones'].items()))
+        print("  Gaps: %d, %.1f s, longest %.1f s" % (result['gaps']['count'], result['gaps']['seconds'], result['gaps']['longest']))
+        for name in result['alerts']:
+            print("  Alerts %s: %d (%d suppressed)" % (name, result['alerts'][name], result['suppressed'][name]))
+    print("%d sessions in %.2f s" % (len(args.sessions), elapsed))
+
+if __name__ == "__main__":
+    main()
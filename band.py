@@ -0,0 +1,286 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Mi Band base Class script
+
+import numpy as np
+import gatt
+from const import *
+from handshake import key_pool, auth_response
+from chunked import ChunkedEncoder, ChunkedDecoder, negotiated_mtu
+from session import get_session
+import output
+from metrics import get_metrics
+from commands import CommandQueue
+
+# -----------------------------------------------------------------------------
+# Mi Band Class
+# -----------------------------------------------------------------------------
+
+class MiBand(gatt.Device):
+
+    def __init__(self, mac_address, manager):
+
+        """ Connection, authentication and notification dispatch shared by every band
+            Subclasses register the characteristics they handle in register_handlers
+
+        Arguments:
+        str   mac_address: MAC address of the band
+        gatt.DeviceManager manager: Manager that handles the connection """
+
+        super().__init__(mac_address, manager)
+        self.notifCount = 0
+        self.disconnectCallback = None
+        self.authCallback = None
+        self.connectCallback = None
+        self.connectFailedCallback = None
+        self.pendingSetup = False
+
+        # Every write goes through the queue, in order and from the event loop
+        self.commands = CommandQueue(self)
+
+        # Handlers by UUID, and by characteristic object once a notification was seen
+        self.valueHandlers = {}
+        self.enabledHandlers = {}
+        self.dispatch = {}
+        self.register(UUIDS.CHARACTERISTIC_CHUNKED_TRANSFER_READ, self.chunked_updated, self.chunked_enabled)
+        self.register_handlers()
+
+    def register(self, uuid, on_value=None, on_enabled=None):
+
+        """ Set the functions called for a characteristic
+
+        Arguments:
+        str   uuid: UUID of the characteristic
+        function on_value: Called with the value of every notification
+        function on_enabled: Called when its notifications are enabled """
+
+        if on_value is not None:
+            self.valueHandlers[uuid] = on_value
+        if on_enabled is not None:
+            self.enabledHandlers[uuid] = on_enabled
+        self.dispatch = {}
+
+    def register_handlers(self):
+
+        """ Register the characteristics handled by the band model """
+
+        pass
+
+    def connect(self, authKey):
+
+        """ Connect with the device, blocking until it is connected
+            Initialize important variables
+            Search for service and characteristics and store them """
+
+        super().connect()
+
+        self.authKey = authKey
+        self.setup()
+
+    def connect_async(self, authKey):
+
+        """ Start connecting with the device without blocking the event loop
+            connectCallback is called once it is connected and its characteristics are found,
+            connectFailedCallback with the error if the connection fails
+
+        Arguments:
+        str   authKey: Authentication key of the band """
+
+        self.authKey = authKey
+        self.pendingSetup = True
+        self._connect_signals()
+        self._object.Connect(reply_handler=self.connect_replied, error_handler=self.connect_failed)
+
+    def connect_replied(self):
+
+        """ Connection accepted by BlueZ, the services may still be resolving
+            Services resolved before, e.g. when retrying a connected band, are read again """
+
+        if self.pendingSetup and self.is_services_resolved():
+            self.services_resolved()
+
+    def services_resolved(self):
+
+        """ Function from gatt-python that is used as callback when
+            the services are resolved, finishes a connection started by connect_async """
+
+        super().services_resolved()
+        if self.pendingSetup:
+            self.pendingSetup = False
+            self.setup()
+            if self.connectCallback is not None:
+                self.connectCallback(self)
+
+    def connect_failed(self, error):
+
+        """ Function from gatt-python that is used as callback when
+            the connection could not be established
+
+        Arguments:
+        Exception error: Error returned by BlueZ """
+
+        super().connect_failed(error)
+        if self.pendingSetup:
+            self.pendingSetup = False
+            if self.connectFailedCallback is not None:
+                self.connectFailedCallback(self, error)
+
+    def setup(self):
+
+        """ Initialize the state of a new connection and find its characteristics """
+
+        self.commands.reset()
+
+        self.create_public_key()
+
+        self.handle = 0
+
+        self.session = get_session(self.mac_address)
+        self.metrics = get_metrics(self.mac_address)
+        if self.metrics is not None:
+            self.metrics.connected()
+        self.prepare_session()
+
+        self.session.resolve(self)
+        self.dispatch = {}
+
+        # Frames are sized from the MTU negotiated for the connection
+        self.encoder = ChunkedEncoder(negotiated_mtu(self.charChunkedW))
+        self.decoder = ChunkedDecoder()
+
+    def prepare_session(self):
+
+        """ Create the state of the band model kept across reconnects """
+
+        pass
+
+    def authenticated(self):
+
+        """ Called once the band accepted the authentication """
+
+        pass
+
+    def create_public_key(self):
+
+        """ Use ECDH private-public key agreement to create a public key for the user
+            Stores private and public key in the class
+            Keys are taken from a pool filled in the background """
+
+        self.keyPool = key_pool()
+        self.privateKey, self.publicKey = self.keyPool.get()
+
+    def enable_notifications_chunked(self):
+
+        """ Enable notifications of Chunked Transfer Characteristic
+            Used to start authentication process """
+
+        self.charChunked.enable_notifications()
+
+    def write_chunked_value(self,handle,data):
+
+        """  Splits data to send in different packets
+            Frames are queued, so they are paced and never written all at once
+
+        Arguments:
+        int   handle: Identify the packages
+        bytes[] data: Data to send to the band """
+
+        for frame in self.encoder.encode(handle, data):
+            self.commands.write(self.charChunkedW, frame)
+
+    def disconnect_succeeded(self):
+
+        """ Function from gatt-python that is used as callback when
+            the connection with the band is lost """
+
+        super().disconnect_succeeded()
+        self.commands.reset()
+        if self.disconnectCallback is not None:
+            self.disconnectCallback(self)
+
+    def characteristic_enable_notifications_succeeded(self, characteristic):
+
+        """ Function from gatt-python that is used as callback when
+            the notifications are enabled
+
+        Arguments:
+        org.bluez.GattCharacteristic1 characteristic: Identify characteristic that now have notif enabled """
+
+        handler = self.enabledHandlers.get(characteristic.uuid)
+        if handler is not None:
+            handler()
+
+    def characteristic_value_updated(self, characteristic, value):
+
+        """ Function from gatt-python that is used as callback when
+            a notification is received
+
+        Arguments:
+        org.bluez.GattCharacteristic1 characteristic: Identify characteristic that sent notification
+        bytes[] value : Value received from the band """
+
+        self.notifCount += 1
+        if self.metrics is not None:
+            self.metrics.notification(characteristic.uuid)
+
+        # Characteristic objects change when services are resolved again, so a miss
+        # falls back to the UUID and caches the handler for the new object
+        handler = self.dispatch.get(characteristic)
+        if handler is None:
+            handler = self.dispatch[characteristic] = self.valueHandlers.get(characteristic.uuid, self.unhandled)
+        handler(value)
+
+    def unhandled(self, value):
+
+        """ Ignore notifications of characteristics without handler """
+
+        pass
+
+    def chunked_enabled(self):
+
+        """ Whenever the notifications are enabled, send 1st package to the band, starting authentication process """
+
+        auth = np.append(np.array([0x04, 0x02, 0x00, 0x02],dtype=np.uint8),self.publicKey.view(dtype=np.uint8))
+        output.message("Sending 1st auth part", self.mac_address)
+        self.write_chunked_value(self.handle, auth)
+
+    def chunked_updated(self, value):
+
+        """ Reassemble the messages received in chunks and go through the authentication
+
+        Arguments:
+        bytes[] value : Frame received from the band """
+
+        message = self.decoder.feed(value)
+        if self.decoder.gap:
+            output.message("Unexpected sequence number", self.mac_address)
+            if self.metrics is not None:
+                self.metrics.chunk_gap()
+
+        if message is None:
+            return
+
+        # If the format indicates that the 1st auth part is passed:
+        if message[:3] == AUTH.KEYS_RECEIVED:
+
+            output.message("1st auth part done", self.mac_address)
+
+            # Calculate shared key between band and the user and prepare data to send
+            command = auth_response(self.keyPool.backend, self.privateKey, self.authKey, message[3:19], message[19:67])
+            output.message("Sending 2nd auth part", self.mac_address)
+            self.handle += 1
+            self.write_chunked_value(self.handle, command)
+
+        elif message[:3] == AUTH.SUCCESS:
+            output.message("Successfully authenticated", self.mac_address)
+            if self.metrics is not None:
+                self.metrics.authenticated()
+            self.authenticated()
+            if self.authCallback is not None:
+                self.authCallback(self)
+        else:
+            output.message("Unhandled characteristic change", self.mac_address)
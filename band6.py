@@ -6,13 +6,18 @@
 # -----------------------------------------------------------------------------
 # Mi Band 6 Class script
 
-import numpy as np
-import gatt
-from Crypto.Cipher import AES
-import matplotlib.pyplot as plt
 import time
 from const import *
-from ecdh import *
+from band import MiBand
+from history import get_history
+from timeseries import get_store
+import output
+from sessionlog import create_session_log
+from rules import RuleEngine, default_rules, load_rules
+import alerts
+from export import get_exporter
+from heartrate import parse_measurement, RrIntervals
+from rawsensor import RawCapture, SENSOR_ENABLE, SENSOR_START
 
 initialTime = 0
 
@@ -20,85 +25,86 @@ initialTime = 0
 # Mi Band 6 Class
 # -----------------------------------------------------------------------------
 
-class MiBand6(gatt.Device):
+class MiBand6(MiBand):
 
-    def __init__(self, mac_address, manager):
+    def __init__(self, mac_address, manager, stats_window=0, history_capacity=3600, history_dir=None, log_dir=None,
+                 rules_file=None, raw_dir=None):
 
-        """ Initialize device class using gatt-python library """
+        """ Initialize device class using gatt-python library
 
-        super().__init__(mac_address, manager)
-
-    def connect(self, authKey):
-
-        """ Connect with the device
-            Initialize important variables
-            Search for service and characteristics and store them """
-
-        super().connect()
-
-        self.privateKey = np.zeros(6,dtype=np.uint32)
-        self.publicKey = np.zeros(12,dtype=np.uint32)
-        self.secretKey = np.zeros(12,dtype=np.uint32)
-        self.reassemble = np.zeros(64,dtype=np.uint8)
-        self.authKey = authKey
-
-        self.create_public_key()
-
-        self.service1 = self.serviceHeart = self.serviceNotif = None
-        self.charChunked = self.charChunkedW = self.charNotif = None
-        self.charHrControl = self.charHrMeasure = self.charTime = None              
-        self.handle = self.lastNumber = self.expectedB = self.pointer = 0
-
-        self.hrHist = [[],[]]
-
-        for s in self.services:
-            if s.uuid == UUIDS.SERVICE_MIBAND1:
-                self.service1 = s
-                for c in self.service1.characteristics:
-                    if c.uuid == UUIDS.CHARACTERISTIC_CHUNKED_TRANSFER_READ:
-                        self.charChunked = c
-                    if c.uuid == UUIDS.CHARACTERISTIC_CHUNKED_TRANSFER_WRITE:
-                        self.charChunkedW = c
-            if s.uuid == UUIDS.SERVICE_HEART_RATE:
-                self.serviceHeart = s
-                for c in self.serviceHeart.characteristics:
-                    if c.uuid == UUIDS.CHARACTERISTIC_HEART_RATE_CONTROL:
-                        self.charHrControl = c
-                    if c.uuid == UUIDS.CHARACTERISTIC_HEART_RATE_MEASURE:
-                        self.charHrMeasure = c
-            if s.uuid == UUIDS.SERVICE_ALERT_NOTIFICATION:
-                self.serviceNotif = s
-                for c in self.serviceNotif.characteristics:
-                    if c.uuid == UUIDS.CHARACTERISTIC_ALERT:
-                        self.charNotif = c
-
-    def create_public_key(self):
-
-        """ Use ECDH private-public key agreement to create a public key for the user 
-            Stores private and public key in the class """
-
-        privateKey = np.zeros(6,dtype=np.uint32)
-        publicKey = np.zeros(12,dtype=np.uint32)
-        for i in range(6):
-            privateKey[i] = np.random.randint(4294967296, dtype=np.uint32)
-
-        self.privateKey, self.publicKey = ecdh_generate_keys(privateKey,publicKey)
-
-    def enable_notifications_chunked(self):
-
-        """ Enable notifications of Chunked Transfer Characteristic
-            Used to start authentication process """
+        Arguments:
+        str   mac_address: MAC address of the band
+        gatt.DeviceManager manager: Manager that handles the connection
+        int   stats_window: Number of samples used by the alert statistics (0 uses every sample)
+        int   history_capacity: Number of heart rate samples kept in memory
+        str   history_dir: Directory where older samples are spilled (None discards them)
+        str   log_dir: Directory where the session is recorded (None does not record it)
+        str   rules_file: JSON file with the alert rules (None uses the drop rule)
+        str   raw_dir: Directory where the raw PPG and accelerometer stream is recorded (None does not enable it) """
 
-        self.charChunked.enable_notifications()
+        super().__init__(mac_address, manager)
+        self.statsWindow = stats_window
+        self.historyCapacity = history_capacity
+        self.historyDir = history_dir
+        self.logDir = log_dir
+        self.rulesFile = rules_file
+        self.rawDir = raw_dir
+        self.rawCapture = None
+        self.lastHr = None
+
+    def register_handlers(self):
+
+        """ Register the characteristics handled by the Mi Band 6 """
+
+        self.register(UUIDS.CHARACTERISTIC_HEART_RATE_MEASURE, self.hr_updated)
+        self.register(UUIDS.CHARACTERISTIC_HZ, self.raw_updated)
+
+    def prepare_session(self):
+
+        """ History, time series store, RR intervals, alert rules, session log, export and raw capture
+            are kept by every connection to this band """
+
+        self.hrHist = get_history(self.mac_address, self.historyCapacity, self.historyDir)
+        self.hrStore = get_store(self.mac_address, self.historyCapacity)
+        if self.session.rr is None:
+            self.session.rr = RrIntervals()
+        self.rrIntervals = self.session.rr
+        if self.session.rules is None:
+            rules = load_rules(self.rulesFile) if self.rulesFile is not None else default_rules(self.statsWindow)
+            self.session.rules = RuleEngine(rules)
+        self.rules = self.session.rules
+        if self.session.alerts is None:
+            self.session.alerts = alerts.create_state(self.mac_address)
+        self.alerts = self.session.alerts
+        if self.logDir is not None and self.session.log is None:
+            self.session.log = create_session_log(self.logDir, self.mac_address, 6)
+        self.exporter = get_exporter(self.mac_address, 'hr')
+        if self.rawDir is not None and self.session.raw is None:
+            self.session.raw = RawCapture(self.rawDir, self.mac_address)
+        self.rawCapture = self.session.raw
+
+    def authenticated(self):
+
+        """ Start measuring once authenticated """
+
+        self.start_hr_measure()
+        if self.rawCapture is not None:
+            self.start_raw_capture()
 
     def ping_hr(self):
 
-        """ Function used to query heart rate """
+        """ Function used to restart heart rate measurement """
 
         # Starts continuous measurement
-        self.charHrControl.write_value([0x15, 0x01, 0x01])
+        self.commands.write(self.charHrControl, [0x15, 0x01, 0x01], 'hrStart')
         # Sets measurement interval
-        self.charHrControl.write_value([0x14, 0x00, 0x01])
+        self.commands.write(self.charHrControl, [0x14, 0x00, 0x01], 'hrInterval')
+
+    def continue_hr(self):
+
+        """ Keep the continuous measurement going, without setting the interval again """
+
+        self.commands.write(self.charHrControl, [0x15, 0x01, 0x01], 'hrStart')
 
     def start_hr_measure(self):
 
@@ -107,178 +113,94 @@ class MiBand6(gatt.Device):
         global initialtime
         initialtime = time.time()
 
-        print("Starting Heart Rate Measurement:")
+        output.message("Starting Heart Rate Measurement:", self.mac_address)
         self.charHrMeasure.enable_notifications()
 
         # Starts continuous measurement
-        self.charHrControl.write_value([0x15, 0x01, 0x01])
+        self.commands.write(self.charHrControl, [0x15, 0x01, 0x01], 'hrStart')
         # Sets measurement interval
-        self.charHrControl.write_value([0x14, 0x00, 0x01])
+        self.commands.write(self.charHrControl, [0x14, 0x00, 0x01], 'hrInterval')
      
-    def send_alert(self):
+    def start_raw_capture(self):
 
-        """ Function that sends call notification to the band """
+        """ Enable the realtime PPG and accelerometer stream, sent while heart rate is measured """
 
-        print("Sending Call Notification to the band")
-        self.charNotif.write_value([0x03, 0x01, 0x0a, 0x0a, 0x0a])
+        if self.charSensor is None or self.charHz is None:
+            output.message("Raw sensor data is not available on this band", self.mac_address)
+            return
 
-    def print_hr(self):
-        
-        """ Function to plot recorded heart rate """
+        output.message("Starting raw sensor capture:", self.mac_address)
+        self.charHz.enable_notifications()
+        self.commands.write(self.charSensor, SENSOR_ENABLE)
+        self.commands.write(self.charSensor, SENSOR_START)
 
-        plt.plot(self.hrHist[1], self.hrHist[0])
-        plt.scatter(self.hrHist[1], self.hrHist[0], color="red")
-        plt.show()
+    def raw_updated(self, value):
 
+        """ Record a raw sensor packet, decoded later in bulk by the capture thread
 
-    def write_chunked_value(self,handle,data):
+        Arguments:
+        bytes[] value : Value received from the band """
 
-        """  Splits data to send in different packets
+        if self.rawCapture is not None:
+            self.rawCapture.append(value)
 
-        Arguments:
-        int   handle: Identify the packages
-        bytes[] data: Data to send to the band """
-
-        remaining = len(data)
-        count = 0
-        header_size = 11
-        mMTU = 23
-
-        while remaining > 0:
-            MAX_CHUNKLENGTH = mMTU - 3 - header_size
-            copybytes = min(remaining, MAX_CHUNKLENGTH)
-            chunk = np.zeros(copybytes + header_size,dtype=np.uint8)
-
-            flags = 0
-
-            if count == 0:
-                flags |= 0x01
-                chunk[5] = len(data) & 0xff
-                chunk[6] = (len(data) >> 8) & 0xff
-                chunk[7] = (len(data) >> 16) & 0xff
-                chunk[8] = (len(data) >> 24) & 0xff
-                chunk[9] = 0x82 & 0xff
-                chunk[10] = (0x82 >> 8) & 0xff
-            if remaining <= MAX_CHUNKLENGTH:
-                flags |= 0x06
-            chunk[0] = 0x03
-            chunk[1] = flags
-            chunk[2] = 0
-            chunk[3] = handle
-            chunk[4] = count
-
-            chunk[header_size:] = data[len(data) - remaining:len(data) - remaining + copybytes]
-            self.charChunkedW.write_value(chunk.tolist())
-            remaining -= copybytes
-            header_size = 5
-            count += 1
-
-    def characteristic_enable_notifications_succeeded(self, characteristic):
-
-        """ Function from gatt-python that is used as callback when
-            the notifications are enabled 
-            
-        Arguments:
-        org.bluez.GattCharacteristic1 characteristic: Identify characteristic that now have notif enabled """
+    def send_alert(self):
+
+        """ Function that sends call notification to the band
+            Called from the alert dispatcher thread, never from the notification callback """
+
+        output.message("Sending Call Notification to the band", self.mac_address)
+        self.commands.write(self.charNotif, [0x03, 0x01, 0x0a, 0x0a, 0x0a], 'alert')
+
+    def print_hr(self):
         
-        if str(characteristic.uuid) == UUIDS.CHARACTERISTIC_CHUNKED_TRANSFER_READ:
+        """ Function to plot recorded heart rate
+            matplotlib is only imported here, so headless runs never load it """
 
-            # Whenever the notifications are enabled, send 1st package to the band, starting authentication process
-            auth = np.append(np.array([0x04, 0x02, 0x00, 0x02],dtype=np.uint8),self.publicKey.view(dtype=np.uint8))
-            print("Sending 1st auth part")
-            self.write_chunked_value(self.handle, auth)
+        import matplotlib.pyplot as plt
 
-    def characteristic_value_updated(self, characteristic, value):
+        values, times = self.hrHist.arrays(spilled=True)
+        plt.plot(times, values)
+        plt.scatter(times, values, color="red")
+        plt.show()
+
+    def hr_updated(self, value):
+
+        """ Save and check every heart rate measure
 
-        """ Function from gatt-python that is used as callback when
-            a notification is received 
-            
         Arguments:
-        org.bluez.GattCharacteristic1 characteristic: Identify characteristic that sent notification
         bytes[] value : Value received from the band """
 
-        if str(characteristic.uuid) == UUIDS.CHARACTERISTIC_CHUNKED_TRANSFER_READ:
-
-            # Checks the format of message received
-            data = np.frombuffer(value,np.uint8)
-            headerSize = 0
-            if len(data) > 1 and data[0] == 0x03:
-                sequenceNumber = data[4]
-                if sequenceNumber == 0 and \
-                data[9] == 0x82 and \
-                data[10] == 0x00 and \
-                data[11] == 0x10 and \
-                data[12] == 0x04 and \
-                data[13] == 0x01:
-                    print("1st auth part done")
-                    self.pointer = 0
-                    headerSize = 14
-                    self.expectedB = data[5] - 3
-                elif sequenceNumber > 0:
-                    if sequenceNumber != self.lastNumber + 1:
-                        print("Unexpected sequence number")
-                    headerSize = 5
-                elif data[9] == 0x82 and \
-                    data[10] == 0x00 and \
-                    data[11] == 0x10 and \
-                    data[12] == 0x05 and \
-                    data[13] == 0x01:
-                    print("Successfully authenticated")
-                    self.start_hr_measure()
-                else:
-                    print("Unhandled characteristic change")
-                
-                bytesToCopy = len(data) - headerSize
-
-                if self.handle == 0:
-                    self.reassemble[self.pointer:self.pointer+bytesToCopy] = data[headerSize:]
-
-                self.pointer += len(data) - headerSize
-                self.lastNumber = sequenceNumber
-
-                # If the format indicates that the 1st auth part is passed:
-                if self.pointer == self.expectedB:
-
-                    remoteRandom = self.reassemble[0:16]
-                    remotePublic = self.reassemble[16:64]
-
-                    # Calculate shared key between band and the user
-                    self.secretKey = ecdh_shared_secret(self.privateKey, remotePublic.view(dtype=np.uint32))
-                    secretKey8 = self.secretKey.view(dtype=np.uint8)
-
-                    secretKey = np.frombuffer(bytes.fromhex(self.authKey), dtype=np.uint8)
-                    finalSharedSessionAES = np.zeros(16, dtype=np.uint8)
-                    for i in range(16):
-                        finalSharedSessionAES[i] = secretKey8[i + 8] ^ secretKey[i]
-
-                    # Use AES encryption and prepare data to send
-                    aesCbc1 = AES.new(secretKey.tobytes(), AES.MODE_CBC, iv=bytes([0]*16))
-                    out1 = aesCbc1.encrypt(remoteRandom.tobytes())
-
-                    aesCbc2 = AES.new(finalSharedSessionAES.tobytes(), AES.MODE_CBC, iv=bytes([0]*16))
-                    out2 = aesCbc2.encrypt(remoteRandom.tobytes())
-
-                    if len(out1) == 16 and len(out2) == 16:
-                        command = np.zeros(33, dtype=np.uint8)
-                        command[0] = 0x05
-                        command[1:17] = np.frombuffer(out1,np.uint8)
-                        command[17:33] = np.frombuffer(out2,np.uint8)
-                        print("Sending 2nd auth part")
-                        self.handle += 1
-                        self.write_chunked_value(self.handle, command)
-
-        elif str(characteristic.uuid) == UUIDS.CHARACTERISTIC_HEART_RATE_MEASURE:
-
-            global initialTime
-            hRate = int.from_bytes(value,"big")
-
-            # Save received heart rate value and the time of it
-            if hRate != 255 and hRate != 0:
-                self.hrHist[0].append(hRate)
-                self.hrHist[1].append(time.time()-initialTime)
-
-                # Check if the heart rate is decreasing and send alert if needed
-                if len(self.hrHist[0]) > 60 and hRate < np.mean(np.array(self.hrHist[0])) - 15:
-                    self.send_alert()
-        
-            print("Heart Rate: " + str(hRate))
\ No newline at end of file
+        global initialTime
+        hRate, contact, energy, rr = parse_measurement(value)
+        timestamp = time.time()-initialTime
+        self.lastHr = time.time()
+
+        # A band reporting no skin contact measures nothing
+        if contact is False:
+            hRate = 0
+        if len(rr):
+            self.rrIntervals.extend(rr)
+
+        # Save received heart rate value and the time of it
+        if hRate != 255 and hRate != 0:
+            self.hrHist.append(timestamp, hRate)
+            self.hrStore.append(timestamp, hRate)
+            if self.session.log is not None:
+                self.session.log.append(timestamp, hRate)
+            if self.exporter is not None:
+                self.exporter.append((timestamp, hRate))
+            if self.metrics is not None:
+                self.metrics.hr_sample(timestamp)
+
+            recovery = self.session.sample_received()
+            if recovery is not None:
+                output.message("First sample %.2f s after the connection was lost" % recovery, self.mac_address)
+
+        # Check the alert rules, invalid values included so that a sensor off can be detected
+        # Alerts are debounced here and delivered from the dispatcher thread
+        alert = self.alerts.update(self.rules.update(timestamp, hRate), time.time(), hRate)
+        if alert is not None:
+            alerts.get_dispatcher().submit(alert, self.send_alert)
+
+        output.sample(hRate, time.time(), self.mac_address)
\ No newline at end of file
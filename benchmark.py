@@ -0,0 +1,536 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Benchmark script
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from stats import RunningStats
+from chunked import ChunkedEncoder, ChunkedDecoder
+from handshake import TinyEcdhBackend, NativeEcdhBackend, KeyPool, get_backend, auth_response
+from const import AUTH
+from activity import ActivityParser
+from history import HrHistory
+from timeseries import TimeSeriesStore
+from heartrate import parse_measurement, parse_measurements, pack
+from rawsensor import RawCapture, decode_packets, ACCEL_DTYPE, PPG_DTYPE
+
+# Results of the benchmarks run so far, written by --json
+results = []
+
+def report(name, value, unit, text, **params):
+
+    """ Print a result and keep it for the machine-readable output
+        Every value is a cost, so lower is better
+
+    Arguments:
+    str   name: Benchmark name
+    float value: Measured cost
+    str   unit: Unit of the cost
+    str   text: Line printed for humans
+    dict  params: Parameters that identify the measure within the benchmark """
+
+    results.append({'name': name, 'params': params, 'value': value, 'unit': unit})
+    print(text)
+
+# -----------------------------------------------------------------------------
+# Benchmarks
+# -----------------------------------------------------------------------------
+
+def bench_running_stats(sizes=(10000, 100000, 1000000), window=0):
+
+    """ Measure the per-sample cost of the heart rate statistics
+        The cost should stay constant whatever the session length
+
+    Arguments:
+    tuple sizes: Number of samples of each run
+    int   window: Sliding window used by the statistics """
+
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        samples = rng.integers(50, 180, size).tolist()
+        stats = RunningStats(window=window)
+        start = time.perf_counter()
+        for hRate in samples:
+            stats.update(hRate)
+            if stats.count > 60 and hRate < stats.mean - 15:
+                pass
+        elapsed = time.perf_counter() - start
+        report("running_stats", elapsed / size * 1e9, "ns/sample",
+               "RunningStats window=%d samples=%d: %.1f ns/sample" % (window, size, elapsed / size * 1e9),
+               window=window, samples=size)
+
+def legacy_chunked_frames(handle, data):
+
+    """ Chunked transfer framing used before the shared codec (MTU 23)
+        Kept as reference to check that the frames did not change
+
+    Arguments:
+    int   handle: Identify the packages
+    bytes[] data: Data to send to the band """
+
+    frames = []
+    remaining = len(data)
+    count = 0
+    header_size = 11
+    mMTU = 23
+
+    while remaining > 0:
+        MAX_CHUNKLENGTH = mMTU - 3 - header_size
+        copybytes = min(remaining, MAX_CHUNKLENGTH)
+        chunk = np.zeros(copybytes + header_size,dtype=np.uint8)
+
+        flags = 0
+
+        if count == 0:
+            flags |= 0x01
+            chunk[5] = len(data) & 0xff
+            chunk[6] = (len(data) >> 8) & 0xff
+            chunk[7] = (len(data) >> 16) & 0xff
+            chunk[8] = (len(data) >> 24) & 0xff
+            chunk[9] = 0x82 & 0xff
+            chunk[10] = (0x82 >> 8) & 0xff
+        if remaining <= MAX_CHUNKLENGTH:
+            flags |= 0x06
+        chunk[0] = 0x03
+        chunk[1] = flags
+        chunk[2] = 0
+        chunk[3] = handle
+        chunk[4] = count
+
+        chunk[header_size:] = data[len(data) - remaining:len(data) - remaining + copybytes]
+        frames.append(chunk.tolist())
+        remaining -= copybytes
+        header_size = 5
+        count += 1
+
+    return frames
+
+def bench_chunked(sizes=(52, 512, 2048), mtus=(23, 185, 247), repeat=200):
+
+    """ Check the chunked transfer codec against the legacy framing
+        and measure encoding and reassembly throughput for several MTUs
+
+    Arguments:
+    tuple sizes: Message sizes in bytes
+    tuple mtus: MTUs used to split the messages
+    int   repeat: Number of messages encoded per measure """
+
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        data = rng.integers(0, 256, size, dtype=np.uint8)
+
+        # Frames must match the legacy format and decode back to the same data
+        frames = [list(f) for f in ChunkedEncoder(23).encode(1, data)]
+        assert frames == legacy_chunked_frames(1, data), "Frames differ from legacy format"
+
+        start = time.perf_counter()
+        for _ in range(max(1, repeat // 10)):
+            legacy_chunked_frames(1, data)
+        elapsed = (time.perf_counter() - start) / max(1, repeat // 10)
+        report("chunked_legacy_encode", elapsed * 1e6, "us/message",
+               "Legacy encode size=%d mtu=23: %d writes, %.1f us/message" % (size, len(frames), elapsed * 1e6),
+               size=size, mtu=23)
+
+        for mtu in mtus:
+            encoder = ChunkedEncoder(mtu)
+            decoder = ChunkedDecoder()
+            frames = [bytes(f) for f in encoder.encode(1, data)]
+            for f in frames:
+                message = decoder.feed(f)
+            assert message is not None and bytes(message) == data.tobytes(), "Round trip failed"
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                encoder.encode(1, data)
+            encode = (time.perf_counter() - start) / repeat
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for f in frames:
+                    decoder.feed(f)
+            decode = (time.perf_counter() - start) / repeat
+
+            report("chunked_encode", encode * 1e6, "us/message",
+                   "Chunked size=%d mtu=%d: %d writes, encode %.1f us/message" % (size, mtu, len(frames), encode * 1e6),
+                   size=size, mtu=mtu)
+            report("chunked_decode", decode * 1e6, "us/message",
+                   "Chunked size=%d mtu=%d: %d writes, decode %.1f us/message" % (size, mtu, len(frames), decode * 1e6),
+                   size=size, mtu=mtu)
+
+def bench_handshake(repeat=20, auth_key="00112233445566778899aabbccddeeff"):
+
+    """ Measure the connect-to-authenticated computation of the handshake
+        for every available ECDH backend, with and without the key pool
+        Radio time is not included, only the work done on the host
+
+    Arguments:
+    int   repeat: Number of handshakes per measure
+    str   auth_key: Authentication key used by the simulated band """
+
+    for name in (NativeEcdhBackend.name, TinyEcdhBackend.name):
+        try:
+            backend = get_backend(name)
+        except RuntimeError:
+            print("Handshake backend=%s: not available" % name)
+            continue
+
+        # Simulated band side: its key pair and the frames of its 1st auth reply
+        bandPrivate, bandPublic = backend.generate_keys()
+        remoteRandom = np.random.default_rng(0).integers(0, 256, 16, dtype=np.uint8).tobytes()
+        reply = [bytes(f) for f in ChunkedEncoder().encode(0, AUTH.KEYS_RECEIVED + remoteRandom + bandPublic.tobytes())]
+
+        for pooled in (False, True):
+            pool = KeyPool(backend, size=repeat) if pooled else None
+            if pooled:
+                while not pool.keys.full():
+                    time.sleep(0.01)
+
+            encoder = ChunkedEncoder()
+            decoder = ChunkedDecoder()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                privateKey, publicKey = pool.get() if pooled else backend.generate_keys()
+                encoder.encode(0, b'\x04\x02\x00\x02' + publicKey.tobytes())
+                for f in reply:
+                    message = decoder.feed(f)
+                command = auth_response(backend, privateKey, auth_key, message[3:19], message[19:67])
+                encoder.encode(1, command)
+            elapsed = (time.perf_counter() - start) / repeat
+            report("handshake", elapsed * 1e3, "ms",
+                   "Handshake backend=%s pool=%s: %.2f ms connect-to-authenticated" % (name, pooled, elapsed * 1e3),
+                   backend=name, pool=pooled)
+
+def bench_activity(packets=100000, sample_size=4):
+
+    """ Measure decoding of Mi Band 7 activity packets
+        One day of history is 1440 records, so this is several weeks
+
+    Arguments:
+    int   packets: Number of packets decoded
+    int   sample_size: Bytes of each record """
+
+    rng = np.random.default_rng(0)
+    records = (20 - 3) // sample_size
+    payloads = [bytes([i & 0xff]) + rng.integers(0, 256, records * sample_size, dtype=np.uint8).tobytes()
+                for i in range(256)]
+
+    parser = ActivityParser(sample_size=sample_size)
+    parser.start(0.0)
+    start = time.perf_counter()
+    for i in range(packets):
+        parser.feed(payloads[i & 0xff])
+    elapsed = time.perf_counter() - start
+    report("activity", elapsed / packets * 1e6, "us/packet",
+           "Activity packets=%d records=%d: %.2f us/packet, %.0f records/sec" % (
+               packets, parser.count, elapsed / packets * 1e6, parser.count / elapsed),
+           packets=packets, sample_size=sample_size)
+
+def simulated_band6(mac_address, history_capacity=3600):
+
+    """ Return a Mi Band 6 connected and authenticated to a simulated band
+        The gatt module is replaced by the simulator, so this never uses Bluetooth
+
+    Arguments:
+    str   mac_address: MAC address of the simulated band
+    int   history_capacity: Number of heart rate samples kept in memory """
+
+    import simulator
+    simulator.install()
+    import commands
+    from band6 import MiBand6
+
+    authKey = "00112233445566778899aabbccddeeff"
+    manager = simulator.FakeDeviceManager()
+    commands.set_timer(lambda ms, f: manager.timeout_add(ms / 1000.0, f))
+    manager.add_band(simulator.SimulatedBand(mac_address, authKey, hr_rate=1e-3))
+    device = MiBand6(mac_address = mac_address, manager = manager, history_capacity = history_capacity)
+    device.connect(authKey)
+    device.enable_notifications_chunked()
+    manager.run(1.0)
+    return device
+
+def bench_hr_notifications(samples=100000, steps=5):
+
+    """ Measure the heart rate notification callback while the history grows
+        The cost should stay constant from an empty to a full history
+
+    Arguments:
+    int   samples: Number of notifications, also the history capacity
+    int   steps: Number of measures taken while the history fills """
+
+    import output
+    output.configure(open(os.devnull, "w"), maxsize=samples)
+    device = simulated_band6("00:00:00:00:BE:01", history_capacity=samples)
+
+    rng = np.random.default_rng(0)
+    values = [bytes([0x00, int(v)]) for v in rng.integers(50, 180, samples)]
+    block = samples // steps
+    for step in range(steps):
+        start = time.perf_counter()
+        for value in values[step * block:(step + 1) * block]:
+            device.characteristic_value_updated(device.charHrMeasure, value)
+        elapsed = (time.perf_counter() - start) / block
+        filled = (step + 1) * block
+        report("hr_notification", elapsed * 1e6, "us/notification",
+               "HR notification history=%d: %.2f us/notification" % (filled, elapsed * 1e6),
+               history=filled)
+    output.get_sink().close()
+
+def bench_print_hr(sizes=(3600, 86400, 604800)):
+
+    """ Measure print_hr rendering for long histories (one hour, day and week at 1 Hz)
+        Rendering is done off screen, the window is never shown
+
+    Arguments:
+    tuple sizes: Number of samples in the history """
+
+    try:
+        import matplotlib
+    except ImportError:
+        print("print_hr: matplotlib not available")
+        return
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    import output
+    output.configure(open(os.devnull, "w"))
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        device = simulated_band6("00:00:00:01:BE:%02X" % (size & 0xff), history_capacity=size)
+        values = rng.integers(50, 180, size)
+        for i in range(size):
+            device.hrHist.append(float(i), int(values[i]))
+
+        start = time.perf_counter()
+        device.print_hr()
+        plt.gcf().canvas.draw()
+        elapsed = time.perf_counter() - start
+        plt.close("all")
+        report("print_hr", elapsed * 1e3, "ms",
+               "print_hr samples=%d: %.1f ms" % (size, elapsed * 1e3), samples=size)
+    output.get_sink().close()
+
+def bench_store(samples=604800, queries=100):
+
+    """ Measure the time series store: cost of a sample and of the per minute
+        min/mean/max of the last 6 hours, compared with a scan of the history
+
+    Arguments:
+    int   samples: Number of samples, one per second (a week by default)
+    int   queries: Number of queries measured """
+
+    values = np.random.default_rng(0).integers(50, 180, samples)
+    store = TimeSeriesStore(capacity=samples)
+    history = HrHistory(capacity=samples)
+
+    start = time.perf_counter()
+    for i, hRate in enumerate(values.tolist()):
+        store.append(float(i), hRate)
+    elapsed = time.perf_counter() - start
+    report("store_append", elapsed / samples * 1e6, "us/sample",
+           "TimeSeriesStore append samples=%d: %.2f us/sample" % (samples, elapsed / samples * 1e6), samples=samples)
+
+    # Summaries must match a scan of the samples, the store keeping more samples than the 1 s rollup
+    rng = np.random.default_rng(1)
+    for begin, end in np.sort(rng.uniform(0, samples, (queries, 2)), axis=1):
+        summary, hr = store.summary(begin, end), store.range(begin, end)['hr']
+        assert summary['count'] == len(hr), "Summary differs from the samples"
+        if len(hr):
+            assert (summary['min'], summary['max']) == (hr.min(), hr.max()), "Summary differs from the samples"
+            assert abs(summary['mean'] - hr.mean()) < 1e-9, "Summary differs from the samples"
+
+    for i, hRate in enumerate(values.tolist()):
+        history.append(float(i), hRate)
+
+    end = float(samples)
+    begin = end - 6 * 3600
+    start = time.perf_counter()
+    for _ in range(queries):
+        store.rollup(60, begin, end)
+    elapsed = (time.perf_counter() - start) / queries
+    report("store_query", elapsed * 1e6, "us/query",
+           "TimeSeriesStore 6 h per minute: %.1f us/query" % (elapsed * 1e6), samples=samples)
+
+    start = time.perf_counter()
+    for _ in range(queries):
+        hr, times = history.arrays()
+        selected = (times >= begin) & (times < end)
+        minutes = (times[selected] // 60).astype(np.int64)
+        np.bincount(minutes - minutes[0], weights=hr[selected])
+    elapsed = (time.perf_counter() - start) / queries
+    report("history_scan", elapsed * 1e6, "us/query",
+           "HrHistory scan 6 h per minute: %.1f us/query" % (elapsed * 1e6), samples=samples)
+
+def bench_hr_parser(packets=100000):
+
+    """ Measure the decoding of raw Heart Rate Measurement notifications,
+        one at a time as in the callback and all at once as for recorded notifications
+
+    Arguments:
+    int   packets: Number of notifications decoded """
+
+    rng = np.random.default_rng(0)
+    kinds = {
+        'plain': lambda hr: bytes([0x00, hr]),
+        'rr': lambda hr: bytes([0x16, hr]) + rng.integers(600, 1100, 2).astype('<u2').tobytes(),
+        'full': lambda hr: bytes([0x1f, hr, 0]) + rng.integers(0, 1000, 1).astype('<u2').tobytes() +
+                           rng.integers(600, 1100, 7).astype('<u2').tobytes(),
+    }
+    for kind, make in kinds.items():
+        values = [make(int(hr)) for hr in rng.integers(50, 180, packets)]
+
+        start = time.perf_counter()
+        for value in values:
+            parse_measurement(value)
+        elapsed = time.perf_counter() - start
+        report("hr_parse", elapsed / packets * 1e9, "ns/packet",
+               "HR parse %s: %.0f ns/packet" % (kind, elapsed / packets * 1e9), kind=kind)
+
+        data, lengths = pack(values)
+        start = time.perf_counter()
+        parse_measurements(data, lengths)
+        elapsed = time.perf_counter() - start
+        report("hr_parse_batch", elapsed / packets * 1e9, "ns/packet",
+               "HR batch parse %s: %.1f ns/packet" % (kind, elapsed / packets * 1e9), kind=kind)
+
+def bench_raw_sensor(packets=100000, batch=512):
+
+    """ Measure the raw sensor capture: cost of a packet in the notification callback
+        and bulk decoding of the packets by the writer thread
+
+    Arguments:
+    int   packets: Number of raw packets
+    int   batch: Packets decoded at once """
+
+    import tempfile
+    rng = np.random.default_rng(0)
+    payload = rng.integers(0, 256, (packets, 18), dtype=np.uint8)
+    values = [bytes([1 + i % 2, i // 2 & 0xff]) + payload[i].tobytes() for i in range(packets)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        capture = RawCapture(directory, "00:00:00:00:BE:02", packets=batch)
+        start = time.perf_counter()
+        for value in values:
+            capture.append(value)
+        elapsed = time.perf_counter() - start
+        capture.close()
+    report("raw_append", elapsed / packets * 1e6, "us/packet",
+           "Raw capture callback: %.2f us/packet" % (elapsed / packets * 1e6), batch=batch)
+
+    data = np.frombuffer(b''.join(values), dtype=np.uint8).reshape(packets, 20)
+    lengths = np.full(packets, 20, dtype=np.uint8)
+    times = np.arange(packets, dtype=np.float64)
+    accel = np.zeros(batch * 3, dtype=ACCEL_DTYPE)
+    ppg = np.zeros(batch * 9, dtype=PPG_DTYPE)
+    start = time.perf_counter()
+    for first in range(0, packets, batch):
+        decode_packets(data[first:first + batch], lengths[first:first + batch], times[first:first + batch], accel, ppg)
+    elapsed = time.perf_counter() - start
+    report("raw_decode", elapsed / packets * 1e9, "ns/packet",
+           "Raw bulk decode: %.0f ns/packet" % (elapsed / packets * 1e9), batch=batch)
+
+def result_key(result):
+
+    """ Identify a result so that runs of different commits can be matched
+
+    Arguments:
+    dict  result: Result of a benchmark """
+
+    return result['name'] + json.dumps(result['params'], sort_keys=True)
+
+def compare(baseline, tolerance=0.2):
+
+    """ Compare the results of this run with the results of another one
+        Returns the number of regressions
+
+    Arguments:
+    dict  baseline: Results written by --json in a previous run
+    float tolerance: Relative increase of a cost counted as a regression """
+
+    previous = {result_key(r): r['value'] for r in baseline['results']}
+    regressions = 0
+    print("Compared with commit %s:" % baseline.get('commit'))
+    for result in results:
+        old = previous.get(result_key(result))
+        if not old:
+            continue
+        ratio = result['value'] / old
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        print("%s %s: %.3g -> %.3g %s (x%.2f)%s" % (result['name'], json.dumps(result['params'], sort_keys=True),
+                                                    old, result['value'], result['unit'], ratio, flag))
+    return regressions
+
+def git_commit():
+
+    """ Return the commit of the working tree, or None outside a git repository """
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+BENCHMARKS = ('stats', 'chunked', 'handshake', 'activity', 'hr', 'plot', 'store', 'parse', 'raw')
+
+def main():
+
+    """ Main function
+        Runs the selected benchmarks, prints the results and optionally
+        writes them as JSON or compares them with a previous run """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--window', type=int, default=0, help='Sliding window used by the statistics')
+    parser.add_argument('-s', '--select', action='append', choices=BENCHMARKS, help='Benchmark to run (default: all)')
+    parser.add_argument('-j', '--json', default=None, help='File where the results are written as JSON')
+    parser.add_argument('-c', '--compare', default=None, help='JSON results of a previous run to compare with')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2, help='Relative slowdown reported as a regression')
+    args = parser.parse_args()
+    if args.window != 0 and args.window < 2:
+        parser.error("the window (-w) must be 0 or at least 2 samples")
+
+    selected = args.select or BENCHMARKS
+    if 'stats' in selected:
+        bench_running_stats(window=args.window)
+    if 'chunked' in selected:
+        bench_chunked()
+    if 'handshake' in selected:
+        bench_handshake()
+    if 'activity' in selected:
+        bench_activity()
+    if 'hr' in selected:
+        bench_hr_notifications()
+    if 'plot' in selected:
+        bench_print_hr()
+    if 'store' in selected:
+        bench_store()
+    if 'parse' in selected:
+        bench_hr_parser()
+    if 'raw' in selected:
+        bench_raw_sensor()
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({'commit': git_commit(), 'time': time.time(), 'python': sys.version.split()[0],
+                       'machine': platform.machine(), 'numpy': np.__version__, 'results': results}, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, args.tolerance) > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Chunked transfer codec script
+
+DEFAULT_MTU = 23
+
+# Frame layout: type, flags, 0, handle, count (+ length and 0x82 0x00 on the first frame)
+FRAME_TYPE = 0x03
+FIRST_HEADER_SIZE = 11
+HEADER_SIZE = 5
+FLAG_FIRST = 0x01
+FLAG_LAST = 0x06
+
+def negotiated_mtu(characteristic, default=DEFAULT_MTU):
+
+    """ Read the MTU negotiated by BlueZ for a characteristic
+        Older BlueZ versions do not expose it, so the default is used instead
+
+    Arguments:
+    gatt.Characteristic characteristic: Characteristic used to write the frames
+    int   default: MTU used when it can not be read """
+
+    try:
+        return int(characteristic._properties.Get('org.bluez.GattCharacteristic1', 'MTU'))
+    except Exception:
+        return default
+
+# -----------------------------------------------------------------------------
+# Chunked Encoder Class
+# -----------------------------------------------------------------------------
+
+class ChunkedEncoder(object):
+
+    def __init__(self, mtu=DEFAULT_MTU):
+
+        """ Split messages into chunked transfer frames
+
+        Arguments:
+        int   mtu: ATT MTU of the connection """
+
+        self.buffer = bytearray(256)
+        self.set_mtu(mtu)
+
+    def set_mtu(self, mtu):
+
+        """ Change the MTU used to size the frames
+
+        Arguments:
+        int   mtu: ATT MTU of the connection """
+
+        # Leave room for the ATT write header and at least one payload byte
+        self.mtu = max(int(mtu), FIRST_HEADER_SIZE + 4)
+
+    def encode(self, handle, data):
+
+        """ Split data into frames
+            Every frame is a memoryview over the same buffer, valid until the next call
+
+        Arguments:
+        int   handle: Identify the packages
+        bytes[] data: Data to send to the band """
+
+        data = memoryview(data).cast('B')
+        length = len(data)
+        maxFrame = self.mtu - 3
+        frameCount = max(1, -(-(length + FIRST_HEADER_SIZE - HEADER_SIZE) // (maxFrame - HEADER_SIZE)))
+        size = length + FIRST_HEADER_SIZE + (frameCount - 1) * HEADER_SIZE
+
+        if len(self.buffer) < size:
+            self.buffer = bytearray(size)
+        view = memoryview(self.buffer)
+
+        frames = []
+        pointer = offset = count = 0
+        headerSize = FIRST_HEADER_SIZE
+        while True:
+            copybytes = min(length - offset, maxFrame - headerSize)
+            flags = FLAG_FIRST if count == 0 else 0
+            if offset + copybytes >= length:
+                flags |= FLAG_LAST
+
+            view[pointer:pointer + HEADER_SIZE] = bytes((FRAME_TYPE, flags, 0, handle & 0xff, count & 0xff))
+            if count == 0:
+                view[pointer + 5:pointer + 11] = length.to_bytes(4, "little") + b'\x82\x00'
+            view[pointer + headerSize:pointer + headerSize + copybytes] = data[offset:offset + copybytes]
+
+            frames.append(view[pointer:pointer + headerSize + copybytes])
+            pointer += headerSize + copybytes
+            offset += copybytes
+            headerSize = HEADER_SIZE
+            count += 1
+            if offset >= length:
+                return frames
+
+# -----------------------------------------------------------------------------
+# Chunked Decoder Class
+# -----------------------------------------------------------------------------
+
+class ChunkedDecoder(object):
+
+    def __init__(self, capacity=256):
+
+        """ Reassemble chunked transfer frames received from the band
+
+        Arguments:
+        int   capacity: Initial size of the reassembly buffer """
+
+        self.buffer = bytearray(capacity)
+        self.expected = self.pointer = self.lastNumber = 0
+        self.gap = False
+
+    def feed(self, value):
+
+        """ Add a received frame to the message being reassembled
+            Returns a memoryview of the message when it is complete, or None
+            The message is valid until the next frame is fed
+            Sets gap when the frame was not the expected one
+
+        Arguments:
+        bytes[] value: Frame received from the band """
+
+        frame = memoryview(value)
+        self.gap = False
+        if len(frame) < HEADER_SIZE or frame[0] != FRAME_TYPE:
+            return None
+
+        flags = frame[1]
+        sequenceNumber = frame[4]
+
+        if flags & FLAG_FIRST:
+            if len(frame) < FIRST_HEADER_SIZE:
+                return None
+            self.expected = int.from_bytes(frame[5:9], "little")
+            self.pointer = 0
+            headerSize = FIRST_HEADER_SIZE
+            if len(self.buffer) < self.expected:
+                self.buffer = bytearray(self.expected)
+        else:
+            if sequenceNumber != (self.lastNumber + 1) & 0xff:
+                self.gap = True
+            headerSize = HEADER_SIZE
+        self.lastNumber = sequenceNumber
+
+        copybytes = min(len(frame) - headerSize, self.expected - self.pointer)
+        self.buffer[self.pointer:self.pointer + copybytes] = frame[headerSize:headerSize + copybytes]
+        self.pointer += copybytes
+
+        if copybytes > 0 and self.pointer == self.expected:
+            return memoryview(self.buffer)[:self.expected]
+
+        return None
@@ -0,0 +1,235 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# GATT command queue script
+
+import threading
+from collections import deque
+import output
+
+GATT_INTERFACE = 'org.bluez.GattCharacteristic1'
+
+# Timer used by the queues, like GObject.timeout_add(milliseconds, function)
+timer = None
+
+def set_timer(function):
+
+    """ Replace the timer used by the queues, e.g. by the simulator
+
+    Arguments:
+    function function: Called as function(milliseconds, callback) """
+
+    global timer
+    timer = function
+
+def get_timer():
+
+    """ Return the timer used by the queues (GObject.timeout_add by default) """
+
+    global timer
+    if timer is None:
+        from gi.repository import GObject
+        timer = GObject.timeout_add
+    return timer
+
+def write_without_response(characteristic):
+
+    """ Check if a characteristic accepts writes without response
+
+    Arguments:
+    gatt.Characteristic characteristic: Characteristic to check """
+
+    try:
+        return 'write-without-response' in characteristic._properties.Get(GATT_INTERFACE, 'Flags')
+    except Exception:
+        return False
+
+# -----------------------------------------------------------------------------
+# Command Queue Class
+# -----------------------------------------------------------------------------
+
+class CommandQueue(object):
+
+    def __init__(self, device, pace=0, timeout=2000, retries=2):
+
+        """ Serialise the writes to a band from the event loop
+            Only one write is in flight; the next one starts when BlueZ answers.
+            A command with the same key as one still waiting replaces it,
+            and characteristics that allow it are written without response
+
+        Arguments:
+        gatt.Device device: Band the commands are written to
+        int   pace: Milliseconds between writes without response
+        int   timeout: Milliseconds before a write without answer is retried
+        int   retries: Attempts after a failed write """
+
+        self.device = device
+        self.pace = pace
+        self.timeout = timeout
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.sequence = 0
+
+        self.writes = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.reset()
+
+    def reset(self):
+
+        """ Drop every command, used when the connection changes """
+
+        with self.lock:
+            self.pending = deque()
+            self.keys = {}
+            self.current = None
+            self.scheduled = False
+            self.flags = {}
+
+    def write(self, characteristic, value, key=None):
+
+        """ Queue a write, safe to call from any thread
+            The value is copied, so reused buffers can be given
+
+        Arguments:
+        gatt.Characteristic characteristic: Characteristic written
+        bytes[] value: Value to write
+        object key: Commands with the same key replace each other while waiting """
+
+        command = [characteristic, bytes(value), key, 0]
+        with self.lock:
+            if key is not None and key in self.keys:
+                self.keys[key][1] = command[1]
+                self.coalesced += 1
+                return
+            if key is not None:
+                self.keys[key] = command
+            self.pending.append(command)
+            start = self.current is None and not self.scheduled
+            self.scheduled = self.scheduled or start
+
+        # Writes always start from the event loop, never from the caller
+        if start:
+            get_timer()(0, self.next)
+
+    def next(self):
+
+        """ Start the next write if none is in flight
+            Returns False so it can be used as a GObject timeout callback """
+
+        with self.lock:
+            self.scheduled = False
+            if self.current is not None or not self.pending:
+                return False
+            command = self.current = self.pending.popleft()
+            if command[2] is not None:
+                del self.keys[command[2]]
+            self.sequence += 1
+            sequence = self.sequence
+
+        self.send(command, sequence)
+        return False
+
+    def send(self, command, sequence):
+
+        """ Write a command to the band
+            Answers carry the number of the write, so late ones are ignored
+
+        Arguments:
+        list  command: Characteristic, value, key and attempt of the command
+        int   sequence: Number of the write, used to ignore late answers and timeouts """
+
+        characteristic, value = command[0], command[1]
+        self.writes += 1
+        try:
+            uuid = characteristic.uuid
+            if uuid not in self.flags:
+                self.flags[uuid] = write_without_response(characteristic)
+
+            if self.flags[uuid]:
+                characteristic._object.WriteValue(value, {'type': 'command'},
+                                                  reply_handler=lambda: self.command_sent(sequence),
+                                                  error_handler=lambda e: self.failed(e, sequence),
+                                                  dbus_interface=GATT_INTERFACE)
+            else:
+                characteristic._object.WriteValue(value, {'type': 'request'},
+                                                  reply_handler=lambda: self.completed(sequence),
+                                                  error_handler=lambda e: self.failed(e, sequence),
+                                                  dbus_interface=GATT_INTERFACE)
+        except Exception as e:
+            self.failed(e, sequence)
+            return
+
+        get_timer()(self.timeout, lambda: self.timed_out(sequence))
+
+    def command_sent(self, sequence):
+
+        """ Write without response accepted by BlueZ, the next one starts after the pace delay
+
+        Arguments:
+        int   sequence: Number of the write """
+
+        with self.lock:
+            if sequence != self.sequence or self.current is None:
+                return
+            self.current = None
+            self.scheduled = True
+        get_timer()(self.pace, self.next)
+
+    def completed(self, sequence):
+
+        """ Write acknowledged by the band, start the next one
+
+        Arguments:
+        int   sequence: Number of the write """
+
+        with self.lock:
+            if sequence != self.sequence or self.current is None:
+                return
+            self.current = None
+            self.scheduled = True
+        get_timer()(0, self.next)
+
+    def failed(self, error, sequence):
+
+        """ Retry the write in flight, or drop it after the last attempt
+            A retried command can still be replaced by newer ones with the same key
+
+        Arguments:
+        Exception error: Error of the write
+        int   sequence: Number of the write """
+
+        with self.lock:
+            command = self.current
+            if command is None or sequence != self.sequence:
+                return
+            self.current = None
+            self.scheduled = True
+            command[3] += 1
+            if command[2] is not None and command[2] in self.keys:
+                # A newer value with the same key is already waiting and replaces the retry
+                self.coalesced += 1
+            elif command[3] <= self.retries:
+                self.pending.appendleft(command)
+                if command[2] is not None:
+                    self.keys[command[2]] = command
+            else:
+                self.failures += 1
+                command = None
+
+        if command is None:
+            output.message("Write failed: " + str(error), self.device.mac_address)
+        get_timer()(0, self.next)
+
+    def timed_out(self, sequence):
+
+        """ Retry a write that got no answer
+
+        Arguments:
+        int   sequence: Number of the write """
+
+        self.failed("no answer after %d ms" % self.timeout, sequence)
+        return False
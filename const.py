@@ -6,7 +6,7 @@
 # -----------------------------------------------------------------------------
 # Script to store Mi Band constants
 
-___all__ = ['UUIDS']
+___all__ = ['UUIDS', 'AUTH']
 
 class Immutable(type):
 
@@ -56,4 +56,9 @@ class UUIDS(object):
     CHARACTERISTIC_HRDW_REVISION = 0x2a27
     ADVERTISEMENT_SERVICE = 0xFEE0
 
-    
+class AUTH(object):
+
+    __metaclass__ = Immutable
+
+    KEYS_RECEIVED = b'\x10\x04\x01'
+    SUCCESS = b'\x10\x05\x01'
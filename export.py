@@ -0,0 +1,346 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Columnar export script
+
+import argparse
+import atexit
+import itertools
+import os
+import queue
+import threading
+import time
+import numpy as np
+from history import HR_DTYPE
+from activity import ACTIVITY_DTYPE
+
+FORMATS = ('csv', 'parquet', 'arrow')
+
+# Columns of every kind of export
+DTYPES = {'hr': HR_DTYPE, 'activity': ACTIVITY_DTYPE}
+
+def csv_formats(dtype):
+
+    """ printf formats of the columns of a structured type
+
+    Arguments:
+    np.dtype dtype: Type of the records """
+
+    return ['%.6f' if dtype[name].kind == 'f' else '%d' for name in dtype.names]
+
+# -----------------------------------------------------------------------------
+# Columnar File Class
+# -----------------------------------------------------------------------------
+
+class ColumnarFile(object):
+
+    def __init__(self, path, dtype, fmt='csv'):
+
+        """ File written one batch of records at a time
+            Each batch is a row group in Parquet and a record batch in Arrow
+            pyarrow is only needed, and imported, for those two formats
+
+        Arguments:
+        str   path: File to create
+        np.dtype dtype: Type of the records
+        str   fmt: Format of the file: csv, parquet or arrow """
+
+        if fmt not in FORMATS:
+            raise ValueError("Unknown export format " + fmt)
+
+        self.path = path
+        self.dtype = dtype
+        self.fmt = fmt
+        self.rows = 0
+
+        if fmt == 'csv':
+            self.file = open(path, "w")
+            self.file.write(",".join(dtype.names) + "\n")
+            self.formats = csv_formats(dtype)
+            return
+
+        try:
+            import pyarrow
+        except ImportError:
+            raise RuntimeError("pyarrow is needed to export " + fmt)
+
+        self.pa = pyarrow
+        self.schema = pyarrow.schema([(name, pyarrow.from_numpy_dtype(dtype[name])) for name in dtype.names])
+        if fmt == 'parquet':
+            import pyarrow.parquet
+            self.file = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            import pyarrow.ipc
+            self.file = pyarrow.ipc.new_file(path, self.schema)
+
+    def write(self, records):
+
+        """ Append a batch of records
+
+        Arguments:
+        ndarray records: Structured array of the records """
+
+        if len(records) == 0:
+            return
+        self.rows += len(records)
+
+        if self.fmt == 'csv':
+            np.savetxt(self.file, records, fmt=self.formats, delimiter=",")
+            self.file.flush()
+            return
+
+        columns = [self.pa.array(records[name]) for name in self.dtype.names]
+        batch = self.pa.RecordBatch.from_arrays(columns, schema=self.schema)
+        if self.fmt == 'parquet':
+            self.file.write_table(self.pa.Table.from_batches([batch]))
+        else:
+            self.file.write_batch(batch)
+
+    def close(self):
+
+        """ Finish the file """
+
+        self.file.close()
+
+# -----------------------------------------------------------------------------
+# Columnar Exporter Class
+# -----------------------------------------------------------------------------
+
+class ColumnarExporter(object):
+
+    def __init__(self, directory, prefix, dtype, fmt='csv', batch=4096, interval=60.0, rotate=3600.0):
+
+        """ Stream records of a band to columnar files
+            Records are gathered in a preallocated array and written in batches
+            by a background thread, which starts a new file every rotate seconds
+
+        Arguments:
+        str   directory: Directory of the files
+        str   prefix: Start of the file names, followed by the time the file was created
+        np.dtype dtype: Type of the records
+        str   fmt: Format of the files: csv, parquet or arrow
+        int   batch: Records written at once (rows of a row group)
+        float interval: Maximum seconds a record waits before being written
+        float rotate: Seconds covered by each file (0 never rotates) """
+
+        if fmt not in FORMATS:
+            raise ValueError("Unknown export format " + fmt)
+
+        self.directory = directory
+        self.prefix = prefix
+        self.dtype = dtype
+        self.fmt = fmt
+        self.interval = interval
+        self.rotate = rotate
+        self.pending = np.zeros(batch, dtype=dtype)
+        self.count = 0
+        self.lastFlush = time.time()
+        self.file = None
+        self.fileStart = 0.0
+        self.files = []
+
+        os.makedirs(directory, exist_ok=True)
+        self.batches = queue.Queue()
+        self.thread = threading.Thread(target=self.write_batches, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def append(self, record):
+
+        """ Add a record
+
+        Arguments:
+        tuple record: Values of the columns, in order """
+
+        self.pending[self.count] = record
+        self.count += 1
+
+        if self.count == len(self.pending) or time.time() - self.lastFlush >= self.interval:
+            self.flush()
+
+    def extend(self, records):
+
+        """ Add a block of records, e.g. every record of an activity packet
+
+        Arguments:
+        ndarray records: Structured array of the records """
+
+        while len(records) > 0:
+            n = min(len(records), len(self.pending) - self.count)
+            self.pending[self.count:self.count + n] = records[:n]
+            self.count += n
+            records = records[n:]
+            if self.count == len(self.pending):
+                self.flush()
+
+        if time.time() - self.lastFlush >= self.interval:
+            self.flush()
+
+    def flush(self):
+
+        """ Hand the pending records to the writer thread """
+
+        if self.count > 0:
+            self.batches.put(self.pending[:self.count].copy())
+            self.count = 0
+        self.lastFlush = time.time()
+
+    def open_file(self):
+
+        """ Close the current file and start a new one """
+
+        if self.file is not None:
+            self.file.close()
+        self.fileStart = time.time()
+        name = "%s_%s.%s" % (self.prefix, time.strftime("%Y%m%d-%H%M%S", time.localtime(self.fileStart)), self.fmt)
+        self.file = ColumnarFile(os.path.join(self.directory, name), self.dtype, self.fmt)
+        self.files.append(self.file.path)
+
+    def write_batches(self):
+
+        """ Write batches until the exporter is closed """
+
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                break
+            if self.file is None or (self.rotate > 0 and time.time() - self.fileStart >= self.rotate):
+                self.open_file()
+            self.file.write(batch)
+
+        if self.file is not None:
+            self.file.close()
+
+    def close(self):
+
+        """ Write the remaining records and close the file """
+
+        if not self.thread.is_alive():
+            return
+        self.flush()
+        self.batches.put(None)
+        self.thread.join()
+
+# Settings of the exporters, None until configure is called
+settings = None
+exporters = {}
+
+def configure(directory, fmt='csv', batch=4096, rotate=3600.0):
+
+    """ Export the samples of every band from now on
+
+    Arguments:
+    str   directory: Directory of the files
+    str   fmt: Format of the files: csv, parquet or arrow
+    int   batch: Records written at once
+    float rotate: Seconds covered by each file (0 never rotates) """
+
+    global settings
+    if fmt not in FORMATS:
+        raise ValueError("Unknown export format " + fmt)
+    if fmt != 'csv':
+        try:
+            import pyarrow
+        except ImportError:
+            raise RuntimeError("pyarrow is needed to export " + fmt)
+    settings = {'directory': directory, 'fmt': fmt, 'batch': batch, 'rotate': rotate}
+
+def get_exporter(mac_address, kind):
+
+    """ Return the exporter of a band, or None when exporting is disabled
+        The same exporter is returned after a reconnect
+
+    Arguments:
+    str   mac_address: MAC address of the band
+    str   kind: Records exported: hr or activity """
+
+    if settings is None:
+        return None
+    if (mac_address, kind) not in exporters:
+        prefix = "%s_%s" % (mac_address.replace(":", "").lower(), kind)
+        exporters[(mac_address, kind)] = ColumnarExporter(settings['directory'], prefix, DTYPES[kind], settings['fmt'],
+                                                          settings['batch'], rotate=settings['rotate'])
+    return exporters[(mac_address, kind)]
+
+# -----------------------------------------------------------------------------
+# Bulk Conversion
+# -----------------------------------------------------------------------------
+
+def read_batches(path, batch=65536):
+
+    """ Read a session log or an exported CSV file in batches
+        Returns the type of the records and an iterator over structured arrays
+
+    Arguments:
+    str   path: Session log (.hrlog) or CSV file written by the exporter
+    int   batch: Records per batch """
+
+    if path.endswith(".hrlog"):
+        from sessionlog import read_session
+        records = read_session(path)[1]
+        return HR_DTYPE, (records[i:i + batch] for i in range(0, len(records), batch))
+
+    with open(path) as f:
+        columns = tuple(f.readline().strip().split(","))
+    dtypes = [d for d in DTYPES.values() if d.names == columns]
+    if not dtypes:
+        raise ValueError(path + " has unknown columns")
+
+    def batches():
+        with open(path) as f:
+            f.readline()
+            while True:
+                # Stop at the end of the file before loadtxt warns about empty input
+                lines = list(itertools.islice(f, batch))
+                if not lines:
+                    break
+                yield np.loadtxt(lines, dtype=dtypes[0], delimiter=",", ndmin=1)
+
+    return dtypes[0], batches()
+
+def convert(path, directory, fmt='parquet', batch=65536):
+
+    """ Convert a recorded session to a columnar file without loading it whole
+        Returns the path of the new file
+
+    Arguments:
+    str   path: Session log (.hrlog) or CSV file written by the exporter
+    str   directory: Directory of the new file
+    str   fmt: Format of the new file
+    int   batch: Records per row group """
+
+    name = os.path.splitext(os.path.basename(path))[0] + "." + fmt
+    output = os.path.join(directory, name)
+    if os.path.realpath(output) == os.path.realpath(path):
+        raise ValueError("Converting " + path + " would overwrite it")
+
+    dtype, batches = read_batches(path, batch)
+    os.makedirs(directory, exist_ok=True)
+    columnar = ColumnarFile(output, dtype, fmt)
+    for records in batches:
+        columnar.write(records)
+    columnar.close()
+    return columnar.path
+
+def main():
+
+    """ Main function
+        Converts recorded sessions to columnar files """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sessions', nargs='+', help='Session logs (.hrlog) or exported CSV files')
+    parser.add_argument('-d', '--directory', default='export', help='Directory of the converted files')
+    parser.add_argument('-f', '--format', default='parquet', choices=FORMATS, help='Format of the converted files')
+    parser.add_argument('-b', '--batch', type=int, default=65536, help='Records per row group')
+    args = parser.parse_args()
+
+    for path in args.sessions:
+        start = time.perf_counter()
+        result = convert(path, args.directory, args.format, args.batch)
+        print("%s -> %s (%.2f s)" % (path, result, time.perf_counter() - start))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Multiple band monitoring script
+
+import time
+from dbus.exceptions import DBusException
+from gi.repository import GObject
+from band6 import *
+from band7 import *
+from session import get_session
+from keepalive import KeepAlive
+import output
+
+# -----------------------------------------------------------------------------
+# Band Fleet Class
+# -----------------------------------------------------------------------------
+
+def read_devices(path, band_type):
+
+    """ Read the bands to monitor from a file
+        Each line has a MAC address, an authentication key and optionally the band type
+        Empty lines and lines starting with # are ignored
+
+    Arguments:
+    str   path: File with the list of bands
+    int   band_type: Band type used when a line does not specify it """
+
+    bands = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split("#")[0].split()
+            if not fields:
+                continue
+            if len(fields) < 2:
+                raise ValueError("Missing authentication key for " + fields[0])
+            bandType = int(fields[2]) if len(fields) > 2 else band_type
+            bands.append((fields[0], fields[1], bandType))
+
+    return bands
+
+class BandFleet(object):
+
+    def __init__(self, manager, report_interval=10, keep_alive=True, **options):
+
+        """ Monitor several bands from a shared device manager and event loop
+
+        Arguments:
+        gatt.DeviceManager manager: Manager shared by every band
+        int   report_interval: Seconds between throughput reports
+        bool  keep_alive: Keep the heart rate measurement of the Mi Band 6 going
+        dict  options: Extra arguments given to the Mi Band 6 class """
+
+        self.manager = manager
+        self.reportInterval = report_interval
+        self.keepAlive = keep_alive
+        self.options = options
+
+        self.bands = {}
+        self.devices = {}
+        self.keepAlives = {}
+        self.connected = set()
+        self.lastCount = 0
+        self.lastTime = time.time()
+
+    def add(self, mac_address, auth_key, band_type):
+
+        """ Add a band to the fleet
+
+        Arguments:
+        str   mac_address: MAC address of the band
+        str   auth_key: Authentication key of the band
+        int   band_type: Type of Mi Band """
+
+        self.bands[mac_address] = (auth_key.strip(), int(band_type))
+
+    def connect(self, mac_address):
+
+        """ Start connecting a band, without blocking the event loop for the other bands
+            The device of the band is created once and reused after a drop
+
+        Arguments:
+        str   mac_address: MAC address of the band """
+
+        authKey, bandType = self.bands[mac_address]
+        device = self.devices.get(mac_address)
+        if device is None:
+            if bandType == 6:
+                device = MiBand6(mac_address = mac_address, manager = self.manager, **self.options)
+            else:
+                device = MiBand7(mac_address = mac_address, manager = self.manager)
+            device.disconnectCallback = self.device_disconnected
+            device.authCallback = self.device_authenticated
+            device.connectCallback = self.device_connected
+            device.connectFailedCallback = self.device_failed
+            self.devices[mac_address] = device
+
+        try:
+            device.connect_async(authKey)
+        except DBusException as e:
+            device.pendingSetup = False
+            self.device_failed(device, e)
+
+        # Returning False stops GObject from calling it again
+        return False
+
+    def device_connected(self, device):
+
+        """ Start the authentication of a band once it is connected
+
+        Arguments:
+        MiBand6/MiBand7 device: Band that was connected """
+
+        mac_address = device.mac_address
+        try:
+            device.enable_notifications_chunked()
+        except AttributeError as e:
+            get_session(mac_address).forget()
+            self.device_failed(device, e)
+            return
+
+        self.connected.add(mac_address)
+        output.message("Connected to " + mac_address, mac_address)
+
+        # One keep-alive per band, resumed once the band is authenticated
+        if self.keepAlive and isinstance(device, MiBand6) and mac_address not in self.keepAlives:
+            self.keepAlives[mac_address] = KeepAlive(device)
+
+    def device_failed(self, device, error):
+
+        """ Schedule a new connection attempt with backoff
+
+        Arguments:
+        MiBand6/MiBand7 device: Band that could not be connected
+        Exception error: Error of the attempt """
+
+        mac_address = device.mac_address
+        session = get_session(mac_address)
+        output.message(f"Failed to connect to device {mac_address}: {error}", mac_address)
+        session.dropped()
+        delay = session.backoff.next_delay()
+        output.message(f"Retrying in {delay:.1f} s...", mac_address)
+        GObject.timeout_add(int(delay * 1000), self.connect, mac_address)
+
+    def device_disconnected(self, device):
+
+        """ Reconnect a band that lost its connection
+
+        Arguments:
+        MiBand6/MiBand7 device: Band that was disconnected """
+
+        output.message("Connection lost with " + device.mac_address, device.mac_address)
+        self.connected.discard(device.mac_address)
+        if device.mac_address in self.keepAlives:
+            self.keepAlives[device.mac_address].stop()
+        get_session(device.mac_address).dropped()
+        GObject.idle_add(self.connect, device.mac_address)
+
+    def device_authenticated(self, device):
+
+        """ Resume the keep-alive of a band once it measures again
+
+        Arguments:
+        MiBand6/MiBand7 device: Band that was authenticated """
+
+        if device.mac_address in self.keepAlives:
+            self.keepAlives[device.mac_address].start()
+
+    def notifications(self):
+
+        """ Total notifications received from every band """
+
+        return sum(d.notifCount for d in self.devices.values())
+
+    def report(self):
+
+        """ Print aggregate throughput of the fleet since the last report """
+
+        now = time.time()
+        count = self.notifications()
+        rate = (count - self.lastCount) / max(now - self.lastTime, 1e-9)
+        self.lastCount = count
+        self.lastTime = now
+
+        output.message("Fleet: %d/%d bands connected, %.1f notifications/sec" % (len(self.connected), len(self.bands), rate))
+        return True
+
+    def run(self):
+
+        """ Connect every band and run the shared event loop """
+
+        for mac in self.bands:
+            self.connect(mac)
+
+        GObject.timeout_add(self.reportInterval * 1000, self.report)
+        self.manager.run()
+
+    def stop(self):
+
+        """ Disconnect every band and stop the event loop """
+
+        for keepAlive in self.keepAlives.values():
+            keepAlive.stop()
+        for device in self.devices.values():
+            device.disconnectCallback = None
+            if device.mac_address in self.connected:
+                device.disconnect()
+        self.connected.clear()
+        self.manager.stop()
@@ -0,0 +1,205 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Authentication handshake script
+
+import queue
+import threading
+import numpy as np
+from Crypto.Cipher import AES
+
+try:
+    from cryptography.hazmat.primitives.asymmetric import ec
+except ImportError:
+    ec = None
+
+try:
+    import ecdh as tinyEcdh
+except ImportError:
+    tinyEcdh = None
+
+# Size in bytes of a B-163 field element as stored by tiny-ECDH (6 little-endian words)
+ELEMENT_SIZE = 24
+
+# -----------------------------------------------------------------------------
+# ECDH Backend Classes
+# -----------------------------------------------------------------------------
+
+class TinyEcdhBackend(object):
+
+    """ Pure Python ECDH on curve B-163 using tiny-ECDH """
+
+    name = "tiny-ecdh"
+
+    def generate_keys(self):
+
+        """ Create a new key pair
+            Returns the private key and the public key as 12 uint32 words """
+
+        privateKey = np.random.randint(4294967296, size=6, dtype=np.uint32)
+        publicKey = np.zeros(12, dtype=np.uint32)
+        return tinyEcdh.ecdh_generate_keys(privateKey, publicKey)
+
+    def shared_secret(self, privateKey, remotePublic):
+
+        """ Compute the shared point with the band
+            Returns its x coordinate as 24 little-endian bytes
+
+        Arguments:
+        uint32[] privateKey: Private key of the user
+        bytes[] remotePublic: Public key of the band (48 bytes) """
+
+        remote = np.frombuffer(bytes(remotePublic), dtype=np.uint32)
+        secret = tinyEcdh.ecdh_shared_secret(privateKey, remote)
+        return secret.view(dtype=np.uint8)[:ELEMENT_SIZE].tobytes()
+
+class NativeEcdhBackend(object):
+
+    """ ECDH on curve B-163 using OpenSSL through the cryptography package """
+
+    name = "openssl"
+
+    def __init__(self):
+
+        """ Check that the installed OpenSSL supports binary curves """
+
+        self.curve = ec.SECT163R2()
+        ec.generate_private_key(self.curve)
+
+    def generate_keys(self):
+
+        """ Create a new key pair
+            Returns the private key and the public key as 12 uint32 words """
+
+        privateKey = ec.generate_private_key(self.curve)
+        numbers = privateKey.public_key().public_numbers()
+        publicKey = numbers.x.to_bytes(ELEMENT_SIZE, "little") + numbers.y.to_bytes(ELEMENT_SIZE, "little")
+        return privateKey, np.frombuffer(publicKey, dtype=np.uint32).copy()
+
+    def shared_secret(self, privateKey, remotePublic):
+
+        """ Compute the shared point with the band
+            Returns its x coordinate as 24 little-endian bytes
+
+        Arguments:
+        EllipticCurvePrivateKey privateKey: Private key of the user
+        bytes[] remotePublic: Public key of the band (48 bytes) """
+
+        remotePublic = bytes(remotePublic)
+        x = int.from_bytes(remotePublic[:ELEMENT_SIZE], "little")
+        y = int.from_bytes(remotePublic[ELEMENT_SIZE:2 * ELEMENT_SIZE], "little")
+        remote = ec.EllipticCurvePublicNumbers(x, y, self.curve).public_key()
+        secret = privateKey.exchange(ec.ECDH(), remote)
+        return int.from_bytes(secret, "big").to_bytes(ELEMENT_SIZE, "little")
+
+backends = {}
+
+def get_backend(name=None):
+
+    """ Return an ECDH backend, preferring the native one when it is available
+
+    Arguments:
+    str   name: Backend to use ("openssl" or "tiny-ecdh"), None picks the fastest """
+
+    if name in backends:
+        return backends[name]
+
+    backend = None
+    if name in (None, NativeEcdhBackend.name) and ec is not None:
+        try:
+            backend = NativeEcdhBackend()
+        except Exception:
+            backend = None
+    if backend is None and name in (None, TinyEcdhBackend.name) and tinyEcdh is not None:
+        backend = TinyEcdhBackend()
+    if backend is None:
+        raise RuntimeError("No ECDH backend available, install tiny-ECDH or cryptography with binary curves")
+
+    backends[name] = backend
+    return backend
+
+# -----------------------------------------------------------------------------
+# Key Pool Class
+# -----------------------------------------------------------------------------
+
+class KeyPool(object):
+
+    def __init__(self, backend, size=4):
+
+        """ Generate key pairs in a background thread
+            so that connecting never waits for key generation
+
+        Arguments:
+        object backend: ECDH backend used to generate the keys
+        int   size: Number of key pairs kept ready """
+
+        self.backend = backend
+        self.keys = queue.Queue(maxsize=size)
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+
+    def fill(self):
+
+        """ Keep the pool full, blocking while it is """
+
+        while True:
+            self.keys.put(self.backend.generate_keys())
+
+    def get(self):
+
+        """ Return a key pair, generating one now if the pool is empty """
+
+        try:
+            return self.keys.get_nowait()
+        except queue.Empty:
+            return self.backend.generate_keys()
+
+pools = {}
+
+def key_pool(backend=None):
+
+    """ Return the shared key pool of a backend, starting it on first use
+
+    Arguments:
+    object backend: ECDH backend (None uses the default one) """
+
+    backend = backend or get_backend()
+    if backend.name not in pools:
+        pools[backend.name] = KeyPool(backend)
+
+    return pools[backend.name]
+
+# -----------------------------------------------------------------------------
+# Key Derivation
+# -----------------------------------------------------------------------------
+
+# AES ciphers and bytes of the authentication keys, reused between handshakes
+authCiphers = {}
+
+def auth_response(backend, privateKey, authKey, remoteRandom, remotePublic):
+
+    """ Build the 2nd auth part from the random number and public key of the band
+        Both encrypted blocks are single AES blocks, so CBC with zero IV is plain ECB
+
+    Arguments:
+    object backend: ECDH backend that created the private key
+    object privateKey: Private key of the user
+    str   authKey: Authentication key of the band in hexadecimal
+    bytes[] remoteRandom: Random number sent by the band (16 bytes)
+    bytes[] remotePublic: Public key of the band (48 bytes) """
+
+    secret = np.frombuffer(backend.shared_secret(privateKey, remotePublic), dtype=np.uint8)
+
+    if authKey not in authCiphers:
+        key = bytes.fromhex(authKey)
+        authCiphers[authKey] = (AES.new(key, AES.MODE_ECB), np.frombuffer(key, dtype=np.uint8))
+    authCipher, secretKey = authCiphers[authKey]
+
+    finalSharedSessionAES = np.bitwise_xor(secret[8:24], secretKey)
+    sessionCipher = AES.new(finalSharedSessionAES.tobytes(), AES.MODE_ECB)
+
+    remoteRandom = bytes(remoteRandom)
+    return b'\x05' + authCipher.encrypt(remoteRandom) + sessionCipher.encrypt(remoteRandom)
@@ -0,0 +1,178 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Heart Rate Measurement parser script
+
+import numpy as np
+
+# Flags of the GATT Heart Rate Measurement characteristic (0x2A37)
+FLAG_HR_UINT16 = 0x01
+FLAG_CONTACT_DETECTED = 0x02
+FLAG_CONTACT_SUPPORTED = 0x04
+FLAG_ENERGY = 0x08
+FLAG_RR = 0x10
+
+# RR intervals are sent in units of 1/1024 s
+RR_UNIT = 1.0 / 1024
+
+# Decoded measurement: contact is -1 when not supported, energy -1 when absent,
+# and rr the number of RR intervals of the notification
+MEASUREMENT_DTYPE = np.dtype([('hr', '<u2'), ('contact', 'i1'), ('energy', '<i4'), ('rr', '<u2')])
+
+def parse_measurement(value):
+
+    """ Decode one Heart Rate Measurement notification
+        Returns the heart rate, the sensor contact (None when not supported),
+        the energy expended in kJ (None when absent) and the RR intervals in 1/1024 s
+
+    Arguments:
+    bytes[] value: Value received from the band """
+
+    value = bytes(value)
+    if len(value) < 2:
+        return 0, None, None, ()
+
+    flags = value[0]
+    if flags & FLAG_HR_UINT16:
+        hRate = value[1] | value[2] << 8 if len(value) > 2 else 0
+        offset = 3
+    else:
+        hRate = value[1]
+        offset = 2
+
+    contact = bool(flags & FLAG_CONTACT_DETECTED) if flags & FLAG_CONTACT_SUPPORTED else None
+
+    energy = None
+    if flags & FLAG_ENERGY and len(value) >= offset + 2:
+        energy = value[offset] | value[offset + 1] << 8
+        offset += 2
+
+    rr = ()
+    if flags & FLAG_RR and len(value) >= offset + 2:
+        count = (len(value) - offset) // 2
+        rr = np.frombuffer(value, dtype='<u2', count=count, offset=offset)
+
+    return hRate, contact, energy, rr
+
+def pack(packets, width=None):
+
+    """ Put notifications of different lengths in a zero-padded 2D array
+        Returns the array and the length of every notification
+
+    Arguments:
+    list  packets: Values of the notifications
+    int   width: Columns of the array (default: longest notification) """
+
+    lengths = np.fromiter((len(p) for p in packets), dtype=np.int64, count=len(packets))
+    width = max(int(lengths.max()) if len(lengths) else 0, 3) if width is None else width
+    data = np.frombuffer(b''.join(bytes(p).ljust(width, b'\x00') for p in packets), dtype=np.uint8)
+    return data.reshape(len(packets), width), lengths
+
+def parse_measurements(packets, lengths=None):
+
+    """ Decode many notifications at once, e.g. recorded raw notifications
+        Returns a MEASUREMENT_DTYPE array and every RR interval in order, in 1/1024 s;
+        the intervals of notification i start at the sum of rr of the previous ones
+
+    Arguments:
+    list  packets: Values of the notifications, or a padded 2D uint8 array
+    ndarray lengths: Length of every row of a 2D array (default: its width) """
+
+    if isinstance(packets, np.ndarray):
+        data = packets
+        lengths = np.full(len(data), data.shape[1]) if lengths is None else np.asarray(lengths)
+        if data.shape[1] < 3:
+            data = np.pad(data, ((0, 0), (0, 3 - data.shape[1])))
+    else:
+        data, lengths = pack(packets)
+
+    rows = np.arange(len(data))
+    last = data.shape[1] - 1
+    flags = data[:, 0]
+    wide = (flags & FLAG_HR_UINT16).astype(np.int64)
+
+    measurements = np.zeros(len(data), dtype=MEASUREMENT_DTYPE)
+    measurements['hr'] = np.where(wide, data[:, 1] | data[:, 2].astype(np.uint16) << 8, data[:, 1])
+    supported = ((flags & FLAG_CONTACT_SUPPORTED) > 0) & (lengths >= 2)
+    measurements['contact'] = np.where(supported, (flags & FLAG_CONTACT_DETECTED) >> 1, -1)
+    measurements['hr'][lengths < 2 + wide] = 0
+
+    offset = 2 + wide
+    energy = (flags & FLAG_ENERGY).astype(bool) & (lengths >= offset + 2)
+    low = data[rows, np.minimum(offset, last)].astype(np.int32)
+    high = data[rows, np.minimum(offset + 1, last)].astype(np.int32)
+    measurements['energy'] = np.where(energy, low | high << 8, -1)
+    offset += 2 * energy
+
+    count = np.where(flags & FLAG_RR, np.maximum(lengths - offset, 0) // 2, 0)
+    measurements['rr'] = count
+
+    # Every RR slot of every notification, kept where it exists (row order keeps the time order)
+    slots = np.arange(int(count.max()) if len(count) else 0)
+    columns = offset[:, None] + 2 * slots
+    low = data[rows[:, None], np.minimum(columns, last)].astype(np.uint16)
+    high = data[rows[:, None], np.minimum(columns + 1, last)].astype(np.uint16)
+    rr = (low | high << 8)[slots < count[:, None]]
+
+    return measurements, rr
+
+# -----------------------------------------------------------------------------
+# RR Intervals Class
+# -----------------------------------------------------------------------------
+
+class RrIntervals(object):
+
+    def __init__(self, capacity=4096):
+
+        """ Ring buffer of RR intervals in 1/1024 s, two bytes per interval
+
+        Arguments:
+        int   capacity: Number of intervals kept """
+
+        self.capacity = max(int(capacity), 2)
+        self.values = np.zeros(self.capacity, dtype=np.uint16)
+        self.total = 0
+
+    def __len__(self):
+
+        """ Number of intervals kept """
+
+        return min(self.total, self.capacity)
+
+    def extend(self, intervals):
+
+        """ Add the intervals of a notification
+
+        Arguments:
+        ndarray intervals: RR intervals in 1/1024 s """
+
+        for interval in intervals:
+            self.values[self.total % self.capacity] = interval
+            self.total += 1
+
+    def array(self, count=None):
+
+        """ Return the most recent intervals in milliseconds, oldest first
+
+        Arguments:
+        int   count: Number of intervals (default: every interval kept) """
+
+        count = len(self) if count is None else min(count, len(self))
+        index = (self.total - count + np.arange(count)) % self.capacity
+        return self.values[index] * (RR_UNIT * 1000)
+
+    def hrv(self, count=None):
+
+        """ Heart rate variability of the most recent intervals
+            Returns RMSSD and SDNN in milliseconds, None without enough intervals
+
+        Arguments:
+        int   count: Number of intervals (default: every interval kept) """
+
+        intervals = self.array(count)
+        if len(intervals) < 3:
+            return None
+        return {'rmssd': float(np.sqrt(np.mean(np.diff(intervals) ** 2))), 'sdnn': float(intervals.std(ddof=1))}
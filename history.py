@@ -0,0 +1,122 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Heart rate history script
+
+import os
+import time
+import numpy as np
+
+# Record format used for samples spilled to disk
+HR_DTYPE = np.dtype([('time', '<f8'), ('hr', '<u2')])
+
+# Histories of every band seen by this process, kept across reconnects
+histories = {}
+
+# -----------------------------------------------------------------------------
+# Heart Rate History Class
+# -----------------------------------------------------------------------------
+
+class HrHistory(object):
+
+    def __init__(self, capacity=3600, spill_path=None):
+
+        """ Bounded ring buffer of heart rate samples
+            Timestamps and values are kept in fixed-width arrays
+            Older samples spill to a segment file when the buffer is full
+
+        Arguments:
+        int   capacity: Number of samples kept in memory
+        str   spill_path: File where older samples are appended (None discards them) """
+
+        self.capacity = max(int(capacity), 2)
+        self.spillPath = spill_path
+        self.times = np.zeros(self.capacity, dtype=np.float64)
+        self.values = np.zeros(self.capacity, dtype=np.uint16)
+        self.start = self.size = self.spilled = 0
+
+        # Spill half of the buffer at once so disk writes stay rare
+        self.spillBlock = self.capacity // 2
+
+    def __len__(self):
+
+        """ Number of samples recorded, including the spilled ones """
+
+        return self.spilled + self.size
+
+    def append(self, timestamp, value):
+
+        """ Add a new sample to the history
+
+        Arguments:
+        float timestamp: Time of the sample
+        int   value: Heart rate value """
+
+        if self.size == self.capacity:
+            self.spill(self.spillBlock)
+
+        slot = (self.start + self.size) % self.capacity
+        self.times[slot] = timestamp
+        self.values[slot] = value
+        self.size += 1
+
+    def spill(self, count):
+
+        """ Move the oldest samples out of memory
+
+        Arguments:
+        int   count: Number of samples to move """
+
+        count = min(count, self.size)
+        if self.spillPath is not None:
+            index = (self.start + np.arange(count)) % self.capacity
+            records = np.empty(count, dtype=HR_DTYPE)
+            records['time'] = self.times[index]
+            records['hr'] = self.values[index]
+            with open(self.spillPath, "ab") as f:
+                records.tofile(f)
+
+        self.start = (self.start + count) % self.capacity
+        self.size -= count
+        self.spilled += count
+
+    def arrays(self, spilled=False):
+
+        """ Return the samples in chronological order as (values, times)
+
+        Arguments:
+        bool  spilled: Also load the samples written to disk """
+
+        index = (self.start + np.arange(self.size)) % self.capacity
+        values = self.values[index]
+        times = self.times[index]
+
+        if spilled and self.spillPath is not None and os.path.exists(self.spillPath):
+            records = np.fromfile(self.spillPath, dtype=HR_DTYPE)
+            values = np.concatenate((records['hr'], values))
+            times = np.concatenate((records['time'], times))
+
+        return values, times
+
+def get_history(mac_address, capacity=3600, spill_dir=None):
+
+    """ Return the history of a band, creating it on first use
+        The same history is returned after a reconnect, and every run spills to its own file
+
+    Arguments:
+    str   mac_address: MAC address of the band
+    int   capacity: Number of samples kept in memory
+    str   spill_dir: Directory of the segment files (None discards older samples) """
+
+    if mac_address not in histories:
+        spillPath = None
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            spillPath = os.path.join(spill_dir, "hr_%s_%s.seg" % (mac_address.replace(":", "").lower(),
+                                                                  time.strftime("%Y%m%d-%H%M%S")))
+        histories[mac_address] = HrHistory(capacity, spillPath)
+
+    return histories[mac_address]
@@ -0,0 +1,124 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Heart rate keep-alive script
+
+import time
+import output
+
+# -----------------------------------------------------------------------------
+# Keep Alive Class
+# -----------------------------------------------------------------------------
+
+class KeepAlive(object):
+
+    def __init__(self, device, check=1.0, stall=3.0, grace=10.0, interval=5.0, max_interval=12.0,
+                 growth=1.5, recover=5, timeout=15.0, schedule=None):
+
+        """ Keep the continuous heart rate measurement of a band going
+            Measurement is only restarted when no sample arrived for stall seconds.
+            While samples arrive, the keep-alive command is sent less and less often,
+            and the interval shrinks again when the band stalls. The interval never gets
+            close to the time the band measures without keep-alive, or every cycle would
+            stall. It is paused with stop() while the band is disconnected, so outages are not taken for stalls
+
+        Arguments:
+        MiBand6 device: Band measuring heart rate
+        float check: Seconds between checks of the time since the last sample (no GATT write)
+        float stall: Seconds without sample after which measurement is restarted
+        float grace: Seconds given to the band to send the first sample after connecting
+        float interval: Initial seconds between keep-alive commands
+        float max_interval: Maximum seconds between keep-alive commands, at most timeout - stall
+        float growth: Factor applied to the interval after each keep-alive without stall
+        int   recover: Keep-alives without stall after which a lowered maximum interval grows back
+        float timeout: Seconds the band keeps measuring without keep-alive command
+        function schedule: Timer function like GObject.timeout_add (default) """
+
+        self.device = device
+        self.check = check
+        self.stall = stall
+        self.grace = grace
+        self.ceiling = min(max_interval, timeout - stall)
+        self.minInterval = min(interval, self.ceiling)
+        self.maxInterval = self.ceiling
+        self.growth = growth
+        self.recover = recover
+        self.schedule = schedule
+
+        self.interval = self.minInterval
+        self.clean = 0
+        self.running = False
+        self.scheduled = False
+        self.startTime = None
+        self.lastPing = None
+        self.pings = 0
+        self.rearms = 0
+
+    def start(self):
+
+        """ Start or resume checking the band, called once it is authenticated
+            Only one timer is kept whatever the number of reconnects """
+
+        self.startTime = self.lastPing = time.time()
+        self.running = True
+        if self.scheduled:
+            return
+
+        if self.schedule is None:
+            from gi.repository import GObject
+            self.schedule = GObject.timeout_add
+
+        self.scheduled = True
+        self.schedule(int(self.check * 1000), self.tick)
+
+    def stop(self):
+
+        """ Pause checking the band, e.g. while it is disconnected
+            The timer ends on its next call unless start is called before """
+
+        self.running = False
+
+    def tick(self):
+
+        """ Check the time since the last sample and send a command if needed
+            Returns True while running so it can be used as a GObject timeout callback """
+
+        if not self.running:
+            self.scheduled = False
+            return False
+
+        now = time.time()
+        last = self.device.lastHr
+        if last is None or last < self.startTime:
+            silence, limit = now - self.startTime, self.grace
+        else:
+            silence, limit = now - last, self.stall
+
+        try:
+            if silence > limit:
+                # The band stopped measuring: restart it and keep it alive more often
+                output.message("No heart rate for %.1f s, restarting measurement" % silence, self.device.mac_address)
+                self.device.ping_hr()
+                self.rearms += 1
+                self.interval = max(self.minInterval, self.interval / self.growth ** 2)
+                self.maxInterval = max(self.minInterval, self.interval)
+                self.clean = 0
+                self.startTime = self.lastPing = now
+            elif now - self.lastPing >= self.interval:
+                self.device.continue_hr()
+                self.pings += 1
+
+                # The maximum lowered by a stall grows back once the band is stable again
+                self.clean += 1
+                if self.clean >= self.recover:
+                    self.maxInterval = min(self.ceiling, self.maxInterval * self.growth)
+                self.interval = min(self.maxInterval, self.interval * self.growth)
+                self.lastPing = now
+        except Exception as e:
+            # Writes fail while reconnecting, keep the timer for the next connection
+            output.message("Keep-alive failed: " + str(e), self.device.mac_address)
+
+        return True
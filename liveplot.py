@@ -0,0 +1,170 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Live heart rate plot script
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Decimation
+# -----------------------------------------------------------------------------
+
+def minmax_decimate(times, values, points):
+
+    """ Keep the minimum and maximum of equal-size buckets
+        Peaks are never lost, whatever the length of the history
+
+    Arguments:
+    float[] times: Time of each sample
+    int[] values: Value of each sample
+    int   points: Maximum number of points returned """
+
+    buckets = points // 2
+    if len(values) <= points or buckets < 1:
+        return times, values
+
+    size = len(values) // buckets
+    used = size * buckets
+    blocks = values[len(values) - used:].reshape(buckets, size)
+    offset = np.arange(buckets) * size + len(values) - used
+
+    low = offset + blocks.argmin(axis=1)
+    high = offset + blocks.argmax(axis=1)
+    index = np.sort(np.concatenate((low, high)))
+    return times[index], values[index]
+
+def lttb(times, values, points):
+
+    """ Largest-Triangle-Three-Buckets downsampling
+        Keeps the visual shape of the curve with a fixed number of points
+
+    Arguments:
+    float[] times: Time of each sample
+    int[] values: Value of each sample
+    int   points: Number of points returned """
+
+    length = len(values)
+    if length <= points or points < 3:
+        return times, values
+
+    x = np.asarray(times, dtype=np.float64)
+    y = np.asarray(values, dtype=np.float64)
+    edges = (np.arange(points - 1) * (length - 2) / (points - 2)).astype(np.int64) + 1
+    edges[-1] = length - 1
+
+    index = np.zeros(points, dtype=np.int64)
+    index[-1] = length - 1
+    selected = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        nextEnd = edges[i + 2] if i + 2 < len(edges) else length
+        nextX = x[end:nextEnd].mean() if nextEnd > end else x[-1]
+        nextY = y[end:nextEnd].mean() if nextEnd > end else y[-1]
+
+        # Pick the point of the bucket making the largest triangle
+        area = np.abs((x[selected] - nextX) * (y[start:end] - y[selected]) -
+                      (x[selected] - x[start:end]) * (nextY - y[selected]))
+        selected = start + int(area.argmax())
+        index[i + 1] = selected
+
+    return times[index], values[index]
+
+# -----------------------------------------------------------------------------
+# Live Plot Class
+# -----------------------------------------------------------------------------
+
+class LivePlot(object):
+
+    def __init__(self, history, max_points=2000, redraw_points=300, store=None):
+
+        """ Heart rate plot updated while the band is measuring
+            Only new points are drawn over a cached background
+            The whole plot is drawn again, decimated, when it runs out of the axes.
+            With a time series store, long histories are drawn from its rollups
+
+        Arguments:
+        HrHistory history: History of the band
+        int   max_points: Maximum number of points drawn in a full redraw
+        int   redraw_points: New points drawn before the background is refreshed
+        TimeSeriesStore store: Store of the band (None decimates the history) """
+
+        self.history = history
+        self.store = store
+        self.maxPoints = max_points
+        self.redrawPoints = redraw_points
+        self.fig = None
+        self.background = None
+        self.drawn = 0
+
+    def start(self):
+
+        """ Open the plot window
+            matplotlib is only imported here, so headless runs never load it """
+
+        import matplotlib.pyplot as plt
+
+        plt.ion()
+        self.fig, self.ax = plt.subplots()
+        self.ax.set_xlabel("Time (s)")
+        self.ax.set_ylabel("Heart Rate (bpm)")
+        self.line, = self.ax.plot([], [])
+        self.tail, = self.ax.plot([], [], color="red", marker=".", animated=True)
+        plt.show(block=False)
+
+    def redraw(self, times, values):
+
+        """ Draw the whole history again and cache it as background
+
+        Arguments:
+        float[] times: Time of each sample
+        int[] values: Value of each sample """
+
+        if self.store is not None and len(values) > self.maxPoints:
+            # Minimum and maximum of every bucket, read from the rollups
+            bucketTimes, low, mean, high = self.store.downsample(times[0], times[-1] + 1, self.maxPoints // 2)
+            self.line.set_data(np.repeat(bucketTimes, 2), np.column_stack((low, high)).ravel())
+        else:
+            self.line.set_data(*lttb(times, values, self.maxPoints))
+
+        # Leave room on the right so new points fit without a redraw
+        span = max(times[-1] - times[0], 60.0)
+        self.ax.set_xlim(times[0], times[-1] + span * 0.25)
+        self.ax.set_ylim(min(values.min(), 40) - 5, max(values.max(), 120) + 5)
+
+        self.tail.set_data([], [])
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.ax.bbox)
+        self.drawn = len(self.history)
+
+    def update(self):
+
+        """ Draw the samples received since the last call
+            Used as a GObject timeout callback, so it always returns True """
+
+        if self.fig is None:
+            self.start()
+
+        values, times = self.history.arrays()
+        if len(values) == 0:
+            self.fig.canvas.flush_events()
+            return True
+
+        new = min(len(self.history) - self.drawn, len(values))
+        xmin, xmax = self.ax.get_xlim()
+        ymin, ymax = self.ax.get_ylim()
+        tail = slice(len(values) - new - 1 if new < len(values) else 0, len(values))
+
+        if self.background is None or new > self.redrawPoints or times[-1] > xmax or \
+           values[tail].min() < ymin or values[tail].max() > ymax:
+            self.redraw(times, values)
+        elif new > 0:
+            self.fig.canvas.restore_region(self.background)
+            self.tail.set_data(times[tail], values[tail])
+            self.ax.draw_artist(self.tail)
+            self.fig.canvas.blit(self.ax.bbox)
+
+        self.fig.canvas.flush_events()
+        return True
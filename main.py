@@ -13,75 +13,208 @@ from dbus.exceptions import DBusException
 from band6 import *
 from band7 import *
 from const import *
+from fleet import *
+from session import get_session
+from handshake import key_pool
+from history import get_history
+from timeseries import get_store
+from liveplot import LivePlot
+from keepalive import KeepAlive
+from gi.repository import GObject
+import metrics
+import output
+import alerts
+import export
 
 # -----------------------------------------------------------------------------
 # Interaction with Mi Band Class
 # -----------------------------------------------------------------------------
 
-def ping_band(device):
+def run_fleet(manager, bands, args):
 
-    """ Function to query Heart Rate
-        Avoids interruptions while continuously measuring heart rate """
-    
-    device.ping_hr()
-    return True
+    """ Monitor several bands from the same event loop
+
+    Arguments:
+    gatt.DeviceManager manager: Manager shared by every band
+    list  bands: MAC address, authentication key and type of each band
+    argparse.Namespace args: Options given by the user """
+
+    fleet = BandFleet(manager, report_interval = args.report, stats_window = args.window,
+                      history_capacity = args.capacity, history_dir = args.history_dir, log_dir = args.log_dir,
+                      rules_file = args.rules, raw_dir = args.raw_dir)
+    for mac, key, band in bands:
+        fleet.add(mac, key, band)
+
+    try:
+        fleet.run()
+    except KeyboardInterrupt:
+        print("Keyboard interrupt detected. Exiting...")
+        fleet.stop()
+        sys.exit(0)
+
+def disconnected(keep_alive, manager):
+
+    """ Pause the keep-alive of the band and leave the event loop to reconnect
+
+    Arguments:
+    KeepAlive keep_alive: Keep-alive of the band (None for a Mi Band 7)
+    gatt.DeviceManager manager: Manager running the event loop """
+
+    if keep_alive is not None:
+        keep_alive.stop()
+    manager.stop()
 
 def main():
 
     """ Main function
         Creates argument parser to receive MAC address and band type from the user
         Starts connection loop to restore it when lost
+        Monitors every band from the same loop when several are given
         Stops when the user presses keyboard interrupt """
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('-m', '--mac',  required=True, help='Mac address of the device')
+    parser.add_argument('-m', '--mac', action='append', default=[], help='Mac address of the device, optionally followed by ,AUTH_KEY (repeat for several bands)')
+    parser.add_argument('-f', '--devices', default=None, help='File with one "MAC AUTH_KEY [BAND]" line per band')
+    parser.add_argument('-r', '--report', type=int, default=10, help='Seconds between throughput reports with several bands')
     parser.add_argument('-b', '--band', required=True, help='Type of Mi Band')
+    parser.add_argument('-w', '--window', type=int, default=0, help='Samples used for the heart rate alert mean (0 uses every sample)')
+    parser.add_argument('--rules', default=None, help='JSON file with the alert rules (default: heart rate drop)')
+    parser.add_argument('--alert-cooldown', type=float, default=60.0, help='Minimum seconds between two alerts of the same rule')
+    parser.add_argument('--alert-clear', type=int, default=5, help='Samples without firing before a rule can alert again')
+    parser.add_argument('--alert-file', default=None, help='File where alerts are also written as JSON lines')
+    parser.add_argument('--alert-webhook', default=None, help='URL where alerts are also posted as JSON')
+    parser.add_argument('-c', '--capacity', type=int, default=3600, help='Heart rate samples kept in memory')
+    parser.add_argument('-d', '--history-dir', default=None, help='Directory where older heart rate samples are spilled')
+    parser.add_argument('-l', '--log-dir', default=None, help='Directory where heart rate sessions are recorded')
+    parser.add_argument('--raw-dir', default=None, help='Directory where the raw PPG and accelerometer stream is recorded (Mi Band 6)')
+    parser.add_argument('-p', '--live', action='store_true', help='Plot heart rate while measuring (Mi Band 6)')
+    parser.add_argument('-i', '--metrics', type=int, default=0, help='Seconds between link metrics dumps (0 disables metrics)')
+    parser.add_argument('-o', '--output', default='text', choices=output.FORMATS, help='Format of heart rate samples and messages')
+    parser.add_argument('--output-file', default=None, help='File where samples and messages are written (default stdout)')
+    parser.add_argument('--output-policy', default='drop-oldest', choices=output.POLICIES, help='What to do when output can not keep up')
+    parser.add_argument('--output-queue', type=int, default=1024, help='Samples and messages waiting to be written')
+    parser.add_argument('--stream-port', type=int, default=None, help='Publish samples to TCP and WebSocket clients on this port')
+    parser.add_argument('--stream-host', default='127.0.0.1', help='Address of the streaming server')
+    parser.add_argument('--stream-socket', default=None, help='Publish samples to clients of this Unix socket')
+    parser.add_argument('-e', '--export', default=None, help='Directory where samples and activity records are exported')
+    parser.add_argument('--export-format', default='csv', choices=('csv', 'parquet', 'arrow'), help='Format of the exported files')
+    parser.add_argument('--export-rotate', type=float, default=3600, help='Seconds covered by each exported file (0 never rotates)')
+    parser.add_argument('--metrics-file', default=None, help='File where link metrics are appended as JSON lines (default stdout)')
     args = parser.parse_args()
-    mac_add = args.mac
     band_type = int(args.band)
 
-    with open("auth_key.txt") as f:
-        auth_key = f.read()
+    if not args.mac and args.devices is None:
+        parser.error("a MAC address (-m) or a devices file (-f) is required")
+    if args.window != 0 and args.window < 2:
+        parser.error("the window (-w) must be 0 or at least 2 samples")
+
+    bands = read_devices(args.devices, band_type) if args.devices is not None else []
+    # Bands given without key, or with an empty one, use the key of auth_key.txt
+    if any(mac.partition(",")[2].strip() == "" for mac in args.mac):
+        with open("auth_key.txt") as f:
+            auth_key = f.read().strip()
+    for mac in args.mac:
+        mac_add, _, key = mac.partition(",")
+        bands.append((mac_add, key.strip() or auth_key, band_type))
+
+    # Write samples and messages from a background thread
+    output_file = open(args.output_file, "a") if args.output_file is not None else None
+    output.configure(output_file, args.output, args.output_queue, args.output_policy)
+    alerts.configure(args.alert_cooldown, args.alert_clear, args.alert_file, args.alert_webhook)
+
+    # Export samples and activity records to columnar files
+    if args.export is not None:
+        export.configure(args.export, args.export_format, rotate = args.export_rotate)
+
+    # Publish samples to local clients from a separate thread
+    if args.stream_port is not None or args.stream_socket is not None:
+        import stream
+        host = args.stream_host if args.stream_port is not None else None
+        output.add_listener(stream.start_server(host, args.stream_port, args.stream_socket).publish)
+
+    # Start generating authentication keys in the background
+    key_pool()
+
+    # Collect link metrics and dump them periodically
+    if args.metrics > 0:
+        metrics.enable()
+        metrics_sink = output.OutputSink(open(args.metrics_file, "a")) if args.metrics_file is not None else None
+        GObject.timeout_add(args.metrics * 1000, metrics.dump, metrics_sink)
 
     # Initialize device manager
     manager = gatt.DeviceManager(adapter_name='hci0')
 
+    if len(bands) > 1:
+        run_fleet(manager, bands, args)
+        return
+
+    mac_add, auth_key, band_type = bands[0]
+
+    # Refresh the live plot from the event loop
+    if args.live and band_type == 6:
+        plot = LivePlot(get_history(mac_add, args.capacity, args.history_dir), store = get_store(mac_add, args.capacity))
+        GObject.timeout_add(1000, plot.update)
+
+    session = get_session(mac_add)
+    device = None
+    keepAlive = None
+
     while True:
         try:
-            # Try to connect with the device
-            if band_type == 6:
-                device = MiBand6(mac_address = mac_add, manager = manager)
-            elif band_type == 7:
-                device = MiBand7(mac_address = mac_add, manager = manager)
+            # Try to connect with the device, reusing it after a drop
+            if device is None:
+                if band_type == 6:
+                    device = MiBand6(mac_address = mac_add, manager = manager, stats_window = args.window,
+                                     history_capacity = args.capacity, history_dir = args.history_dir,
+                                     log_dir = args.log_dir, rules_file = args.rules, raw_dir = args.raw_dir)
+                elif band_type == 7:
+                    device = MiBand7(mac_address = mac_add, manager = manager)
+
+                # Keep heart rate measurement going once authenticated, only writing to the band when needed
+                if band_type == 6:
+                    keepAlive = KeepAlive(device)
+                    device.authCallback = lambda d: keepAlive.start()
+
+                # Leave the loop when the connection is lost to reconnect
+                device.disconnectCallback = lambda d: disconnected(keepAlive, manager)
+
             device.connect(auth_key)
             print("Connected")
 
             # Enable notifications to start authentication process
             device.enable_notifications_chunked()
 
-            # Initialize callback to ping heart rate
-            manager.notification_query(ping_band,device)
-
             # Start GObject loop to continuosly check for notifications
             manager.run()
 
+            print("Connection lost, reconnecting...\n")
+            session.dropped()
+
         except DBusException as e:
-            print(f"Failed to connect to device {args.mac}: {e}")
-            print("Retrying...\n")
-            time.sleep(2)
+            print(f"Failed to connect to device {mac_add}: {e}")
+            session.dropped()
+            delay = session.backoff.next_delay()
+            print(f"Retrying in {delay:.1f} s...\n")
+            time.sleep(delay)
 
         except KeyboardInterrupt:
             print("Keyboard interrupt detected. Exiting...")
 
             # Plot recorded heart rate measures
-            device.print_hr()
-            device.disconnect()
+            if device is not None:
+                device.print_hr()
+                device.disconnect()
             manager.stop()
             sys.exit(0)
 
         except AttributeError as e:
             print("Bluetooth problems found, try to restart your bluetooth")
 
+            # Characteristics may have changed, resolve them again on the next attempt
+            session.forget()
+            session.dropped()
+            time.sleep(session.backoff.next_delay())
+
 if __name__ == "__main__":
     main()
 
@@ -0,0 +1,145 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Link instrumentation script
+
+import time
+import output
+
+# Inter-arrival histogram buckets: bucket i counts intervals from 2^(i-1) to 2^i ms (last one is open)
+LATENCY_BUCKETS = 18
+
+# Metrics of every band, only filled when enabled
+registry = {}
+enabled = False
+
+# -----------------------------------------------------------------------------
+# Band Metrics Class
+# -----------------------------------------------------------------------------
+
+class BandMetrics(object):
+
+    def __init__(self, hr_gap=3.0):
+
+        """ Link quality counters of a band, kept across reconnects
+
+        Arguments:
+        float hr_gap: Seconds without heart rate sample counted as a gap """
+
+        self.hrGap = hr_gap
+        self.characteristics = {}
+        self.hrGaps = 0
+        self.hrMaxGap = 0.0
+        self.lastSample = None
+        self.chunkGaps = 0
+        self.connects = 0
+        self.authStart = None
+        self.authDurations = []
+
+    def notification(self, uuid):
+
+        """ Count a notification and its time since the previous one
+
+        Arguments:
+        str   uuid: Characteristic that sent the notification """
+
+        now = time.time()
+        stats = self.characteristics.get(uuid)
+        if stats is None:
+            stats = self.characteristics[uuid] = [0, now, [0] * LATENCY_BUCKETS]
+        else:
+            bucket = min(int((now - stats[1]) * 1000).bit_length(), LATENCY_BUCKETS - 1)
+            stats[2][bucket] += 1
+            stats[1] = now
+        stats[0] += 1
+
+    def hr_sample(self, timestamp):
+
+        """ Track the time between heart rate samples
+
+        Arguments:
+        float timestamp: Time of the sample """
+
+        if self.lastSample is not None:
+            gap = timestamp - self.lastSample
+            if gap > self.hrGap:
+                self.hrGaps += 1
+                self.hrMaxGap = max(self.hrMaxGap, gap)
+        self.lastSample = timestamp
+
+    def chunk_gap(self):
+
+        """ Count a chunked transfer frame with an unexpected sequence number """
+
+        self.chunkGaps += 1
+
+    def connected(self):
+
+        """ Count a connection and start timing the authentication """
+
+        self.connects += 1
+        self.authStart = time.time()
+
+    def authenticated(self):
+
+        """ Register the end of the authentication """
+
+        if self.authStart is not None:
+            self.authDurations.append(time.time() - self.authStart)
+            self.authStart = None
+
+    def snapshot(self):
+
+        """ Return the counters as a dictionary """
+
+        return {
+            'notifications': {uuid: s[0] for uuid, s in self.characteristics.items()},
+            'interArrivalMs': {uuid: s[2] for uuid, s in self.characteristics.items()},
+            'hrGaps': self.hrGaps,
+            'hrMaxGap': self.hrMaxGap,
+            'chunkGaps': self.chunkGaps,
+            'reconnects': max(self.connects - 1, 0),
+            'authDuration': self.authDurations[-1] if self.authDurations else None,
+        }
+
+def enable():
+
+    """ Start collecting metrics for the bands connected from now on """
+
+    global enabled
+    enabled = True
+
+def get_metrics(mac_address):
+
+    """ Return the metrics of a band, or None when metrics are disabled
+
+    Arguments:
+    str   mac_address: MAC address of the band """
+
+    if not enabled:
+        return None
+    if mac_address not in registry:
+        registry[mac_address] = BandMetrics()
+    return registry[mac_address]
+
+def snapshot():
+
+    """ Return the metrics of every band """
+
+    return {'time': time.time(), 'bands': {mac: m.snapshot() for mac, m in registry.items()}}
+
+def dump(sink=None):
+
+    """ Queue a snapshot of every band, written as a JSON line by the writer thread of a sink
+        so that a slow stream never blocks the event loop
+        Returns True so it can be used as a GObject timeout callback
+
+    Arguments:
+    output.OutputSink sink: Sink the snapshot is written to (default: the sink of the samples) """
+
+    current = snapshot()
+    (sink or output.get_sink()).emit({'time': current['time'], 'mac': None, 'kind': 'metrics', 'metrics': current})
+    return True
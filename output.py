@@ -0,0 +1,192 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Output sink script
+
+import atexit
+import json
+import queue
+import sys
+import threading
+import time
+
+FORMATS = ('text', 'json', 'csv')
+POLICIES = ('drop-newest', 'drop-oldest', 'block')
+CSV_FIELDS = ('time', 'mac', 'kind', 'hr', 'text')
+
+# -----------------------------------------------------------------------------
+# Output Sink Class
+# -----------------------------------------------------------------------------
+
+class OutputSink(object):
+
+    def __init__(self, stream=None, fmt='text', maxsize=1024, policy='drop-oldest', timeout=0.05):
+
+        """ Write samples and messages from a background thread
+            The notification callback only puts events in a bounded queue
+
+        Arguments:
+        file  stream: File where events are written (default stdout)
+        str   fmt: Output format: text, json (one object per line) or csv
+        int   maxsize: Number of events waiting to be written
+        str   policy: What to do when the queue is full: drop-newest, drop-oldest or block
+        float timeout: Seconds the block policy waits before dropping the event """
+
+        if fmt not in FORMATS:
+            raise ValueError("Unknown output format " + fmt)
+        if policy not in POLICIES:
+            raise ValueError("Unknown output policy " + policy)
+
+        self.stream = stream or sys.stdout
+        self.fmt = fmt
+        self.policy = policy
+        self.timeout = timeout
+        self.dropped = 0
+        self.events = queue.Queue(maxsize=maxsize)
+
+        if self.fmt == 'csv':
+            self.stream.write(",".join(CSV_FIELDS) + "\n")
+
+        self.thread = threading.Thread(target=self.write_events, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def emit(self, event):
+
+        """ Queue an event without waiting for the stream
+
+        Arguments:
+        dict  event: Event with time, mac, kind and either hr, text or metrics """
+
+        try:
+            if self.policy == 'block':
+                self.events.put(event, timeout=self.timeout)
+            else:
+                self.events.put_nowait(event)
+            return
+        except queue.Full:
+            pass
+
+        if self.policy == 'drop-oldest':
+            try:
+                self.events.get_nowait()
+                self.events.put_nowait(event)
+            except (queue.Empty, queue.Full):
+                pass
+        self.dropped += 1
+
+    def format(self, event):
+
+        """ Convert an event to a line of the output format
+
+        Arguments:
+        dict  event: Event to convert """
+
+        if self.fmt == 'json':
+            return json.dumps(event) + "\n"
+        if event['kind'] == 'metrics':
+            # Metrics are a JSON line in text, and the text column in CSV
+            event = dict(event, text=json.dumps(event['metrics']))
+        if self.fmt == 'csv':
+            return ",".join(str(event.get(f, "")).replace(",", ";") for f in CSV_FIELDS) + "\n"
+
+        # Text lines start with the band they come from, so several bands can be told apart
+        prefix = "[" + event['mac'] + "] " if event.get('mac') else ""
+        if event['kind'] == 'hr':
+            return prefix + "Heart Rate: " + str(event['hr']) + "\n"
+        return prefix + event['text'] + "\n"
+
+    def write_events(self):
+
+        """ Write events until the sink is closed
+            The stream is flushed whenever the queue becomes empty """
+
+        while True:
+            event = self.events.get()
+            if event is None:
+                break
+            self.stream.write(self.format(event))
+            if self.events.empty():
+                self.stream.flush()
+        self.stream.flush()
+
+    def close(self):
+
+        """ Write the events still queued and stop the writer thread """
+
+        if not self.thread.is_alive():
+            return
+        self.events.put(None)
+        self.thread.join(timeout=1.0)
+
+# Sink used by the bands, created on first use
+sink = None
+
+# Functions also called with every event, they must not block
+listeners = []
+
+def configure(stream=None, fmt='text', maxsize=1024, policy='drop-oldest'):
+
+    """ Replace the sink used by the bands
+
+    Arguments:
+    file  stream: File where events are written (default stdout)
+    str   fmt: Output format: text, json or csv
+    int   maxsize: Number of events waiting to be written
+    str   policy: What to do when the queue is full: drop-newest, drop-oldest or block """
+
+    global sink
+    if sink is not None:
+        sink.close()
+    sink = OutputSink(stream, fmt, maxsize, policy)
+    return sink
+
+def get_sink():
+
+    """ Return the sink used by the bands """
+
+    return sink or configure()
+
+def add_listener(function):
+
+    """ Call a function with every event, e.g. to publish it
+
+    Arguments:
+    function function: Called as function(event) from the band callbacks """
+
+    listeners.append(function)
+
+def emit(event):
+
+    """ Send an event to the sink and the listeners
+
+    Arguments:
+    dict  event: Event to send """
+
+    get_sink().emit(event)
+    for listener in listeners:
+        listener(event)
+
+def message(text, mac=None):
+
+    """ Output a status message
+
+    Arguments:
+    str   text: Message
+    str   mac: MAC address of the band it refers to """
+
+    emit({'time': time.time(), 'mac': mac, 'kind': 'message', 'text': text})
+
+def sample(hr, timestamp, mac=None):
+
+    """ Output a heart rate sample
+
+    Arguments:
+    int   hr: Heart rate value
+    float timestamp: Time of the sample
+    str   mac: MAC address of the band """
+
+    emit({'time': timestamp, 'mac': mac, 'kind': 'hr', 'hr': hr})
@@ -0,0 +1,234 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Raw sensor capture script
+
+import atexit
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+# Commands written to the sensor characteristic
+SENSOR_ENABLE = [0x01, 0x03, 0x19]
+SENSOR_START = [0x02]
+SENSOR_STOP = [0x03]
+
+# Raw packets: type, sequence number, then little-endian samples
+# Accelerometer packets hold x, y, z triples of int16, PPG packets uint16 values
+PACKET_SIZE = 20
+RAW_ACCEL = 0x01
+RAW_PPG = 0x02
+
+# Records written to the capture files
+ACCEL_DTYPE = np.dtype([('time', '<f8'), ('x', '<i2'), ('y', '<i2'), ('z', '<i2')])
+PPG_DTYPE = np.dtype([('time', '<f8'), ('ppg', '<u2')])
+PACKET_DTYPE = np.dtype([('time', '<f8'), ('length', 'u1'), ('data', 'u1', (PACKET_SIZE,))])
+
+def sequence_gaps(sequence, last=None):
+
+    """ Number of packets lost between consecutive sequence numbers (modulo 256)
+        Each packet type has its own sequence
+
+    Arguments:
+    ndarray sequence: Sequence numbers of the packets, in order
+    int   last: Sequence number of the packet before the first one (None if unknown) """
+
+    if last is not None:
+        sequence = np.concatenate(([last], sequence))
+    return int(((np.diff(sequence.astype(np.int64)) - 1) % 256).sum())
+
+def decode_packets(data, lengths, times, accel, ppg):
+
+    """ Decode a batch of raw packets into preallocated record arrays
+        Returns the number of accelerometer and PPG records written and a mask of unknown packets
+
+    Arguments:
+    ndarray data: Packets, one zero-padded row of PACKET_SIZE bytes each
+    ndarray lengths: Length of every packet
+    ndarray times: Time of every packet
+    ndarray accel: ACCEL_DTYPE array receiving the accelerometer samples
+    ndarray ppg: PPG_DTYPE array receiving the PPG samples """
+
+    kinds = data[:, 0]
+    payload = data[:, 2:].view('<i2')
+
+    # Accelerometer: up to three triples per packet
+    rows = np.flatnonzero(kinds == RAW_ACCEL)
+    triples = payload[rows, :9].reshape(len(rows), 3, 3)
+    valid = np.arange(3) < ((lengths[rows].astype(np.int64) - 2) // 6)[:, None]
+    count = int(valid.sum())
+    accel['time'][:count] = np.repeat(times[rows], 3)[valid.ravel()]
+    samples = triples[valid]
+    accel['x'][:count], accel['y'][:count], accel['z'][:count] = samples[:, 0], samples[:, 1], samples[:, 2]
+
+    # PPG: up to nine values per packet
+    rows = np.flatnonzero(kinds == RAW_PPG)
+    valid = np.arange(payload.shape[1]) < ((lengths[rows].astype(np.int64) - 2) // 2)[:, None]
+    total = int(valid.sum())
+    ppg['time'][:total] = np.repeat(times[rows], payload.shape[1])[valid.ravel()]
+    ppg['ppg'][:total] = payload[rows].view('<u2')[valid]
+
+    return count, total, (kinds != RAW_ACCEL) & (kinds != RAW_PPG)
+
+# -----------------------------------------------------------------------------
+# Raw Capture Class
+# -----------------------------------------------------------------------------
+
+class RawCapture(object):
+
+    def __init__(self, directory, mac_address, packets=512, interval=1.0):
+
+        """ Record the raw sensor stream of a band
+            The callback copies each packet into a preallocated buffer; full buffers
+            are decoded in bulk and appended to the files by a background thread.
+            Buffers are reused once written, and a new one is allocated instead of
+            dropping packets when the writer is late
+
+        Arguments:
+        str   directory: Directory of the capture files
+        str   mac_address: MAC address of the band
+        int   packets: Packets per buffer
+        float interval: Maximum seconds a packet waits before being written """
+
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, "%s_%s" % (mac_address.replace(":", "").lower(), time.strftime("%Y%m%d-%H%M%S")))
+        self.paths = {'accel': prefix + ".accel", 'ppg': prefix + ".ppg", 'packets': prefix + ".packets"}
+        self.files = {kind: open(path, "wb") for kind, path in self.paths.items()}
+
+        self.size = packets
+        self.interval = interval
+        self.free = queue.Queue()
+        self.batches = queue.Queue()
+        self.allocated = 0
+        self.buffer = self.new_buffer()
+        self.count = 0
+        self.lastFlush = time.time()
+
+        # Decoded records, reused for every batch
+        self.accel = np.zeros(packets * 3, dtype=ACCEL_DTYPE)
+        self.ppg = np.zeros(packets * (PACKET_SIZE - 2) // 2, dtype=PPG_DTYPE)
+        self.lastSequence = {}
+
+        self.packets = 0
+        self.samples = 0
+        self.lost = 0
+        self.unknown = 0
+
+        self.thread = threading.Thread(target=self.write_batches, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def new_buffer(self):
+
+        """ Return a free buffer: packet bytes, lengths and times """
+
+        try:
+            return self.free.get_nowait()
+        except queue.Empty:
+            self.allocated += 1
+            return (np.zeros((self.size, PACKET_SIZE), dtype=np.uint8), np.zeros(self.size, dtype=np.uint8),
+                    np.zeros(self.size, dtype=np.float64))
+
+    def append(self, value, timestamp=None):
+
+        """ Add a raw packet, called from the notification callback
+
+        Arguments:
+        bytes[] value: Value received from the band
+        float timestamp: Time of the packet (default: now) """
+
+        value = bytes(value)[:PACKET_SIZE]
+        data, lengths, times = self.buffer
+        row = data[self.count]
+        row[:len(value)] = np.frombuffer(value, dtype=np.uint8)
+        row[len(value):] = 0
+        lengths[self.count] = len(value)
+        times[self.count] = time.time() if timestamp is None else timestamp
+        self.count += 1
+
+        if self.count == self.size or times[self.count - 1] - self.lastFlush >= self.interval:
+            self.flush()
+
+    def flush(self):
+
+        """ Hand the buffered packets to the writer thread """
+
+        if self.count > 0:
+            self.batches.put((self.buffer, self.count))
+            self.buffer = self.new_buffer()
+            self.count = 0
+        self.lastFlush = time.time()
+
+    def write_batches(self):
+
+        """ Decode and write batches until the capture is closed """
+
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                break
+            (data, lengths, times), count = batch
+            self.write(data[:count], lengths[:count], times[:count])
+            self.free.put(batch[0])
+
+        for f in self.files.values():
+            f.close()
+
+    def write(self, data, lengths, times):
+
+        """ Decode a batch and append it to the files
+
+        Arguments:
+        ndarray data: Packets of the batch
+        ndarray lengths: Length of every packet
+        ndarray times: Time of every packet """
+
+        accel, ppg, unknown = decode_packets(data, lengths, times, self.accel, self.ppg)
+        self.accel[:accel].tofile(self.files['accel'])
+        self.ppg[:ppg].tofile(self.files['ppg'])
+
+        # Packets of unknown types are kept as they came
+        if unknown.any():
+            packets = np.zeros(int(unknown.sum()), dtype=PACKET_DTYPE)
+            packets['time'], packets['length'], packets['data'] = times[unknown], lengths[unknown], data[unknown]
+            packets.tofile(self.files['packets'])
+
+        for kind in (RAW_ACCEL, RAW_PPG):
+            sequence = data[data[:, 0] == kind, 1]
+            if len(sequence):
+                self.lost += sequence_gaps(sequence, self.lastSequence.get(kind))
+                self.lastSequence[kind] = int(sequence[-1])
+
+        for f in self.files.values():
+            f.flush()
+        self.packets += len(data)
+        self.samples += accel + ppg
+        self.unknown += int(unknown.sum())
+
+    def close(self):
+
+        """ Write the remaining packets and close the files """
+
+        if not self.thread.is_alive():
+            return
+        self.flush()
+        self.batches.put(None)
+        self.thread.join()
+
+def read_capture(path):
+
+    """ Memory-map a capture file (.accel, .ppg or .packets)
+
+    Arguments:
+    str   path: File written by a raw capture """
+
+    dtype = {'.accel': ACCEL_DTYPE, '.ppg': PPG_DTYPE, '.packets': PACKET_DTYPE}[os.path.splitext(path)[1]]
+    count = os.path.getsize(path) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
@@ -0,0 +1,332 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Anomaly detection rules script
+
+import argparse
+import json
+from collections import deque
+import numpy as np
+from stats import RunningStats
+
+# Values sent by the band when it can not measure
+INVALID_VALUES = (0, 255)
+
+def invalid_mask(values):
+
+    """ Return True where the value is not a heart rate measure
+
+    Arguments:
+    ndarray values: Heart rate values """
+
+    return np.isin(values, INVALID_VALUES)
+
+def run_lengths(condition):
+
+    """ Number of consecutive True values ending at each position
+
+    Arguments:
+    ndarray condition: Boolean array """
+
+    index = np.arange(len(condition))
+    lastFalse = np.maximum.accumulate(np.where(condition, -1, index))
+    return np.where(condition, index - lastFalse, 0)
+
+# -----------------------------------------------------------------------------
+# Rule Classes
+# -----------------------------------------------------------------------------
+
+class Rule(object):
+
+    # Rules that also look at the invalid values
+    acceptsInvalid = False
+
+    def __init__(self, name=None, sustain=1):
+
+        """ Condition evaluated on every sample, either one at a time (update)
+            or on a whole recording at once (evaluate), with the same result
+            The rule fires once its condition held for sustain consecutive samples
+
+        Arguments:
+        str   name: Name reported when the rule fires (default: rule type)
+        int   sustain: Consecutive samples the condition must hold """
+
+        self.name = name or self.kind
+        self.sustain = int(sustain)
+        self.run = 0
+
+    def update(self, timestamp, value):
+
+        """ Add a sample and return True if the rule fires
+
+        Arguments:
+        float timestamp: Time of the sample in seconds
+        int   value: Heart rate value """
+
+        if value in INVALID_VALUES and not self.acceptsInvalid:
+            return False
+        self.run = self.run + 1 if self.check(timestamp, value) else 0
+        return self.run >= self.sustain
+
+    def evaluate(self, times, values):
+
+        """ Return where the rule fires for every sample of a recording
+
+        Arguments:
+        ndarray times: Time of every sample in seconds
+        ndarray values: Heart rate values """
+
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        fires = np.zeros(len(values), dtype=bool)
+
+        valid = np.ones(len(values), dtype=bool) if self.acceptsInvalid else ~invalid_mask(values)
+        condition = self.check_batch(times[valid], values[valid])
+        fires[valid] = run_lengths(condition) >= self.sustain
+        return fires
+
+    def check(self, timestamp, value):
+
+        """ Condition on the new sample, updating the rule state """
+
+        raise NotImplementedError
+
+    def check_batch(self, times, values):
+
+        """ Condition on every sample of a recording """
+
+        raise NotImplementedError
+
+class DropRule(Rule):
+
+    kind = "drop"
+
+    def __init__(self, margin=15, min_samples=60, window=0, **options):
+
+        """ Heart rate below the mean of the previous samples minus a margin
+            The warm-up counts every sample seen, so a window smaller than it still fires
+
+        Arguments:
+        float margin: Beats per minute below the mean
+        int   min_samples: Samples needed before the rule is checked
+        int   window: Number of samples of the mean (0 uses every sample) """
+
+        super().__init__(**options)
+        self.margin = margin
+        self.minSamples = min_samples
+        self.window = window
+        self.stats = RunningStats(window=window)
+
+    def check(self, timestamp, value):
+        self.stats.update(value)
+        return self.stats.total > self.minSamples and value < self.stats.mean - self.margin
+
+    def check_batch(self, times, values):
+        seen = np.arange(1, len(values) + 1)
+        n = seen
+        total = np.cumsum(values)
+        if self.window > 0:
+            n = np.minimum(seen, self.window)
+            total[self.window:] -= total[:-self.window].copy()
+        return (seen > self.minSamples) & (values < total / n - self.margin)
+
+class ThresholdRule(Rule):
+
+    kind = "threshold"
+
+    def __init__(self, above=None, below=None, **options):
+
+        """ Heart rate above or below a limit (tachycardia, bradycardia)
+
+        Arguments:
+        float above: Fires over this value (None disables it)
+        float below: Fires under this value (None disables it) """
+
+        super().__init__(**options)
+        self.above = above
+        self.below = below
+
+    def check(self, timestamp, value):
+        return (self.above is not None and value > self.above) or (self.below is not None and value < self.below)
+
+    def check_batch(self, times, values):
+        condition = np.zeros(len(values), dtype=bool)
+        if self.above is not None:
+            condition |= values > self.above
+        if self.below is not None:
+            condition |= values < self.below
+        return condition
+
+class RateRule(Rule):
+
+    kind = "rate"
+
+    def __init__(self, change=20, seconds=10, **options):
+
+        """ Heart rate changed by more than a value within a time span
+
+        Arguments:
+        float change: Beats per minute of change
+        float seconds: Time span compared with the new sample """
+
+        super().__init__(**options)
+        self.change = change
+        self.seconds = seconds
+        self.samples = deque()
+
+    def check(self, timestamp, value):
+        self.samples.append((timestamp, value))
+        while self.samples[0][0] < timestamp - self.seconds:
+            self.samples.popleft()
+        return abs(value - self.samples[0][1]) > self.change
+
+    def check_batch(self, times, values):
+        first = np.searchsorted(times, times - self.seconds, side='left')
+        return np.abs(values - values[first]) > self.change
+
+class FlatLineRule(Rule):
+
+    kind = "flatline"
+
+    def __init__(self, seconds=60, **options):
+
+        """ Same heart rate value for a time span, usually a band off the wrist
+
+        Arguments:
+        float seconds: Time span without any change """
+
+        super().__init__(**options)
+        self.seconds = seconds
+        self.value = None
+        self.since = 0.0
+
+    def check(self, timestamp, value):
+        if value != self.value:
+            self.value = value
+            self.since = timestamp
+        return timestamp - self.since >= self.seconds
+
+    def check_batch(self, times, values):
+        changed = np.ones(len(values), dtype=bool)
+        changed[1:] = values[1:] != values[:-1]
+        since = times[np.maximum.accumulate(np.where(changed, np.arange(len(values)), 0))]
+        return times - since >= self.seconds
+
+class SensorOffRule(Rule):
+
+    kind = "sensoroff"
+    acceptsInvalid = True
+
+    def __init__(self, sustain=5, **options):
+
+        """ Band sending invalid values, the sensor does not see the skin
+
+        Arguments:
+        int   sustain: Consecutive invalid values before the rule fires """
+
+        super().__init__(sustain=sustain, **options)
+
+    def check(self, timestamp, value):
+        return value in INVALID_VALUES
+
+    def check_batch(self, times, values):
+        return invalid_mask(values)
+
+# Rule classes by the type used in rule files
+RULE_TYPES = {cls.kind: cls for cls in (DropRule, ThresholdRule, RateRule, FlatLineRule, SensorOffRule)}
+
+# -----------------------------------------------------------------------------
+# Rule Engine Class
+# -----------------------------------------------------------------------------
+
+class RuleEngine(object):
+
+    def __init__(self, rules):
+
+        """ Evaluate a set of rules on a stream of samples
+
+        Arguments:
+        list  rules: Rules to evaluate """
+
+        self.rules = list(rules)
+
+    def update(self, timestamp, value):
+
+        """ Add a sample to every rule
+            Returns the names of the rules that fire
+
+        Arguments:
+        float timestamp: Time of the sample in seconds
+        int   value: Heart rate value """
+
+        return [rule.name for rule in self.rules if rule.update(timestamp, value)]
+
+    def evaluate(self, times, values):
+
+        """ Evaluate every rule over a recording
+            Returns a dictionary of boolean arrays by rule name
+
+        Arguments:
+        ndarray times: Time of every sample in seconds
+        ndarray values: Heart rate values """
+
+        return {rule.name: rule.evaluate(times, values) for rule in self.rules}
+
+def default_rules(window=0):
+
+    """ Rules used when no file is given: heart rate 15 below the mean after 60 samples
+
+    Arguments:
+    int   window: Number of samples of the mean (0 uses every sample) """
+
+    return [DropRule(window=window)]
+
+def load_rules(path):
+
+    """ Read rules from a JSON file: a list of objects with the rule type
+        and its arguments, e.g. [{"type": "threshold", "name": "tachycardia", "above": 120}]
+
+    Arguments:
+    str   path: File with the rules """
+
+    with open(path) as f:
+        config = json.load(f)
+
+    rules = []
+    for entry in config:
+        entry = dict(entry)
+        kind = entry.pop('type')
+        if kind not in RULE_TYPES:
+            raise ValueError("Unknown rule type " + kind)
+        rules.append(RULE_TYPES[kind](**entry))
+    return rules
+
+def main():
+
+    """ Main function
+        Evaluates the rules over recorded sessions and prints when they fire """
+
+    from sessionlog import read_session
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sessions', nargs='+', help='Session logs to evaluate')
+    parser.add_argument('-r', '--rules', default=None, help='JSON file with the rules (default: drop rule)')
+    args = parser.parse_args()
+
+    for path in args.sessions:
+        header, records = read_session(path)
+        rules = load_rules(args.rules) if args.rules is not None else default_rules()
+        results = RuleEngine(rules).evaluate(records['time'], records['hr'])
+
+        print("%s (%s, %d samples):" % (path, header['mac'], len(records)))
+        for name, fires in results.items():
+            starts = np.flatnonzero(fires & ~np.concatenate(([False], fires[:-1])))
+            print("  %s: %d samples in %d episodes" % (name, int(fires.sum()), len(starts)))
+            for start in starts[:10]:
+                print("    at %.1f s (%d bpm)" % (records['time'][start], records['hr'][start]))
+
+if __name__ == "__main__":
+    main()
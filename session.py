@@ -0,0 +1,145 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Band session script
+
+import random
+import time
+from const import *
+
+# Characteristics resolved after connecting, stored as device attributes
+CHARACTERISTICS = {
+    (UUIDS.SERVICE_MIBAND1, UUIDS.CHARACTERISTIC_CHUNKED_TRANSFER_READ): 'charChunked',
+    (UUIDS.SERVICE_MIBAND1, UUIDS.CHARACTERISTIC_CHUNKED_TRANSFER_WRITE): 'charChunkedW',
+    (UUIDS.SERVICE_MIBAND1, UUIDS.CHARACTERISTIC_FETCH): 'charFetch',
+    (UUIDS.SERVICE_MIBAND1, UUIDS.CHARACTERISTIC_ACTIVITY_DATA): 'charActivity',
+    (UUIDS.SERVICE_MIBAND1, UUIDS.CHARACTERISTIC_CURRENT_TIME): 'charTime',
+    (UUIDS.SERVICE_MIBAND1, UUIDS.CHARACTERISTIC_SENSOR): 'charSensor',
+    (UUIDS.SERVICE_MIBAND1, UUIDS.CHARACTERISTIC_HZ): 'charHz',
+    (UUIDS.SERVICE_HEART_RATE, UUIDS.CHARACTERISTIC_HEART_RATE_CONTROL): 'charHrControl',
+    (UUIDS.SERVICE_HEART_RATE, UUIDS.CHARACTERISTIC_HEART_RATE_MEASURE): 'charHrMeasure',
+    (UUIDS.SERVICE_ALERT_NOTIFICATION, UUIDS.CHARACTERISTIC_ALERT): 'charNotif',
+}
+
+# Sessions of every band seen by this process
+sessions = {}
+
+# -----------------------------------------------------------------------------
+# Backoff Class
+# -----------------------------------------------------------------------------
+
+class Backoff(object):
+
+    def __init__(self, base=0.5, cap=30.0):
+
+        """ Exponential backoff with jitter between reconnect attempts
+
+        Arguments:
+        float base: Delay after the first failure, in seconds
+        float cap: Maximum delay, in seconds """
+
+        self.base = base
+        self.cap = cap
+        self.failures = 0
+
+    def next_delay(self):
+
+        """ Return the delay before the next attempt and count the failure
+            Half of the delay is random so that many bands do not retry together """
+
+        delay = min(self.cap, self.base * 2 ** self.failures)
+        self.failures += 1
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def reset(self):
+
+        """ Start again from the base delay after a successful connection """
+
+        self.failures = 0
+
+# -----------------------------------------------------------------------------
+# Band Session Class
+# -----------------------------------------------------------------------------
+
+class BandSession(object):
+
+    def __init__(self, mac_address):
+
+        """ State of a band kept across reconnects
+
+        Arguments:
+        str   mac_address: MAC address of the band """
+
+        self.macAddress = mac_address
+        self.chars = {}
+        self.rules = None
+        self.alerts = None
+        self.rr = None
+        self.raw = None
+        self.log = None
+        self.activity = None
+        self.sync = None
+        self.backoff = Backoff()
+        self.dropTime = None
+        self.recoveryTimes = []
+
+    def resolve(self, device):
+
+        """ Set the characteristics of the band as device attributes
+            Services are walked on every connection, since each one creates new
+            characteristic objects even when the device object is reused
+
+        Arguments:
+        gatt.Device device: Connected band """
+
+        self.chars = {}
+        for s in device.services:
+            for c in s.characteristics:
+                name = CHARACTERISTICS.get((s.uuid, c.uuid))
+                if name is not None:
+                    self.chars[name] = c
+
+        for name in CHARACTERISTICS.values():
+            setattr(device, name, self.chars.get(name))
+
+    def forget(self):
+
+        """ Drop the cached characteristics, used when they stop working """
+
+        self.chars = {}
+
+    def dropped(self):
+
+        """ Register that the connection was lost or could not be restored """
+
+        if self.dropTime is None:
+            self.dropTime = time.time()
+
+    def sample_received(self):
+
+        """ Register a new sample from the band
+            Returns the time to first sample after a drop, or None """
+
+        if self.dropTime is None:
+            return None
+
+        recovery = time.time() - self.dropTime
+        self.recoveryTimes.append(recovery)
+        self.dropTime = None
+        self.backoff.reset()
+        return recovery
+
+def get_session(mac_address):
+
+    """ Return the session of a band, creating it on first use
+
+    Arguments:
+    str   mac_address: MAC address of the band """
+
+    if mac_address not in sessions:
+        sessions[mac_address] = BandSession(mac_address)
+
+    return sessions[mac_address]
@@ -0,0 +1,141 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Binary session log script
+
+import atexit
+import os
+import queue
+import struct
+import threading
+import time
+import numpy as np
+from history import HR_DTYPE
+
+# Header: magic, version, band type, MAC address, start time, padded to HEADER_SIZE
+MAGIC = b'MBHR'
+VERSION = 1
+HEADER_FORMAT = '<4sHB17sd'
+HEADER_SIZE = 64
+
+# -----------------------------------------------------------------------------
+# Session Log Class
+# -----------------------------------------------------------------------------
+
+class SessionLog(object):
+
+    def __init__(self, path, mac_address, band_type, batch=64, interval=1.0):
+
+        """ Append-only file of fixed-size heart rate records
+            Records are written and fsync'd in batches by a background thread
+            so the notification callback never waits for the disk
+
+        Arguments:
+        str   path: File of the session
+        str   mac_address: MAC address of the band
+        int   band_type: Type of Mi Band
+        int   batch: Records written at once
+        float interval: Maximum seconds a record waits before being written """
+
+        self.path = path
+        self.interval = interval
+        self.pending = np.zeros(batch, dtype=HR_DTYPE)
+        self.count = 0
+        self.lastFlush = time.time()
+
+        header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, band_type, mac_address.encode(), time.time())
+        self.file = open(path, "wb")
+        self.file.write(header.ljust(HEADER_SIZE, b'\x00'))
+
+        self.batches = queue.Queue()
+        self.thread = threading.Thread(target=self.write_batches, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def append(self, timestamp, value):
+
+        """ Add a sample to the session
+
+        Arguments:
+        float timestamp: Time of the sample
+        int   value: Heart rate value """
+
+        record = self.pending[self.count]
+        record['time'] = timestamp
+        record['hr'] = value
+        self.count += 1
+
+        if self.count == len(self.pending) or time.time() - self.lastFlush >= self.interval:
+            self.flush()
+
+    def flush(self):
+
+        """ Hand the pending records to the writer thread """
+
+        if self.count > 0:
+            self.batches.put(self.pending[:self.count].tobytes())
+            self.count = 0
+        self.lastFlush = time.time()
+
+    def write_batches(self):
+
+        """ Write batches to the file until the log is closed """
+
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                break
+            self.file.write(batch)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+
+        """ Write the remaining records and close the file """
+
+        if self.file.closed:
+            return
+
+        self.flush()
+        self.batches.put(None)
+        self.thread.join()
+        self.file.close()
+
+def create_session_log(log_dir, mac_address, band_type):
+
+    """ Create the log of a new session in a directory
+        Files are named after the band and the start time of the session
+
+    Arguments:
+    str   log_dir: Directory of the session logs
+    str   mac_address: MAC address of the band
+    int   band_type: Type of Mi Band """
+
+    os.makedirs(log_dir, exist_ok=True)
+    name = "%s_%s.hrlog" % (mac_address.replace(":", "").lower(), time.strftime("%Y%m%d-%H%M%S"))
+    return SessionLog(os.path.join(log_dir, name), mac_address, band_type)
+
+def read_session(path):
+
+    """ Memory-map a session log
+        Returns the header as a dictionary and the records as a NumPy array
+        A record cut by a crash at the end of the file is ignored
+
+    Arguments:
+    str   path: File of the session """
+
+    with open(path, "rb") as f:
+        magic, version, bandType, mac, start = struct.unpack_from(HEADER_FORMAT, f.read(HEADER_SIZE))
+
+    if magic != MAGIC:
+        raise ValueError(path + " is not a heart rate session log")
+
+    header = {'version': version, 'band': bandType, 'mac': mac.decode(), 'start': start}
+    count = (os.path.getsize(path) - HEADER_SIZE) // HR_DTYPE.itemsize
+    if count == 0:
+        return header, np.zeros(0, dtype=HR_DTYPE)
+
+    return header, np.memmap(path, dtype=HR_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
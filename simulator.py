@@ -0,0 +1,740 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Simulated band script
+#
+# Runs the Mi Band classes without Bluetooth: a stand-in for the gatt library
+# delivers notifications from simulated bands that speak the chunked transfer
+# authentication, stream heart rate and answer Mi Band 7 history fetches.
+
+import argparse
+import calendar
+import heapq
+import os
+import sys
+import time
+import types
+import numpy as np
+from Crypto.Cipher import AES
+from const import *
+from chunked import ChunkedEncoder, ChunkedDecoder
+from handshake import get_backend
+
+# -----------------------------------------------------------------------------
+# Fake gatt Classes
+# -----------------------------------------------------------------------------
+
+class FakeDeviceManager(object):
+
+    def __init__(self, adapter_name='hci0', speed=1.0):
+
+        """ Event loop and registry of simulated bands, used instead of gatt.DeviceManager
+
+        Arguments:
+        str   adapter_name: Ignored, kept for compatibility with gatt
+        float speed: Time acceleration of every scheduled event """
+
+        self.speed = speed
+        self.bands = {}
+        self.events = []
+        self.counter = 0
+        self.running = False
+
+    def add_band(self, band):
+
+        """ Make a simulated band reachable by its MAC address
+
+        Arguments:
+        SimulatedBand band: Band to add """
+
+        band.manager = self
+        self.bands[band.macAddress] = band
+
+    def timeout_add(self, delay, function, *args):
+
+        """ Call function after delay seconds, again while it returns True
+
+        Arguments:
+        float delay: Seconds before the call, divided by the speed
+        function function: Callback
+        list  args: Arguments of the callback """
+
+        interval = delay / self.speed
+        self.counter += 1
+        heapq.heappush(self.events, (time.perf_counter() + interval, self.counter, interval, function, args))
+
+    def call_soon(self, function, *args):
+
+        """ Call function once as soon as possible
+
+        Arguments:
+        function function: Callback
+        list  args: Arguments of the callback """
+
+        self.counter += 1
+        heapq.heappush(self.events, (time.perf_counter(), self.counter, None, function, args))
+
+    def run(self, duration=None):
+
+        """ Run scheduled events until stopped, out of events or after duration seconds
+
+        Arguments:
+        float duration: Maximum seconds to run """
+
+        self.running = True
+        end = None if duration is None else time.perf_counter() + duration
+        while self.running and self.events:
+            due, _, interval, function, args = self.events[0]
+            if end is not None and due > end:
+                break
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            heapq.heappop(self.events)
+            if function(*args) and interval is not None:
+                self.counter += 1
+                heapq.heappush(self.events, (due + interval, self.counter, interval, function, args))
+        self.running = False
+
+    def stop(self):
+
+        """ Stop the event loop """
+
+        self.running = False
+
+class FakeProperties(object):
+
+    def __init__(self, characteristic):
+
+        """ D-Bus properties of a characteristic, only the MTU and flags are known
+
+        Arguments:
+        FakeCharacteristic characteristic: Owner of the properties """
+
+        self.characteristic = characteristic
+
+    def Get(self, interface, name):
+
+        """ Return a property like org.freedesktop.DBus.Properties.Get """
+
+        if name == 'MTU':
+            return self.characteristic.service.device.band.mtu
+        if name == 'Flags':
+            return self.characteristic.service.device.band.flags(self.characteristic.uuid)
+        raise KeyError(name)
+
+class FakeObject(object):
+
+    def __init__(self, characteristic):
+
+        """ D-Bus object of a characteristic, used for writes
+
+        Arguments:
+        FakeCharacteristic characteristic: Owner of the object """
+
+        self.characteristic = characteristic
+
+    def WriteValue(self, value, options, reply_handler=None, error_handler=None, dbus_interface=None):
+
+        """ Write a value like org.bluez.GattCharacteristic1.WriteValue, answering asynchronously """
+
+        device = self.characteristic.service.device
+        device.band.write(self.characteristic.uuid, bytes(value))
+        if reply_handler is not None:
+            device.manager.call_soon(reply_handler)
+
+class FakeCharacteristic(object):
+
+    def __init__(self, service, uuid):
+
+        """ Characteristic of a simulated band, used instead of gatt.Characteristic
+
+        Arguments:
+        FakeService service: Service of the characteristic
+        str   uuid: UUID of the characteristic """
+
+        self.service = service
+        self.uuid = uuid
+        self.notifying = False
+        self._properties = FakeProperties(self)
+        self._object = FakeObject(self)
+
+    def enable_notifications(self, enabled=True):
+
+        """ Enable notifications and report it to the device asynchronously """
+
+        self.notifying = enabled
+        device = self.service.device
+        device.manager.call_soon(device.characteristic_enable_notifications_succeeded, self)
+
+    def write_value(self, value, offset=0):
+
+        """ Send a value to the simulated band, acknowledged asynchronously as gatt does """
+
+        device = self.service.device
+        device.band.write(self.uuid, bytes(value))
+        device.manager.call_soon(device.characteristic_write_value_succeeded, self)
+
+    def read_value(self, offset=0):
+
+        """ Read a value from the simulated band """
+
+        return self.service.device.band.read(self.uuid)
+
+    def notify(self, value):
+
+        """ Deliver a notification to the device, as gatt does on PropertiesChanged
+
+        Arguments:
+        bytes value: Value sent by the band """
+
+        if self.notifying:
+            self.service.device.characteristic_value_updated(characteristic=self, value=value)
+
+class FakeDeviceObject(object):
+
+    def __init__(self, device):
+
+        """ D-Bus object of a device, used for connections that do not block
+
+        Arguments:
+        FakeDevice device: Owner of the object """
+
+        self.device = device
+
+    def Connect(self, reply_handler=None, error_handler=None):
+
+        """ Connect like org.bluez.Device1.Connect, answering asynchronously """
+
+        device = self.device
+        band = device.manager.bands.get(device.mac_address)
+        if band is None:
+            device.manager.call_soon(error_handler, KeyError("Device does not exist " + device.mac_address))
+            return
+
+        def connected():
+            device.band = band
+            band.connected(device)
+            reply_handler()
+        device.manager.call_soon(connected)
+
+class FakeService(object):
+
+    def __init__(self, device, uuid, characteristics):
+
+        """ Service of a simulated band, used instead of gatt.Service
+
+        Arguments:
+        FakeDevice device: Device of the service
+        str   uuid: UUID of the service
+        list  characteristics: UUIDs of its characteristics """
+
+        self.device = device
+        self.uuid = uuid
+        self.characteristics = [FakeCharacteristic(self, c) for c in characteristics]
+
+class FakeDevice(object):
+
+    def __init__(self, mac_address, manager, managed=True):
+
+        """ Device connected to a simulated band, used instead of gatt.Device
+
+        Arguments:
+        str   mac_address: MAC address of the band
+        FakeDeviceManager manager: Manager with the simulated bands
+        bool  managed: Ignored, kept for compatibility with gatt """
+
+        self.mac_address = mac_address
+        self.manager = manager
+        self.services = []
+        self.band = None
+        self._object = FakeDeviceObject(self)
+
+    def connect(self):
+
+        """ Connect to the simulated band and resolve its services """
+
+        self.band = self.manager.bands[self.mac_address]
+        self.band.connected(self)
+        self.connect_succeeded()
+        self.services_resolved()
+
+    def _connect_signals(self):
+        pass
+
+    def is_services_resolved(self):
+        return self.band is not None
+
+    def disconnect(self):
+
+        """ Disconnect from the simulated band """
+
+        if self.band is not None:
+            self.band.disconnected()
+            self.band = None
+            self.manager.call_soon(self.disconnect_succeeded)
+
+    def characteristic(self, uuid):
+
+        """ Return the characteristic with the given UUID, or None
+
+        Arguments:
+        str   uuid: UUID of the characteristic """
+
+        for s in self.services:
+            for c in s.characteristics:
+                if c.uuid == uuid:
+                    return c
+        return None
+
+    def connect_succeeded(self):
+        pass
+
+    def connect_failed(self, error):
+        pass
+
+    def disconnect_succeeded(self):
+        self.services = []
+
+    def services_resolved(self):
+
+        """ Create the services of the band, like gatt once BlueZ resolved them """
+
+        self.services = [FakeService(self, s, c) for s, c in self.band.services]
+
+    def characteristic_value_updated(self, characteristic, value):
+        pass
+
+    def characteristic_enable_notifications_succeeded(self, characteristic):
+        pass
+
+    def characteristic_write_value_succeeded(self, characteristic):
+        pass
+
+def install():
+
+    """ Register the fake classes as the gatt module
+        Must be called before importing the band classes """
+
+    module = types.ModuleType('gatt')
+    module.Device = FakeDevice
+    module.DeviceManager = FakeDeviceManager
+    module.Service = FakeService
+    module.Characteristic = FakeCharacteristic
+    sys.modules['gatt'] = module
+    return module
+
+# -----------------------------------------------------------------------------
+# Simulated Band Class
+# -----------------------------------------------------------------------------
+
+class SimulatedBand(object):
+
+    def __init__(self, mac_address, auth_key, hr_rate=1.0, activity_rate=50.0, activity_minutes=60,
+                 replay=None, mtu=23, hr_timeout=15.0, rr=False, raw_rate=50.0):
+
+        """ Band that answers like a Mi Band 6/7
+
+        Arguments:
+        str   mac_address: MAC address of the band
+        str   auth_key: Authentication key in hexadecimal
+        float hr_rate: Heart rate notifications per second
+        float activity_rate: Activity packets per second during a fetch
+        int   activity_minutes: Maximum minutes of history sent per fetch
+        ndarray replay: Recorded samples (time, hr) sent instead of generated ones
+        int   mtu: MTU reported for the connection
+        float hr_timeout: Seconds without start command after which measuring stops (None never stops)
+        bool  rr: Send sensor contact and RR intervals with the heart rate
+        float raw_rate: Raw sensor packets per second once the raw stream is started """
+
+        self.macAddress = mac_address
+        self.authKey = auth_key
+        self.hrRate = hr_rate
+        self.activityRate = activity_rate
+        self.activityMinutes = activity_minutes
+        self.replay = replay
+        self.mtu = mtu
+        self.hrTimeout = hr_timeout
+        self.rr = rr
+        self.rawRate = raw_rate
+        self.lastControl = 0.0
+        self.manager = None
+        self.device = None
+        self.sent = 0
+        self.authentications = 0
+        self.drops = 0
+
+        self.services = [
+            (UUIDS.SERVICE_MIBAND1, [UUIDS.CHARACTERISTIC_CHUNKED_TRANSFER_READ, UUIDS.CHARACTERISTIC_CHUNKED_TRANSFER_WRITE,
+                                     UUIDS.CHARACTERISTIC_FETCH, UUIDS.CHARACTERISTIC_ACTIVITY_DATA,
+                                     UUIDS.CHARACTERISTIC_CURRENT_TIME, UUIDS.CHARACTERISTIC_SENSOR, UUIDS.CHARACTERISTIC_HZ]),
+            (UUIDS.SERVICE_HEART_RATE, [UUIDS.CHARACTERISTIC_HEART_RATE_CONTROL, UUIDS.CHARACTERISTIC_HEART_RATE_MEASURE]),
+            (UUIDS.SERVICE_ALERT_NOTIFICATION, [UUIDS.CHARACTERISTIC_ALERT]),
+        ]
+
+        self.backend = get_backend()
+        self.rng = np.random.default_rng()
+
+    def connected(self, device):
+
+        """ Start a new connection
+
+        Arguments:
+        FakeDevice device: Device connected to the band """
+
+        self.device = device
+        self.decoder = ChunkedDecoder()
+        self.encoder = ChunkedEncoder(self.mtu)
+        self.measuring = False
+        self.hr = 70.0
+        self.replayIndex = 0
+        self.fetchRecords = 0
+        self.streaming = False
+        self.rawSequence = [0, 0]
+
+    def drop(self):
+
+        """ Lose the connection like a band going out of range
+            Returns True so it can be scheduled periodically """
+
+        if self.device is not None:
+            self.drops += 1
+            self.device.disconnect()
+        return True
+
+    def disconnected(self):
+
+        """ Stop sending notifications """
+
+        self.device = None
+        self.measuring = False
+        self.streaming = False
+
+    def notify(self, uuid, value):
+
+        """ Send a notification to the connected device
+
+        Arguments:
+        str   uuid: Characteristic that sends it
+        bytes value: Value sent """
+
+        if self.device is None:
+            return
+        characteristic = self.device.characteristic(uuid)
+        if characteristic is not None and characteristic.notifying:
+            self.sent += 1
+            characteristic.notify(value)
+
+    def flags(self, uuid):
+
+        """ Return the flags of a characteristic, only chunked transfer frames are written without response
+
+        Arguments:
+        str   uuid: UUID of the characteristic """
+
+        if uuid == UUIDS.CHARACTERISTIC_CHUNKED_TRANSFER_WRITE:
+            return ['read', 'write', 'write-without-response', 'notify']
+        return ['read', 'write', 'notify']
+
+    def read(self, uuid):
+
+        """ Answer a read request
+
+        Arguments:
+        str   uuid: Characteristic read """
+
+        if uuid == UUIDS.CHARACTERISTIC_CURRENT_TIME:
+            return list(self.time_bytes(time.time())) + [0, 0, 0, 0]
+        return []
+
+    def time_bytes(self, timestamp):
+
+        """ Date in the band format: year (2), month, day, hour, minute, second
+            The simulated band runs in UTC
+
+        Arguments:
+        float timestamp: Time in seconds since epoch """
+
+        t = time.gmtime(timestamp)
+        return bytes([t.tm_year & 0xff, t.tm_year >> 8, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec])
+
+    def write(self, uuid, value):
+
+        """ Handle a value written by the device
+
+        Arguments:
+        str   uuid: Characteristic written
+        bytes value: Value written """
+
+        if uuid == UUIDS.CHARACTERISTIC_CHUNKED_TRANSFER_WRITE:
+            message = self.decoder.feed(value)
+            if message is not None:
+                self.chunked_message(bytes(message))
+        elif uuid == UUIDS.CHARACTERISTIC_HEART_RATE_CONTROL:
+            if value[:3] == b'\x15\x01\x01':
+                self.lastControl = time.perf_counter()
+            if value[:3] == b'\x15\x01\x01' and not self.measuring:
+                self.measuring = True
+                self.manager.timeout_add(1.0 / self.hrRate, self.send_hr, self.device)
+        elif uuid == UUIDS.CHARACTERISTIC_FETCH:
+            self.fetch_command(value)
+        elif uuid == UUIDS.CHARACTERISTIC_SENSOR:
+            if value[:1] == b'\x02' and not self.streaming:
+                self.streaming = True
+                self.manager.timeout_add(1.0 / self.rawRate, self.send_raw, self.device)
+            elif value[:1] == b'\x03':
+                self.streaming = False
+
+    def chunked_message(self, message):
+
+        """ Answer the authentication messages
+
+        Arguments:
+        bytes message: Message reassembled from the chunked transfer frames """
+
+        if message[:4] == b'\x04\x02\x00\x02':
+            self.hostPublic = message[4:52]
+            self.random = self.rng.integers(0, 256, 16, dtype=np.uint8).tobytes()
+            self.privateKey, publicKey = self.backend.generate_keys()
+            reply = AUTH.KEYS_RECEIVED + self.random + publicKey.tobytes()
+        elif message[:1] == b'\x05':
+            # The expected answer is built with plain AES, not with the client code under test:
+            # the random number encrypted with the auth key, then with the session key
+            # (the auth key xored with bytes 8 to 24 of the ECDH shared secret)
+            key = bytes.fromhex(self.authKey)
+            secret = bytes(self.backend.shared_secret(self.privateKey, self.hostPublic))
+            sessionKey = bytes(a ^ b for a, b in zip(secret[8:24], key))
+            expected = (b'\x05' + AES.new(key, AES.MODE_CBC, bytes(16)).encrypt(self.random) +
+                        AES.new(sessionKey, AES.MODE_CBC, bytes(16)).encrypt(self.random))
+            reply = AUTH.SUCCESS if message == expected else b'\x10\x05\x08'
+            self.authentications += message == expected
+        else:
+            return
+
+        for frame in self.encoder.encode(0, reply):
+            self.manager.call_soon(self.notify, UUIDS.CHARACTERISTIC_CHUNKED_TRANSFER_READ, bytes(frame))
+
+    def send_hr(self, device):
+
+        """ Send a heart rate notification, generated or replayed
+            Returns True while the band keeps measuring
+
+        Arguments:
+        FakeDevice device: Device of the connection that started the measurement """
+
+        if device is not self.device or not self.measuring:
+            return False
+
+        # Like the real band, continuous measurement stops without keep-alive
+        if self.hrTimeout is not None and time.perf_counter() - self.lastControl > self.hrTimeout / self.manager.speed:
+            self.measuring = False
+            return False
+
+        if self.replay is not None:
+            if self.replayIndex >= len(self.replay):
+                self.measuring = False
+                return False
+            hr = int(self.replay['hr'][self.replayIndex])
+            self.replayIndex += 1
+            if self.replayIndex < len(self.replay):
+                delay = self.replay['time'][self.replayIndex] - self.replay['time'][self.replayIndex - 1]
+                self.manager.timeout_add(max(float(delay), 0.0), self.send_hr, device)
+        else:
+            self.hr = min(max(self.hr + self.rng.normal(0, 1.5), 45), 180)
+            hr = int(self.hr)
+            self.manager.timeout_add(1.0 / self.hrRate, self.send_hr, device)
+
+        if self.rr and hr > 0:
+            # Contact detected and one RR interval per beat since the last notification
+            interval = 60.0 / hr
+            count = max(1, min(9, int(round(1.0 / self.hrRate / interval))))
+            beats = self.rng.normal(interval, interval * 0.05, count)
+            self.notify(UUIDS.CHARACTERISTIC_HEART_RATE_MEASURE,
+                        bytes([0x16, hr]) + np.round(beats * 1024).astype('<u2').tobytes())
+        else:
+            self.notify(UUIDS.CHARACTERISTIC_HEART_RATE_MEASURE, bytes([0x00, hr]))
+        return False
+
+    def send_raw(self, device):
+
+        """ Send a raw sensor packet, accelerometer and PPG in turn
+            Returns True while the stream is running
+
+        Arguments:
+        FakeDevice device: Device of the connection that started the stream """
+
+        if device is not self.device or not self.streaming:
+            return False
+
+        kind = self.rawSequence[0] + self.rawSequence[1]
+        if kind % 2 == 0:
+            samples = self.rng.normal((0, 0, 1024), 40, (3, 3)).astype('<i2')
+            header = bytes([0x01, self.rawSequence[0] & 0xff])
+            self.rawSequence[0] += 1
+        else:
+            phase = 2 * np.pi * self.hr / 60.0 * (time.perf_counter() + np.arange(9) / (4.5 * self.rawRate))
+            samples = (30000 + 2000 * np.sin(phase) + self.rng.normal(0, 50, 9)).astype('<u2')
+            header = bytes([0x02, self.rawSequence[1] & 0xff])
+            self.rawSequence[1] += 1
+
+        self.notify(UUIDS.CHARACTERISTIC_HZ, header + samples.tobytes())
+        return True
+
+    def fetch_command(self, value):
+
+        """ Answer the Mi Band 7 history fetch commands
+
+        Arguments:
+        bytes value: Command written on the fetch characteristic """
+
+        if value[:1] == b'\x01' and len(value) >= 9:
+            year = value[2] | (value[3] << 8)
+            since = calendar.timegm((year, value[4], value[5], value[6], value[7], value[8]))
+            since = max(since, time.time() - self.activityMinutes * 60)
+            # Only activity data (type 0x25) is simulated, other types are empty
+            self.fetchRecords = max(int((time.time() - since) // 60), 0) if value[1] == 0x25 else 0
+            reply = b'\x10\x01\x01' + (self.fetchRecords * 4).to_bytes(4, "little") + self.time_bytes(since) + b'\x00'
+            self.manager.call_soon(self.notify, UUIDS.CHARACTERISTIC_FETCH, reply)
+        elif value[:1] == b'\x02':
+            self.fetchSent = 0
+            self.fetchSequence = 0
+            self.manager.timeout_add(1.0 / self.activityRate, self.send_activity, self.device)
+        elif value[:1] == b'\x03':
+            self.manager.call_soon(self.notify, UUIDS.CHARACTERISTIC_FETCH, b'\x10\x03\x01')
+
+    def send_activity(self, device):
+
+        """ Send the next activity packet of the fetch, four records per packet
+            Returns True while records remain
+
+        Arguments:
+        FakeDevice device: Device of the connection that started the fetch """
+
+        if device is not self.device:
+            return False
+
+        if self.fetchSent >= self.fetchRecords:
+            self.notify(UUIDS.CHARACTERISTIC_FETCH, b'\x10\x02\x01')
+            return False
+
+        n = min(4, self.fetchRecords - self.fetchSent)
+        records = np.zeros((n, 4), dtype=np.uint8)
+        records[:, 0] = 1
+        records[:, 1] = self.rng.integers(0, 100, n)
+        records[:, 2] = self.rng.integers(0, 120, n)
+        records[:, 3] = self.rng.integers(55, 110, n)
+        self.notify(UUIDS.CHARACTERISTIC_ACTIVITY_DATA, bytes([self.fetchSequence & 0xff]) + records.tobytes())
+
+        self.fetchSent += n
+        self.fetchSequence += 1
+        return True
+
+# -----------------------------------------------------------------------------
+# Load Test
+# -----------------------------------------------------------------------------
+
+def main():
+
+    """ Main function
+        Connects the band classes to simulated bands and reports throughput """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--bands', type=int, default=1, help='Number of simulated bands')
+    parser.add_argument('-b', '--band', type=int, default=6, help='Type of Mi Band')
+    parser.add_argument('-r', '--rate', type=float, default=1.0, help='Heart rate notifications per second per band')
+    parser.add_argument('-a', '--activity-rate', type=float, default=50.0, help='Activity packets per second during a fetch')
+    parser.add_argument('-t', '--duration', type=float, default=10.0, help='Seconds to run')
+    parser.add_argument('--replay', default=None, help='Session log replayed by every band instead of generated samples')
+    parser.add_argument('-s', '--speed', type=float, default=1.0, help='Time acceleration of the simulation')
+    parser.add_argument('--mtu', type=int, default=23, help='MTU reported by the simulated bands')
+    parser.add_argument('--hr-timeout', type=float, default=15.0, help='Seconds the bands measure without keep-alive')
+    parser.add_argument('--raw-dir', default=None, help='Directory where the Mi Band 6 records the raw sensor stream')
+    parser.add_argument('--raw-rate', type=float, default=50.0, help='Raw sensor packets per second per band')
+    parser.add_argument('--rr', action='store_true', help='Send sensor contact and RR intervals with the heart rate')
+    parser.add_argument('-d', '--drop', type=float, default=None, help='Seconds between connection drops of every band, reconnected by the client')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Discard samples and messages')
+    args = parser.parse_args()
+
+    install()
+    import output
+    import commands
+    from keepalive import KeepAlive
+    from band6 import MiBand6
+    from band7 import MiBand7
+
+    if args.quiet:
+        output.configure(open(os.devnull, "w"))
+
+    replay = None
+    if args.replay is not None:
+        from sessionlog import read_session
+        replay = np.array(read_session(args.replay)[1])
+
+    authKey = "00112233445566778899aabbccddeeff"
+    manager = FakeDeviceManager(speed=args.speed)
+    commands.set_timer(lambda ms, f: manager.timeout_add(ms / 1000.0, f))
+    devices = []
+    keepAlives = []
+    bands = []
+
+    def reconnect(device, keep_alive):
+
+        """ Connect the same device object again after a drop, as the fleet does """
+
+        if keep_alive is not None:
+            keep_alive.stop()
+        manager.call_soon(device.connect_async, authKey)
+
+    for i in range(args.bands):
+        mac = "00:00:00:00:%02X:%02X" % (i >> 8, i & 0xff)
+        band = SimulatedBand(mac, authKey, hr_rate=args.rate, activity_rate=args.activity_rate, replay=replay,
+                             mtu=args.mtu, hr_timeout=args.hr_timeout, rr=args.rr, raw_rate=args.raw_rate)
+        manager.add_band(band)
+        bands.append(band)
+        if args.band == 6:
+            device = MiBand6(mac_address = mac, manager = manager, raw_dir = args.raw_dir)
+        else:
+            device = MiBand7(mac_address = mac, manager = manager, sync_state = None)
+        keepAlive = None
+        if args.band == 6:
+            keepAlive = KeepAlive(device, timeout=args.hr_timeout, schedule=lambda ms, f: manager.timeout_add(ms / 1000.0, f))
+            device.authCallback = lambda d, k=keepAlive: k.start()
+            keepAlives.append(keepAlive)
+        device.disconnectCallback = lambda d, k=keepAlive: reconnect(d, k)
+        device.connectCallback = lambda d: d.enable_notifications_chunked()
+        device.connect_async(authKey)
+        devices.append(device)
+        if args.drop is not None:
+            manager.timeout_add(args.drop, band.drop)
+
+    start = time.perf_counter()
+    cpu = time.process_time()
+    manager.run(args.duration)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    output.get_sink().close()
+
+    count = sum(d.notifCount for d in devices)
+    print("Simulated %d bands for %.1f s: %d notifications, %.0f notifications/sec, %.1f us CPU/notification" % (
+        args.bands, elapsed, count, count / elapsed, cpu / max(count, 1) * 1e6))
+    print("GATT writes: %d, coalesced %d, failed %d" % (sum(d.commands.writes for d in devices),
+                                                       sum(d.commands.coalesced for d in devices),
+                                                       sum(d.commands.failures for d in devices)))
+    print("Connections: %d drops, %d authentications" % (sum(b.drops for b in bands), sum(b.authentications for b in bands)))
+    if keepAlives:
+        print("Keep-alive: %d commands, %d restarts" % (sum(k.pings for k in keepAlives), sum(k.rearms for k in keepAlives)))
+    if args.raw_dir is not None and args.band == 6:
+        for d in devices:
+            d.rawCapture.close()
+        print("Raw sensor: %d packets, %d samples, %d lost, %d unknown, %d buffers" % (
+            sum(d.rawCapture.packets for d in devices), sum(d.rawCapture.samples for d in devices),
+            sum(d.rawCapture.lost for d in devices), sum(d.rawCapture.unknown for d in devices),
+            sum(d.rawCapture.allocated for d in devices)))
+    if args.rr and args.band == 6:
+        print("RR intervals: %d, HRV of the first band: %s" % (sum(len(d.rrIntervals) for d in devices), devices[0].rrIntervals.hrv()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Running statistics script
+
+import math
+from collections import deque
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Running Statistics Class
+# -----------------------------------------------------------------------------
+
+class RunningStats(object):
+
+    def __init__(self, window=0, alpha=0.1):
+
+        """ Keep mean, variance, min/max and exponentially weighted mean
+            of a stream of samples, updated in O(1) per sample
+
+        Arguments:
+        int   window: Number of most recent samples to consider, at least 2 (0 uses every sample)
+        float alpha: Smoothing factor of the exponentially weighted mean """
+
+        self.window = int(window)
+        if self.window != 0 and self.window < 2:
+            raise ValueError("Window must be 0 or at least 2 samples, not %d" % self.window)
+        self.alpha = float(alpha)
+        self.reset()
+
+    def reset(self):
+
+        """ Forget every sample seen so far """
+
+        self.count = 0
+        self.total = 0
+        self.mean = 0.0
+        self.ewma = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+        # Sliding window state: samples ring and monotonic deques for min/max
+        self.ring = np.zeros(self.window, dtype=np.float64) if self.window > 0 else None
+        self.minQueue = deque()
+        self.maxQueue = deque()
+
+    def update(self, value):
+
+        """ Add a new sample to the statistics
+
+        Arguments:
+        float value: Sample to add """
+
+        value = float(value)
+
+        if self.total == 0:
+            self.ewma = value
+        else:
+            self.ewma += self.alpha * (value - self.ewma)
+
+        if self.window > 0:
+            slot = self.total % self.window
+
+            # Drop the oldest sample when the window is full (Welford removal)
+            if self.count == self.window:
+                old = self.ring[slot]
+                self.count -= 1
+                delta = old - self.mean
+                self.mean -= delta / self.count
+                self.m2 -= delta * (old - self.mean)
+            self.ring[slot] = value
+
+            # Keep min/max of the window in monotonic queues
+            oldest = self.total - self.window
+            while self.minQueue and self.minQueue[-1][1] >= value:
+                self.minQueue.pop()
+            self.minQueue.append((self.total, value))
+            if self.minQueue[0][0] <= oldest:
+                self.minQueue.popleft()
+            while self.maxQueue and self.maxQueue[-1][1] <= value:
+                self.maxQueue.pop()
+            self.maxQueue.append((self.total, value))
+            if self.maxQueue[0][0] <= oldest:
+                self.maxQueue.popleft()
+            self.min = self.minQueue[0][1]
+            self.max = self.maxQueue[0][1]
+        else:
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+
+        # Welford update of mean and sum of squared differences
+        self.count += 1
+        self.total += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+
+        """ Sample variance of the samples in the window """
+
+        if self.count < 2:
+            return 0.0
+        return max(self.m2, 0.0) / (self.count - 1)
+
+    @property
+    def std(self):
+
+        """ Sample standard deviation of the samples in the window """
+
+        return math.sqrt(self.variance)
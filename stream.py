@@ -0,0 +1,278 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Streaming server script
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import stat
+import struct
+import threading
+from collections import deque
+import numpy as np
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+def websocket_frame(data):
+
+    """ Wrap data in an unmasked WebSocket text frame
+
+    Arguments:
+    bytes data: Payload of the frame """
+
+    size = len(data)
+    if size < 126:
+        header = struct.pack("!BB", 0x81, size)
+    elif size < 65536:
+        header = struct.pack("!BBH", 0x81, 126, size)
+    else:
+        header = struct.pack("!BBQ", 0x81, 127, size)
+    return header + data
+
+# -----------------------------------------------------------------------------
+# Subscriber Class
+# -----------------------------------------------------------------------------
+
+class Subscriber(object):
+
+    def __init__(self, writer, topics, websocket, buffer):
+
+        """ Client of the streaming server
+
+        Arguments:
+        asyncio.StreamWriter writer: Connection of the client
+        frozenset topics: MAC addresses the client wants (None for every band)
+        bool  websocket: Frames are sent as WebSocket messages
+        int   buffer: Number of frames waiting before the client is evicted """
+
+        self.writer = writer
+        self.topics = topics
+        self.websocket = websocket
+        self.frames = asyncio.Queue(maxsize=buffer)
+        self.evicted = False
+
+# -----------------------------------------------------------------------------
+# Stream Server Class
+# -----------------------------------------------------------------------------
+
+class StreamServer(object):
+
+    def __init__(self, host='127.0.0.1', port=8765, path=None, buffer=64, interval=0.1, backlog=100000):
+
+        """ Publish samples to local clients over TCP, WebSocket or a Unix socket
+            The asyncio loop runs in its own thread; publish only appends to a deque,
+            and the loop sends the samples in batches every interval seconds.
+            Clients send one line with the MAC addresses they want (or *, in any case), or connect
+            with WebSocket to /MAC or /, then receive one JSON list of events per batch.
+            A client with buffer frames waiting is disconnected.
+            A client sending HISTORY MAC SECONDS [POINTS] receives the downsampled
+            heart rate of the last seconds from the time series store instead
+
+        Arguments:
+        str   host: Address of the TCP and WebSocket server (None disables it)
+        int   port: Port of the TCP and WebSocket server
+        str   path: Path of the Unix socket (None disables it)
+        int   buffer: Frames waiting for a client before it is evicted
+        float interval: Seconds between batches
+        int   backlog: Events kept while the loop is late, older ones are dropped """
+
+        self.host = host
+        self.port = port
+        self.path = path
+        self.buffer = buffer
+        self.interval = interval
+        self.events = deque(maxlen=backlog)
+        self.subscribers = set()
+        self.published = 0
+        self.evicted = 0
+        self.loop = None
+        self.error = None
+        self.ready = threading.Event()
+
+    def start(self):
+
+        """ Start the server thread and wait until it listens
+            Errors raised while binding, e.g. a port already in use, are raised here """
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self
+
+    def run(self):
+
+        """ Run the asyncio loop of the server """
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            if self.host is not None:
+                self.loop.run_until_complete(asyncio.start_server(self.connected, self.host, self.port))
+            if self.path is not None:
+                # A socket file left by a previous run would make the bind fail
+                if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+                    os.unlink(self.path)
+                self.loop.run_until_complete(asyncio.start_unix_server(self.connected, self.path))
+            self.loop.create_task(self.send_batches())
+        except Exception as e:
+            self.error = e
+            self.loop.close()
+            return
+        finally:
+            self.ready.set()
+        self.loop.run_forever()
+
+    def publish(self, event):
+
+        """ Queue an event for the subscribers, safe to call from any thread
+
+        Arguments:
+        dict  event: Event with time, mac, kind and either hr or text """
+
+        self.events.append(event)
+
+    async def connected(self, reader, writer):
+
+        """ Read the subscription of a new client and send it frames until it leaves
+
+        Arguments:
+        asyncio.StreamReader reader: Data sent by the client
+        asyncio.StreamWriter writer: Connection of the client """
+
+        try:
+            line = (await asyncio.wait_for(reader.readline(), 10)).decode(errors="replace").strip()
+            websocket = line.startswith("GET ")
+            if websocket:
+                topic, key = line.split()[1].strip("/"), None
+                while True:
+                    header = (await reader.readline()).decode(errors="replace").strip()
+                    if not header:
+                        break
+                    name, _, value = header.partition(":")
+                    if name.strip().lower() == "sec-websocket-key":
+                        key = value.strip()
+                if key is None:
+                    writer.close()
+                    return
+                accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+                writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                              "Sec-WebSocket-Accept: " + accept + "\r\n\r\n").encode())
+                topics = frozenset(topic.upper().split(",")) if topic else None
+            elif line.upper().startswith("HISTORY"):
+                writer.write(self.history(line.split()[1:]))
+                await writer.drain()
+                writer.close()
+                return
+            else:
+                macs = line.replace(",", " ").upper().split()
+                topics = None if not macs or "*" in macs else frozenset(macs)
+        except (asyncio.TimeoutError, ConnectionError, ValueError, IndexError):
+            writer.close()
+            return
+
+        subscriber = Subscriber(writer, topics, websocket, self.buffer)
+        self.subscribers.add(subscriber)
+        try:
+            while True:
+                frame = await subscriber.frames.get()
+                if frame is None:
+                    break
+                writer.write(frame)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+            writer.close()
+
+    def history(self, arguments):
+
+        """ Answer a history query with one JSON object
+            Points have the time, minimum, mean and maximum heart rate of a bucket
+
+        Arguments:
+        list  arguments: MAC address, seconds and optionally the number of points """
+
+        from timeseries import stores
+
+        mac = arguments[0].upper()
+        seconds = float(arguments[1])
+        points = int(arguments[2]) if len(arguments) > 2 else 300
+        store = next((s for address, s in stores.items() if address.upper() == mac), None)
+        end = store.last_time() if store is not None else None
+        if end is None:
+            return (json.dumps({'mac': mac, 'points': []}) + "\n").encode()
+
+        times, low, mean, high = store.downsample(end - seconds, end + 1, points)
+        rows = np.column_stack((times, low, mean, high)).round(2).tolist()
+        return (json.dumps({'mac': mac, 'points': rows}) + "\n").encode()
+
+    async def send_batches(self):
+
+        """ Every interval, encode the new events once per subscription and queue them """
+
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.events:
+                continue
+
+            batch = []
+            while self.events:
+                batch.append(self.events.popleft())
+            self.published += len(batch)
+
+            frames = {}
+            for subscriber in list(self.subscribers):
+                key = (subscriber.topics, subscriber.websocket)
+                if key not in frames:
+                    events = batch if subscriber.topics is None else \
+                             [e for e in batch if (e.get('mac') or '').upper() in subscriber.topics]
+                    data = (json.dumps(events) + "\n").encode() if events else None
+                    frames[key] = websocket_frame(data) if data is not None and subscriber.websocket else data
+                frame = frames[key]
+                if frame is None:
+                    continue
+                try:
+                    subscriber.frames.put_nowait(frame)
+                except asyncio.QueueFull:
+                    self.evict(subscriber)
+
+    def evict(self, subscriber):
+
+        """ Disconnect a client that does not read its frames fast enough
+
+        Arguments:
+        Subscriber subscriber: Slow client """
+
+        self.evicted += 1
+        self.subscribers.discard(subscriber)
+        subscriber.evicted = True
+        while not subscriber.frames.empty():
+            subscriber.frames.get_nowait()
+        subscriber.frames.put_nowait(None)
+        subscriber.writer.transport.abort()
+
+# Server publishing the samples, created by start_server
+server = None
+
+def start_server(host='127.0.0.1', port=8765, path=None, **options):
+
+    """ Start the streaming server and return it
+
+    Arguments:
+    str   host: Address of the TCP and WebSocket server (None disables it)
+    int   port: Port of the TCP and WebSocket server
+    str   path: Path of the Unix socket (None disables it)
+    dict  options: Extra arguments of StreamServer """
+
+    global server
+    server = StreamServer(host, port, path, **options).start()
+    return server
@@ -0,0 +1,94 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# History synchronization script
+
+import calendar
+import json
+import os
+import time
+
+# -----------------------------------------------------------------------------
+# History Sync Class
+# -----------------------------------------------------------------------------
+
+class HistorySync(object):
+
+    def __init__(self, mac_address, path="sync_state.json", initial=3600):
+
+        """ Keep the time of the last record received from a band
+            so that each fetch only asks for what is new
+
+        Arguments:
+        str   mac_address: MAC address of the band
+        str   path: JSON file where the time of the last record of every band is stored
+        int   initial: Seconds of history fetched the first time a band is synchronized """
+
+        self.macAddress = mac_address
+        self.path = path
+        self.initial = initial
+        self.highWater = self.load().get(mac_address)
+        self.dirty = False
+
+    def load(self):
+
+        """ Read the state of every band from the file """
+
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def since_bytes(self, band_time):
+
+        """ Return the start date of the next fetch, in the local time of the band
+            Format: year (2), month, day, hour, minute, second
+
+        Arguments:
+        bytes[] band_time: Current time read from the band """
+
+        bandTime = [int(b) for b in band_time]
+        bandNow = calendar.timegm((bandTime[0] | (bandTime[1] << 8), bandTime[2], bandTime[3],
+                                   bandTime[4], bandTime[5], bandTime[6]))
+
+        # Offset of the band clock, rounded to the quarter of hour used by timezones
+        offset = round((bandNow - time.time()) / 900) * 900
+
+        # Records are one minute apart, so ask for the minute after the last one
+        if self.highWater is None:
+            since = time.time() - self.initial
+        else:
+            since = self.highWater + 60
+
+        t = time.gmtime(since + offset)
+        return [t.tm_year & 0xff, t.tm_year >> 8, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec]
+
+    def advance(self, timestamp):
+
+        """ Register that every record up to timestamp was received
+
+        Arguments:
+        float timestamp: Time of the last record received """
+
+        if self.highWater is None or timestamp > self.highWater:
+            self.highWater = float(timestamp)
+            self.dirty = True
+
+    def commit(self):
+
+        """ Store the time of the last record received in the file
+            The file is replaced atomically so a crash never corrupts it """
+
+        if not self.dirty or self.path is None:
+            return
+
+        state = self.load()
+        state[self.macAddress] = self.highWater
+        temp = self.path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(temp, self.path)
+        self.dirty = False
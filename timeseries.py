@@ -0,0 +1,397 @@
+# -----------------------------------------------------------------------------
+# Heart Rate Monitor for Mi Band 6 and 7
+# -----------------------------------------------------------------------------
+# Author: Daniel Oliveira
+# https://github.com/danielsousaoliveira
+# -----------------------------------------------------------------------------
+# Time series store script
+
+import threading
+import numpy as np
+from history import HR_DTYPE
+
+# Record of a rollup bucket: start time, number, sum, minimum and maximum of its samples
+ROLLUP_DTYPE = np.dtype([('time', '<f8'), ('count', '<u4'), ('sum', '<f8'), ('min', '<u2'), ('max', '<u2')])
+
+# Resolution in seconds and number of buckets of every rollup level: 3 hours, 1 week, 1 year
+LEVELS = ((1, 10800), (60, 10080), (3600, 8760))
+
+# Stores of every band seen by this process, kept across reconnects
+stores = {}
+
+# -----------------------------------------------------------------------------
+# Time Ring Class
+# -----------------------------------------------------------------------------
+
+class TimeRing(object):
+
+    def __init__(self, dtype, capacity):
+
+        """ Ring buffer of records kept sorted by time
+            Records arriving in order are appended in O(1), late ones are inserted
+            in place, and the oldest record is dropped when the ring is full
+
+        Arguments:
+        np.dtype dtype: Type of the records, with a time column
+        int   capacity: Number of records kept """
+
+        self.dtype = dtype
+        self.capacity = max(int(capacity), 2)
+        self.columns = {name: np.zeros(self.capacity, dtype=dtype[name]) for name in dtype.names}
+        self.times = self.columns['time']
+        self.start = self.size = 0
+        self.dropped = False
+
+    def __len__(self):
+
+        """ Number of records kept """
+
+        return self.size
+
+    def slot(self, index):
+
+        """ Position in the arrays of the record at an index in time order
+
+        Arguments:
+        int   index: Index of the record, 0 being the oldest """
+
+        return (self.start + index) % self.capacity
+
+    def first_time(self):
+
+        """ Time of the oldest record, None when the ring is empty """
+
+        return float(self.times[self.slot(0)]) if self.size else None
+
+    def last_time(self):
+
+        """ Time of the newest record, None when the ring is empty """
+
+        return float(self.times[self.slot(self.size - 1)]) if self.size else None
+
+    def covers(self, timestamp):
+
+        """ Check if every record from a time on is still kept
+
+        Arguments:
+        float timestamp: Time to check """
+
+        return not self.dropped or (self.size > 0 and self.times[self.slot(0)] <= timestamp)
+
+    def locate(self, timestamp, side='left'):
+
+        """ Index where a record of this time would be inserted, in O(log n)
+            The ring holds at most two sorted segments, searched one after the other
+
+        Arguments:
+        float timestamp: Time to look for
+        str   side: left for the first index, right for the index after equal times """
+
+        end = self.start + self.size
+        if end <= self.capacity:
+            return int(np.searchsorted(self.times[self.start:end], timestamp, side))
+
+        first = self.capacity - self.start
+        wrapped = self.times[:end - self.capacity]
+        if timestamp > wrapped[0] or (side == 'right' and timestamp == wrapped[0]):
+            return first + int(np.searchsorted(wrapped, timestamp, side))
+        return int(np.searchsorted(self.times[self.start:], timestamp, side))
+
+    def insert(self, index, record):
+
+        """ Insert a record at an index, shifting the newer ones
+            Returns the position of the record, or None if it is older than every record of a full ring
+
+        Arguments:
+        int   index: Index in time order
+        tuple record: Values of the columns, in order """
+
+        if self.size == self.capacity:
+            self.dropped = True
+            if index == 0:
+                return None
+            self.start = (self.start + 1) % self.capacity
+            self.size -= 1
+            index -= 1
+
+        if index < self.size:
+            source = self.slot(np.arange(index, self.size))
+            target = self.slot(np.arange(index + 1, self.size + 1))
+            for column in self.columns.values():
+                column[target] = column[source]
+
+        slot = self.slot(index)
+        for column, value in zip(self.columns.values(), record):
+            column[slot] = value
+        self.size += 1
+        return slot
+
+    def read(self, first, last):
+
+        """ Copy the records between two indexes as a structured array
+
+        Arguments:
+        int   first: Index of the first record
+        int   last: Index after the last record """
+
+        first, last = max(first, 0), min(last, self.size)
+        records = np.empty(max(last - first, 0), dtype=self.dtype)
+        if len(records):
+            slots = self.slot(np.arange(first, last))
+            for name, column in self.columns.items():
+                records[name] = column[slots]
+        return records
+
+    def between(self, start, end):
+
+        """ Copy the records with start <= time < end
+
+        Arguments:
+        float start: Oldest time included
+        float end: Time after the newest included """
+
+        return self.read(self.locate(start), self.locate(end))
+
+# -----------------------------------------------------------------------------
+# Rollup Level Class
+# -----------------------------------------------------------------------------
+
+class RollupLevel(TimeRing):
+
+    def __init__(self, resolution, capacity):
+
+        """ Count, sum, minimum and maximum of the samples of every bucket of a resolution
+
+        Arguments:
+        float resolution: Seconds covered by a bucket
+        int   capacity: Number of buckets kept """
+
+        super().__init__(ROLLUP_DTYPE, capacity)
+        self.resolution = resolution
+        self.count = self.columns['count']
+        self.sum = self.columns['sum']
+        self.min = self.columns['min']
+        self.max = self.columns['max']
+
+    def add(self, timestamp, value):
+
+        """ Add a sample to its bucket, creating the bucket if needed
+
+        Arguments:
+        float timestamp: Time of the sample
+        int   value: Heart rate value """
+
+        bucket = (timestamp // self.resolution) * self.resolution
+        slot = self.slot(self.size - 1)
+        if self.size == 0 or self.times[slot] != bucket:
+            index = self.size if self.size == 0 or bucket > self.times[slot] else self.locate(bucket)
+            if index == self.size or self.times[self.slot(index)] != bucket:
+                self.insert(index, (bucket, 1, value, value, value))
+                return
+            slot = self.slot(index)
+
+        self.count[slot] += 1
+        self.sum[slot] += value
+        if value < self.min[slot]:
+            self.min[slot] = value
+        if value > self.max[slot]:
+            self.max[slot] = value
+
+# -----------------------------------------------------------------------------
+# Time Series Store Class
+# -----------------------------------------------------------------------------
+
+class TimeSeriesStore(object):
+
+    def __init__(self, capacity=3600, levels=LEVELS):
+
+        """ Heart rate samples of a band sorted by time, with rollups of several resolutions
+            updated on every sample, so range queries and downsampled reads take
+            O(log n) to find the records plus the size of the answer.
+            Safe to query from other threads, e.g. the streaming server
+
+        Arguments:
+        int   capacity: Number of samples kept
+        tuple levels: Resolution in seconds and number of buckets of every rollup """
+
+        self.samples = TimeRing(HR_DTYPE, capacity)
+        self.levels = [RollupLevel(resolution, size) for resolution, size in sorted(levels)]
+        self.lock = threading.Lock()
+
+    def __len__(self):
+
+        """ Number of samples kept """
+
+        return len(self.samples)
+
+    def append(self, timestamp, value):
+
+        """ Add a valid sample to the store and to every rollup
+
+        Arguments:
+        float timestamp: Time of the sample
+        int   value: Heart rate value """
+
+        with self.lock:
+            samples = self.samples
+            if samples.size and timestamp < samples.times[samples.slot(samples.size - 1)]:
+                samples.insert(samples.locate(timestamp, 'right'), (timestamp, value))
+            else:
+                samples.insert(samples.size, (timestamp, value))
+            for level in self.levels:
+                level.add(timestamp, value)
+
+    def last_time(self):
+
+        """ Time of the newest sample, None when the store is empty """
+
+        with self.lock:
+            return self.samples.last_time()
+
+    def range(self, start, end):
+
+        """ Samples with start <= time < end
+
+        Arguments:
+        float start: Oldest time included
+        float end: Time after the newest included """
+
+        with self.lock:
+            return self.samples.between(start, end)
+
+    def level(self, resolution):
+
+        """ Rollup of a resolution
+
+        Arguments:
+        float resolution: Seconds covered by a bucket """
+
+        for level in self.levels:
+            if level.resolution == resolution:
+                return level
+        raise ValueError("No rollup of %s s" % resolution)
+
+    def rollup(self, resolution, start, end):
+
+        """ Buckets of a resolution starting with start <= time < end
+
+        Arguments:
+        float resolution: Seconds covered by a bucket
+        float start: Oldest time included
+        float end: Time after the newest included """
+
+        with self.lock:
+            return self.level(resolution).between(start, end)
+
+    def summary(self, start, end):
+
+        """ Number, mean, minimum and maximum of the samples with start <= time < end
+            The largest buckets inside the range are used, and finer ones only at its edges.
+            Buckets a level dropped are read from the finer sources that still keep them,
+            the samples included, and edges older than every finer source are rounded to the buckets
+
+        Arguments:
+        float start: Oldest time included
+        float end: Time after the newest included """
+
+        with self.lock:
+            count, total, low, high = self.combine(start, end, len(self.levels) - 1)
+
+        if count == 0:
+            return {'count': 0, 'mean': None, 'min': None, 'max': None}
+        return {'count': count, 'mean': total / count, 'min': low, 'max': high}
+
+    def combine(self, start, end, depth):
+
+        """ Count, sum, minimum and maximum between two times, from a rollup level down to the samples
+
+        Arguments:
+        float start: Oldest time included
+        float end: Time after the newest included
+        int   depth: Index of the coarsest rollup level used (-1 for the samples) """
+
+        if start >= end:
+            return 0, 0.0, None, None
+
+        if depth < 0:
+            values = self.samples.between(start, end)['hr']
+            if len(values) == 0:
+                return 0, 0.0, None, None
+            return len(values), float(values.sum()), int(values.min()), int(values.max())
+
+        level = self.levels[depth]
+        resolution = level.resolution
+        first = -(-start // resolution) * resolution
+        last = (end // resolution) * resolution
+
+        # Times older than what every finer source keeps are only known by the buckets of this level,
+        # and buckets this level dropped by the finer sources, which may keep more (e.g. many samples)
+        if not self.finer_covers(start, depth):
+            first = (start // resolution) * resolution
+        if not self.finer_covers(last, depth):
+            last = -(-end // resolution) * resolution
+        if not level.covers(first):
+            first = level.first_time()
+        if first >= last:
+            return self.combine(start, end, depth - 1)
+
+        parts = [self.combine(start, first, depth - 1), self.combine(last, end, depth - 1)]
+        buckets = level.between(first, last)
+        if len(buckets):
+            parts.append((int(buckets['count'].sum()), float(buckets['sum'].sum()),
+                          int(buckets['min'].min()), int(buckets['max'].max())))
+
+        count = sum(part[0] for part in parts)
+        total = sum(part[1] for part in parts)
+        lows = [part[2] for part in parts if part[2] is not None]
+        highs = [part[3] for part in parts if part[3] is not None]
+        return count, total, min(lows) if lows else None, max(highs) if highs else None
+
+    def finer_covers(self, timestamp, depth):
+
+        """ Check if the samples or a rollup level finer than a depth keep every record from a time on
+
+        Arguments:
+        float timestamp: Time to check
+        int   depth: Index of the rollup level """
+
+        return self.samples.covers(timestamp) or any(level.covers(timestamp) for level in self.levels[:depth])
+
+    def downsample(self, start, end, points):
+
+        """ Read a range with at most about points values, from the finest data that fits
+            and still covers the whole range
+            Returns the times, minimum, mean and maximum of every point
+
+        Arguments:
+        float start: Oldest time included
+        float end: Time after the newest included
+        int   points: Maximum number of points """
+
+        with self.lock:
+            first, last = self.samples.locate(start), self.samples.locate(end)
+            if last - first <= points and self.samples.covers(start):
+                values = self.samples.read(first, last)
+                hr = values['hr'].astype(np.float64)
+                return values['time'], hr, hr, hr
+
+            # Finest level that fits and still keeps the start of the range, else the coarsest one
+            covering = [level for level in self.levels if level.covers(start)] or self.levels[-1:]
+            fitting = [level for level in covering if (end - start) / level.resolution <= points]
+            buckets = (fitting or covering[-1:])[0].between(start, end)
+
+        return buckets['time'], buckets['min'].astype(np.float64), buckets['sum'] / buckets['count'], \
+               buckets['max'].astype(np.float64)
+
+def get_store(mac_address, capacity=3600):
+
+    """ Return the time series store of a band, creating it on first use
+        The same store is returned after a reconnect
+
+    Arguments:
+    str   mac_address: MAC address of the band
+    int   capacity: Number of samples kept """
+
+    if mac_address not in stores:
+        stores[mac_address] = TimeSeriesStore(capacity)
+    return stores[mac_address]